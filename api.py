@@ -0,0 +1,318 @@
+"""
+Headless JSON scoring service for the SOFA, KDIGO and time interval calculators.
+
+Uses only the standard library: a threaded HTTP/1.1 server with keep-alive,
+pre-forked into several worker processes that share one listening socket.
+The handlers call the same functions as the Streamlit tabs.
+
+Every endpoint takes a single JSON object, or a JSON array of objects as a
+batch (batches of SOFA scores and intervals are computed vectorized):
+
+    POST /v1/sofa      {"pao2_fio2": 180, "resp_support": 1, "platelets": 90, ...}
+    POST /v1/kdigo     {"curr_creat": 2.1, "base_creat": 1.0, "prev_creat_48h": 1.6,
+                        "u_vol": 300, "weight": 70, "duration_hrs": 12}
+    POST /v1/interval  {"start": "2024-03-09T20:00", "end": "2024-03-10T08:00", "tz": "America/New_York"}
+    GET  /health
+    GET  /metrics      Prometheus-format request timings of the worker that answers
+
+    python api.py serve --port 8000 --workers 4
+    python api.py loadtest --url http://127.0.0.1:8000 --endpoint sofa --batch-size 100
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import signal
+import time
+import traceback
+import urllib.parse
+import zoneinfo
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import intervals
+import kdigo
+import sofa
+import timing
+
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class RequestError(Exception):
+    pass
+
+
+def _required(item, *names):
+    missing = [name for name in names if item.get(name) is None]
+    if missing:
+        raise RequestError(f"missing field(s): {', '.join(missing)}")
+    try:
+        return [float(item[name]) for name in names]
+    except (TypeError, ValueError):
+        raise RequestError(f"non-numeric value in: {', '.join(names)}")
+
+
+def score_sofa(items):
+    try:
+        scores = sofa.score_batch(sofa.rows_to_columns(items))
+    except (TypeError, ValueError):
+        raise RequestError("SOFA values must be numeric")
+    return [
+        dict({organ: int(scores[organ][i]) for organ in sofa.ORGANS}, total=int(scores["total"][i]), mortality=str(scores["mortality"][i]))
+        for i in range(len(items))
+    ]
+
+
+def score_kdigo(items):
+    results = []
+    for item in items:
+        curr, base, prev, u_vol, weight, duration = _required(
+            item, "curr_creat", "base_creat", "prev_creat_48h", "u_vol", "weight", "duration_hrs"
+        )
+        if weight <= 0 or duration <= 0:
+            raise RequestError("weight and duration_hrs must be positive")
+        results.append(kdigo.evaluate_criteria(curr, base, prev, u_vol, weight, duration))
+    return results
+
+
+def _interval_result(total_seconds):
+    if total_seconds != total_seconds:
+        return {"error": "invalid or DST-ambiguous timestamp"}
+    if total_seconds < 0:
+        return {"error": "end time must be after the start time", "total_seconds": total_seconds}
+    days, hours, minutes, seconds = intervals.breakdown(total_seconds)
+    return {"total_seconds": total_seconds, "days": days, "hours": hours, "minutes": minutes, "seconds": seconds}
+
+
+def _check_tz(tz):
+    if not tz:
+        return
+    try:
+        zoneinfo.ZoneInfo(tz)
+    except (TypeError, ValueError, zoneinfo.ZoneInfoNotFoundError):
+        raise RequestError(f"unknown time zone: {tz}")
+
+
+def score_interval(items):
+    for item in items:
+        if not item.get("start") or not item.get("end"):
+            raise RequestError("missing field(s): start, end")
+        _check_tz(item.get("tz"))
+
+    # Vectorized per time zone; a single item takes the same path, so it gets the same answer as in a batch
+    results = [None] * len(items)
+    by_tz = {}
+    for i, item in enumerate(items):
+        by_tz.setdefault(item.get("tz"), []).append(i)
+    for tz, indices in by_tz.items():
+        try:
+            batch = intervals.compute_batch([items[i]["start"] for i in indices], [items[i]["end"] for i in indices], tz)
+        except ValueError as e:
+            raise RequestError(f"start and end must be ISO timestamps ({e})")
+        for i, total in zip(indices, batch["total_seconds"].tolist()):
+            results[i] = _interval_result(total)
+    return results
+
+
+ROUTES = {
+    "/v1/sofa": score_sofa,
+    "/v1/kdigo": score_kdigo,
+    "/v1/interval": score_interval,
+}
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    server_version = "ScoringAPI/1.0"
+    # Headers and body go out as separate writes; without TCP_NODELAY every
+    # keep-alive response stalls ~40 ms on Nagle + delayed ACK
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/metrics":
+            body = timing.prometheus_text("scoring_api").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        handler = ROUTES.get(urllib.parse.urlsplit(self.path).path)
+        length = (self.headers.get("Content-Length") or "0").strip()
+        if not (length.isascii() and length.isdigit()):
+            # The body's extent is unknown, so the connection cannot be reused either
+            self.close_connection = True
+            self._send_json(400, {"error": "invalid Content-Length"})
+            return
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_json(413, {"error": "request body too large"})
+            return
+        body = self.rfile.read(length)
+        if handler is None:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        is_batch = isinstance(payload, list)
+        items = payload if is_batch else [payload]
+        if not all(isinstance(item, dict) for item in items):
+            self._send_json(400, {"error": "expected a JSON object or an array of objects"})
+            return
+
+        try:
+            with timing.span("api", endpoint=handler.__name__):
+                results = handler(items) if items else []
+        except RequestError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception:
+            # Answer instead of dropping the connection; the details go to the server log
+            traceback.print_exc()
+            self._send_json(500, {"error": "internal error"})
+            return
+        self._send_json(200, results if is_batch else results[0])
+
+    def log_message(self, format, *args):
+        # Per-request access logging would dominate the cost of a score
+        pass
+
+
+def serve(host="127.0.0.1", port=8000, workers=1):
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.daemon_threads = True
+    print(f"Scoring API listening on http://{host}:{server.server_port} with {workers} worker(s)")
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    # Pre-fork: every worker accepts connections on the socket bound above
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+    finally:
+        server.server_close()
+
+
+def _synthetic_item(endpoint):
+    if endpoint == "sofa":
+        return {
+            "pao2_fio2": random.uniform(60, 500), "resp_support": random.random() < 0.5,
+            "platelets": random.uniform(5, 400), "bilirubin": random.uniform(0.2, 15),
+            "map": random.uniform(40, 110), "norepinephrine": random.choice([0, 0, 0.05, 0.2]),
+            "gcs": random.randint(3, 15), "creatinine": random.uniform(0.4, 6), "urine_output": random.uniform(0, 3000),
+        }
+    if endpoint == "kdigo":
+        return {
+            "curr_creat": random.uniform(0.5, 4), "base_creat": random.uniform(0.5, 1.5), "prev_creat_48h": random.uniform(0.5, 3),
+            "u_vol": random.uniform(0, 1500), "weight": random.uniform(40, 120), "duration_hrs": random.choice([6, 12, 24]),
+        }
+    start = datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=random.randint(0, 500000))
+    end = start + datetime.timedelta(minutes=random.randint(0, 20000))
+    return {"start": start.isoformat(), "end": end.isoformat(), "tz": "America/New_York"}
+
+
+def _load_worker(url, endpoint, requests, batch_size):
+    # One keep-alive connection per client process
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80)
+    path = f"/v1/{endpoint}"
+    bodies = []
+    for _ in range(min(requests, 50)):
+        items = [_synthetic_item(endpoint) for _ in range(batch_size)]
+        bodies.append(json.dumps(items if batch_size > 1 else items[0]).encode("utf-8"))
+
+    latencies = []
+    errors = 0
+    for i in range(requests):
+        started = time.perf_counter()
+        conn.request("POST", path, body=bodies[i % len(bodies)], headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        errors += response.status != 200
+    conn.close()
+    return latencies, errors
+
+
+def loadtest(url, endpoint="sofa", connections=8, requests=20000, batch_size=1):
+    per_client = max(1, requests // connections)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=connections) as pool:
+        results = list(pool.map(_load_worker, [url] * connections, [endpoint] * connections, [per_client] * connections, [batch_size] * connections))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for client, _ in results for latency in client)
+    errors = sum(e for _, e in results)
+    pct = lambda p: timing.percentile(latencies, p) * 1000
+    print(f"{len(latencies):,} requests ({len(latencies) * batch_size:,} {endpoint} scores) in {elapsed:.2f}s, {errors} error(s)")
+    print(f"{len(latencies) / elapsed:,.0f} req/s · {len(latencies) * batch_size / elapsed:,.0f} scores/s")
+    print(f"latency p50 {pct(50):.2f} ms · p95 {pct(95):.2f} ms · p99 {pct(99):.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = sub.add_parser("serve", help="run the scoring service")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+    load_parser = sub.add_parser("loadtest", help="drive a running service with synthetic requests")
+    load_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    load_parser.add_argument("--endpoint", choices=["sofa", "kdigo", "interval"], default="sofa")
+    load_parser.add_argument("--connections", type=int, default=8)
+    load_parser.add_argument("--requests", type=int, default=20000)
+    load_parser.add_argument("--batch-size", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers)
+    else:
+        loadtest(args.url, args.endpoint, args.connections, args.requests, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
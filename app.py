@@ -1,7 +1,29 @@
 import streamlit as st
 import datetime
 import calendar
+import functools
+import hashlib
+import html
+import json
 import os
+import time
+import uuid
+import zoneinfo
+
+import batch_extract
+import doc_jobs
+import doc_search
+import drug_lexicon
+import extractor
+import gemini_cache
+import intervals
+import kdigo
+import micro_batch
+import result_log
+import sofa
+import sofa_tracker
+import timing
+import upload_store
 
 st.set_page_config(
     page_title="SOFA Score Calculator",
@@ -10,515 +32,1289 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-def main():
-    # Custom CSS to wrap segmented control items so they fit the container width
-    st.markdown("""
-        <style>
-        /* Target the internal container of the segmented control to wrap its items */
-        div[data-testid="stSegmentedControl"] > div {
-            flex-wrap: wrap;
-            gap: 10px;
-        }
-        
-        /* Make the container full width */
-        div[data-testid="stSegmentedControl"] {
-            width: 100%;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+# SOFA options and their corresponding point values
+RESPIRATION_OPTIONS = {
+    "≥ 400 (0 pts)": 0,
+    "< 400 (1 pt)": 1,
+    "< 300 (2 pts)": 2,
+    "< 200 with respiratory support (3 pts)": 3,
+    "< 100 with respiratory support (4 pts)": 4
+}
 
-    st.title("⚕️ Medical Calculator & Tools")
-    
-    # Check for API key in secrets, otherwise ask in sidebar
+COAGULATION_OPTIONS = {
+    "≥ 150 (0 pts)": 0,
+    "< 150 (1 pt)": 1,
+    "< 100 (2 pts)": 2,
+    "< 50 (3 pts)": 3,
+    "< 20 (4 pts)": 4
+}
+
+LIVER_OPTIONS = {
+    "< 1.2 [< 20] (0 pts)": 0,
+    "1.2–1.9 [20-32] (1 pt)": 1,
+    "2.0–5.9 [33-101] (2 pts)": 2,
+    "6.0–11.9 [102-204] (3 pts)": 3,
+    "≥ 12.0 [> 204] (4 pts)": 4
+}
+
+CARDIOVASCULAR_OPTIONS = {
+    "MAP ≥ 70 mmHg (0 pts)": 0,
+    "MAP < 70 mmHg (1 pt)": 1,
+    "Dopamine < 5 or dobutamine (any dose) (2 pts)": 2,
+    "Dopamine 5.1–15 or epinephrine ≤ 0.1 or norepinephrine ≤ 0.1 (3 pts)": 3,
+    "Dopamine > 15 or epinephrine > 0.1 or norepinephrine > 0.1 (4 pts)": 4
+}
+
+CNS_OPTIONS = {
+    "15 (0 pts)": 0,
+    "13–14 (1 pt)": 1,
+    "10–12 (2 pts)": 2,
+    "6–9 (3 pts)": 3,
+    "< 6 (4 pts)": 4
+}
+
+RENAL_OPTIONS = {
+    "< 1.2 [< 110] (0 pts)": 0,
+    "1.2–1.9 [110-170] (1 pt)": 1,
+    "2.0–3.4 [171-299] (2 pts)": 2,
+    "3.5–4.9 [300-440] or UOP < 500 mL/day (3 pts)": 3,
+    "≥ 5.0 [> 440] or UOP < 200 mL/day (4 pts)": 4
+}
+
+# Date and time toggle options
+MONTH_OPTIONS = [calendar.month_abbr[i] for i in range(1, 13)]
+MONTH_NUMBERS = {calendar.month_abbr[i]: i for i in range(1, 13)}
+HOUR_OPTIONS = [str(i).zfill(2) for i in range(24)]
+MINUTE_OPTIONS = [str(i).zfill(2) for i in range(0, 60, 5)] # 5-minute increments
+DAY_OPTIONS = {n: [str(i).zfill(2) for i in range(1, n + 1)] for n in range(28, 32)}
+TIMEZONE_OPTIONS = sorted(zoneinfo.available_timezones())
+
+# Custom CSS to wrap segmented control items so they fit the container width
+CUSTOM_CSS = """
+    <style>
+    /* Target the internal container of the segmented control to wrap its items */
+    div[data-testid="stSegmentedControl"] > div {
+        flex-wrap: wrap;
+        gap: 10px;
+    }
+
+    /* Make the container full width */
+    div[data-testid="stSegmentedControl"] {
+        width: 100%;
+    }
+    </style>
+"""
+
+@functools.lru_cache(maxsize=None)
+def days_in_month(year, month):
+    return calendar.monthrange(year, month)[1]
+
+@st.cache_resource
+def get_gemini_model(api_key):
+    return extractor.make_model(api_key=api_key)
+
+@st.cache_resource
+def get_response_cache():
+    return gemini_cache.ResponseCache()
+
+@st.cache_resource
+def get_drug_matcher(lexicon_csv=None):
+    # Compiled once per lexicon and shared across reruns and sessions
+    if lexicon_csv:
+        return drug_lexicon.DrugMatcher.from_csv(lexicon_csv)
+    return drug_lexicon.DrugMatcher.from_csv()
+
+RESULT_LOG_PATH = os.environ.get("RESULT_LOG_PATH", result_log.DEFAULT_PATH)
+# Prometheus scrape port for this server process's timing spans; unset disables it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+@st.cache_resource
+def get_metrics_server(port):
+    return timing.serve(port, host=os.environ.get("METRICS_HOST", "127.0.0.1"))
+
+@st.cache_resource
+def get_result_log():
+    # One writer thread for every session; results are committed in batches
+    return result_log.ResultLog(RESULT_LOG_PATH)
+
+def current_patient():
+    return st.session_state.get("patient_id", "").strip(), st.session_state.get("encounter_id", "").strip()
+
+# How long a save waits for its own rows to be committed, so the history shown next includes them
+SAVE_WAIT_SECONDS = 5.0
+
+def save_failed(written):
+    # Shows why a save did not go through; the button stays so it can be retried
+    if not written.wait(SAVE_WAIT_SECONDS):
+        st.error("The result log did not confirm the save in time, so it may not have been recorded. Try again.")
+        return True
+    if written.error:
+        st.error(f"Not saved: {written.error}")
+        return True
+    return False
+
+def render_save_result(kind, inputs, outputs, summary):
+    """Save button for a calculator result; nothing is logged until it is clicked for a patient or encounter."""
+    patient_id, encounter_id = current_patient()
+    if not (patient_id or encounter_id):
+        return
+    fingerprint = result_log.to_json([patient_id, encounter_id, inputs])
+    state_key = f"saved_result_{kind}"
+    if st.session_state.get(state_key) == fingerprint:
+        st.caption(f"✅ Saved to the history of {patient_id or encounter_id}.")
+        return
+    if st.button("💾 Save result", key=f"save_result_{kind}", help="Add this result to the patient's history."):
+        written = get_result_log().record(kind, inputs, outputs, summary, patient_id=patient_id, encounter_id=encounter_id)
+        if save_failed(written):
+            return
+        st.session_state[state_key] = fingerprint
+        st.caption(f"✅ Saved to the history of {patient_id or encounter_id}.")
+
+def render_save_batch(kind, key, make_entries):
+    """Save button for a batch section's results; rows without a patient or encounter ID are left out."""
+    state_key = f"saved_batch_{kind}"
+    if st.session_state.get(state_key) == key:
+        st.caption("✅ These results are saved to the patient histories.")
+        return
+    if not st.button("💾 Save results to history", key=f"save_batch_{kind}"):
+        return
+    entries = make_entries()
+    with_id = [e for e in entries if e["patient_id"] or e["encounter_id"]]
+    if not with_id:
+        st.warning("No row has a patient or encounter ID (patient_id / encounter_id column or the sidebar), so nothing was saved.")
+        return
+    if save_failed(get_result_log().record_many(with_id)):
+        return
+    st.session_state[state_key] = key
+    skipped = len(entries) - len(with_id)
+    st.caption(f"✅ Saved {len(with_id):,} result(s)" + (f"; {skipped:,} row(s) without an ID were left out." if skipped else "."))
+
+def batch_entry(kind, row, inputs, outputs, source):
+    # Per-row IDs come from patient_id/encounter_id columns, falling back to the sidebar
+    patient_id, encounter_id = current_patient()
+    return dict(
+        kind=kind, inputs=inputs, outputs=outputs, source=source,
+        patient_id=result_log.clean_id(row.get("patient_id", patient_id)),
+        encounter_id=result_log.clean_id(row.get("encounter_id", encounter_id)),
+    )
+
+# Upload storage limits, overridable from the environment on a shared server
+UPLOAD_BASE_DIR = os.environ.get("UPLOAD_BASE_DIR", "uploads")
+UPLOAD_QUOTA_BYTES = int(float(os.environ.get("UPLOAD_QUOTA_MB", "200")) * 1024 * 1024)
+UPLOAD_TTL_SECONDS = float(os.environ.get("UPLOAD_TTL_HOURS", "72")) * 3600
+UPLOAD_MAX_TOTAL_BYTES = int(float(os.environ.get("UPLOAD_MAX_TOTAL_MB", "5120")) * 1024 * 1024)
+UPLOAD_SWEEP_SECONDS = 600
+# Stores, job queues and search indexes kept open at once, one of each per active namespace
+UPLOAD_CACHED_NAMESPACES = int(os.environ.get("UPLOAD_CACHED_NAMESPACES", "100"))
+UPLOAD_CACHE_TTL_SECONDS = 3600
+# "gzip", "zstd" (needs the zstandard package) or "none"; zstd when installed, else gzip
+UPLOAD_CODEC = os.environ.get("UPLOAD_CODEC", upload_store.default_codec())
+
+def current_namespace():
+    # Signed-in users keep their documents across sessions; anonymous sessions get their own space
     try:
-        api_key = st.secrets["GEMINI_API_KEY"]
+        if st.user.is_logged_in and st.user.get("email"):
+            return "user-" + hashlib.sha256(st.user["email"].lower().encode("utf-8")).hexdigest()[:16]
     except Exception:
-        api_key = ""
-        
-    with st.sidebar:
-        st.header("⚙️ Settings")
-        if not api_key:
-            api_key = st.text_input("Gemini API Key", type="password", help="Enter your Google Gemini API Key to enable AI features (e.g., drug extraction).")
-            if not api_key:
-                st.warning("Please enter your Gemini API Key to use AI features.")
-        else:
-            st.success("API Key loaded from secrets.")
-            
-    if api_key:
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-        except ImportError:
-            st.sidebar.error("Please install google-generativeai to use AI features.")
-    
-    # Create Layout Tabs
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["sofa scale calculator", "KDIGO AKI calculation", "show only drug extractor", "time interval", "Upload Documents"])
-    
-    with tab1:
-        st.header("Sequential Organ Failure Assessment (SOFA) Score")
-        st.markdown("""
-        The SOFA score is a mortality prediction score that is based on the degree of dysfunction of 6 organ systems.
-        Select the appropriate criteria for each organ system below.
-        """)
-        st.divider()
+        pass
+    return "session-" + st.session_state.setdefault("upload_namespace", uuid.uuid4().hex)
 
-        # Define the options and their corresponding point values
-        respiration_options = {
-            "≥ 400 (0 pts)": 0,
-            "< 400 (1 pt)": 1,
-            "< 300 (2 pts)": 2,
-            "< 200 with respiratory support (3 pts)": 3,
-            "< 100 with respiratory support (4 pts)": 4
-        }
+@st.cache_resource(max_entries=UPLOAD_CACHED_NAMESPACES, ttl=UPLOAD_CACHE_TTL_SECONDS)
+def get_upload_store(upload_dir):
+    codec = None if UPLOAD_CODEC == "none" else UPLOAD_CODEC
+    return upload_store.UploadStore(upload_dir, quota_bytes=UPLOAD_QUOTA_BYTES, codec=codec)
 
-        coagulation_options = {
-            "≥ 150 (0 pts)": 0,
-            "< 150 (1 pt)": 1,
-            "< 100 (2 pts)": 2,
-            "< 50 (3 pts)": 3,
-            "< 20 (4 pts)": 4
-        }
+@st.cache_resource
+def get_job_pool():
+    return doc_jobs.make_pool()
 
-        liver_options = {
-            "< 1.2 [< 20] (0 pts)": 0,
-            "1.2–1.9 [20-32] (1 pt)": 1,
-            "2.0–5.9 [33-101] (2 pts)": 2,
-            "6.0–11.9 [102-204] (3 pts)": 3,
-            "≥ 12.0 [> 204] (4 pts)": 4
-        }
+@st.cache_resource(max_entries=UPLOAD_CACHED_NAMESPACES, ttl=UPLOAD_CACHE_TTL_SECONDS)
+def get_job_queue(upload_dir):
+    return doc_jobs.JobQueue(get_upload_store(upload_dir), pool=get_job_pool())
 
-        cardiovascular_options = {
-            "MAP ≥ 70 mmHg (0 pts)": 0,
-            "MAP < 70 mmHg (1 pt)": 1,
-            "Dopamine < 5 or dobutamine (any dose) (2 pts)": 2,
-            "Dopamine 5.1–15 or epinephrine ≤ 0.1 or norepinephrine ≤ 0.1 (3 pts)": 3,
-            "Dopamine > 15 or epinephrine > 0.1 or norepinephrine > 0.1 (4 pts)": 4
-        }
+JOB_ICONS = {"queued": "🕒", "running": "⏳", "done": "✅", "failed": "❌"}
 
-        cns_options = {
-            "15 (0 pts)": 0,
-            "13–14 (1 pt)": 1,
-            "10–12 (2 pts)": 2,
-            "6–9 (3 pts)": 3,
-            "< 6 (4 pts)": 4
-        }
+@st.cache_resource(max_entries=UPLOAD_CACHED_NAMESPACES, ttl=UPLOAD_CACHE_TTL_SECONDS)
+def get_search_index(upload_dir):
+    index = doc_search.SearchIndex(upload_dir)
+    # Catch up with documents saved or deleted while the index was not being maintained
+    index.sync(get_upload_store(upload_dir))
+    return index
 
-        renal_options = {
-            "< 1.2 [< 110] (0 pts)": 0,
-            "1.2–1.9 [110-170] (1 pt)": 1,
-            "2.0–3.4 [171-299] (2 pts)": 2,
-            "3.5–4.9 [300-440] or UOP < 500 mL/day (3 pts)": 3,
-            "≥ 5.0 [> 440] or UOP < 200 mL/day (4 pts)": 4
-        }
+def forget_evicted(root, names):
+    # Keep the namespace's search index and job history in step with the sweeper
+    index = doc_search.SearchIndex(root)
+    for name in names:
+        index.remove(name)
+    doc_jobs.forget(os.path.join(root, doc_jobs.JOBS_FILE), names)
 
-        # UI Layout using columns
-        col1, col2 = st.columns(2)
-
-        with col1:
-            st.subheader("🫁 Respiration")
-            st.markdown("**PaO2/FiO2 ratio, mmHg**")
-            resp_selection = st.segmented_control("Respiration", list(respiration_options.keys()), default="≥ 400 (0 pts)", label_visibility="collapsed")
-            resp_score = respiration_options.get(resp_selection, 0)
-
-            st.subheader("🩸 Coagulation")
-            st.markdown("**Platelets, ×10³/µL**")
-            coag_selection = st.segmented_control("Coagulation", list(coagulation_options.keys()), default="≥ 150 (0 pts)", label_visibility="collapsed")
-            coag_score = coagulation_options.get(coag_selection, 0)
-
-            st.subheader("🧠 Central Nervous System")
-            st.markdown("**Glasgow Coma Scale (GCS)**")
-            cns_selection = st.segmented_control("CNS", list(cns_options.keys()), default="15 (0 pts)", label_visibility="collapsed")
-            cns_score = cns_options.get(cns_selection, 0)
-
-        with col2:
-            st.subheader("🧪 Liver")
-            st.markdown("**Bilirubin, mg/dL [μmol/L]**")
-            liver_selection = st.segmented_control("Liver", list(liver_options.keys()), default="< 1.2 [< 20] (0 pts)", label_visibility="collapsed")
-            liver_score = liver_options.get(liver_selection, 0)
-
-            st.subheader("❤️ Cardiovascular")
-            st.markdown("**Hypotension / Vasopressor Support** *(doses in µg/kg/min)*")
-            cardio_selection = st.segmented_control("Cardiovascular", list(cardiovascular_options.keys()), default="MAP ≥ 70 mmHg (0 pts)", label_visibility="collapsed")
-            cardio_score = cardiovascular_options.get(cardio_selection, 0)
-
-            st.subheader("💧 Renal")
-            st.markdown("**Creatinine, mg/dL [μmol/L] (or urine output)**")
-            renal_selection = st.segmented_control("Renal", list(renal_options.keys()), default="< 1.2 [< 110] (0 pts)", label_visibility="collapsed")
-            renal_score = renal_options.get(renal_selection, 0)
+@st.cache_resource
+def get_upload_sweeper():
+    sweeper = upload_store.Sweeper(
+        UPLOAD_BASE_DIR, ttl_seconds=UPLOAD_TTL_SECONDS, max_total_bytes=UPLOAD_MAX_TOTAL_BYTES,
+        interval=UPLOAD_SWEEP_SECONDS, on_evict=forget_evicted,
+    )
+    sweeper.start()
+    return sweeper
 
-        st.divider()
+def get_namespace_resources(upload_dir):
+    # The sweeper removes abandoned session namespaces; start afresh if ours went with them
+    if not os.path.isdir(upload_dir):
+        for resource in (get_upload_store, get_job_queue, get_search_index):
+            resource.clear(upload_dir)
+    return get_upload_store(upload_dir), get_job_queue(upload_dir), get_search_index(upload_dir)
 
-        # Calculate Total Score
-        total_score = resp_score + coag_score + liver_score + cardio_score + cns_score + renal_score
+def delete_document(store, queue, index, name):
+    store.delete(name)
+    queue.forget(name)
+    index.remove(name)
 
-        # Layout for Total Score and Mortality
-        score_col, empty_col = st.columns([1, 2])
-        
-        with score_col:
-            st.metric(label="Total SOFA Score", value=total_score)
-            
-        # Simple Mortality estimate mapping
-        mortality = ""
-        if total_score <= 1:
-            mortality = "0.0%"
-        elif total_score <= 3:
-            mortality = "6.4%"
-        elif total_score <= 5:
-            mortality = "20.2%"
-        elif total_score <= 7:
-            mortality = "21.5%"
-        elif total_score <= 9:
-            mortality = "33.3%"
-        elif total_score <= 11:
-            mortality = "50.0%"
-        elif total_score <= 14:
-            mortality = "95.2%"
-        else:
-            mortality = ">95.2%"
+DOCUMENT_SORTS = {"Name": "name", "Date modified": "modified", "Size": "size", "Type": "mime"}
 
-        st.info(f"**Predicted Mortality:** ~{mortality}")
-        st.caption("Mortality estimates are generalizations from historical critical care cohorts and vary widely based on patient condition.")
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:,.0f} {unit}" if unit == "B" else f"{n:,.1f} {unit}"
+        n /= 1024
 
-        st.divider()
+def render_cache_stats():
+    stats = get_response_cache().stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups if lookups else 0.0
 
-        st.subheader("📋 Output Summary")
-        
-        # Format the summary text
-        summary_text = (
-            "SOFA SCORE\n"
-            f"PaO2/FIO2 - {resp_score}\n"
-            f"Platelet count - {coag_score}\n"
-            f"Bilirubin (mg/dL) - {liver_score}\n"
-            f"MAP (mmHg) or vasopressor - {cardio_score}\n"
-            f"Glasgow Coma Scale Score - {cns_score}\n"
-            f"Creatinine (mg/dl)- {renal_score}\n"
-            f"Total - {total_score}"
+    st.divider()
+    st.subheader("⚡ AI Response Cache")
+    c1, c2 = st.columns(2)
+    c1.metric("Hits", f"{stats['hits']:,}")
+    c2.metric("Misses", f"{stats['misses']:,}")
+    st.caption(f"Hit rate {hit_rate:.0%} · {stats['entries']:,} entries · {stats['bytes'] / 1024:,.1f} KiB")
+    if st.button("Clear cache", key="clear_response_cache"):
+        get_response_cache().clear()
+        st.rerun()
+
+# Server folders the batch extractor may read notes from; unset hides the folder input
+BATCH_NOTES_ROOT = os.environ.get("BATCH_NOTES_ROOT", "")
+
+def resolve_notes_folder(folder):
+    """Absolute path of `folder` (relative to BATCH_NOTES_ROOT), or None if it points outside the root."""
+    root = os.path.realpath(BATCH_NOTES_ROOT)
+    path = os.path.realpath(os.path.join(root, folder))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+def render_extract_batch(api_key, prefilter=None):
+    st.subheader("📚 Batch Extraction")
+    st.markdown(
+        "Run the extractor over many notes at once. Upload text files (one note per file) or CSV files with a "
+        "`text` column (one note per row)" + (", or point to a folder of notes on the server." if BATCH_NOTES_ROOT else ".")
+    )
+
+    note_files = st.file_uploader("Note files", type=["txt", "md", "csv"], accept_multiple_files=True, key="batch_note_files")
+    folder = ""
+    if BATCH_NOTES_ROOT:
+        folder = st.text_input("Or server folder", key="batch_note_folder", help=f"Relative to `{BATCH_NOTES_ROOT}` on the server.")
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        concurrency = st.number_input("Concurrent requests", min_value=1, max_value=64, value=8, step=1)
+    with c2:
+        rate = st.number_input("Rate limit (requests/s)", min_value=0.1, value=5.0, step=0.5)
+    with c3:
+        use_stub = st.checkbox("Use offline stub model", help="Benchmark the pipeline locally without calling Gemini.")
+        coalesce = st.checkbox(
+            "Pack short notes into shared calls", value=False, key="batch_coalesce",
+            help=f"Notes up to {micro_batch.SHORT_NOTE_CHARS:,} characters from this run are sent several per request, "
+                 "with one id per note. Saves calls and prompt tokens, but those notes are not streamed."
         )
 
-        st.markdown("Use the copy button in the top right of the text block below to copy your results:")
-        # st.code provides an automatic "copy to clipboard" button on hover
-        st.code(summary_text, language="text")
+    if not st.button("Run Batch Extraction", key="run_batch_extraction"):
+        return
 
-    with tab2:
-        st.header("Kidney Disease: Improving Global Outcomes (KDIGO) AKI")
-        st.markdown("""
-        The KDIGO 2012 guidelines define Acute Kidney Injury (AKI) based on serum creatinine changes and urine output.
-        """)
-        st.divider()
+    documents = []
+    for note_file in note_files or []:
+        documents.extend(batch_extract.read_notes(note_file.name, note_file.getvalue()))
+    if folder.strip():
+        path = resolve_notes_folder(folder.strip())
+        if path is None:
+            st.error(f"Only folders inside `{BATCH_NOTES_ROOT}` can be read.")
+            return
+        if not os.path.isdir(path):
+            st.error(f"Folder not found: `{folder}`")
+            return
+        documents.extend(batch_extract.read_folder(path))
 
-        col1, col2 = st.columns(2)
+    if not documents:
+        st.warning("Please provide at least one note.")
+        return
+    if not use_stub and not api_key:
+        st.error("Please provide a Gemini API Key in the sidebar, or use the offline stub model.")
+        return
 
-        with col1:
-            st.subheader("🧪 Creatinine Criteria")
-            curr_creat = st.number_input("Current Serum Creatinine (mg/dL)", min_value=0.0, step=0.1, value=1.0, help="Most recent creatinine level")
-            base_creat = st.number_input("Baseline Serum Creatinine (mg/dL)", min_value=0.0, step=0.1, value=1.0, help="Known baseline. If unknown, use the lowest creatinine level attained during admission.")
-            prev_creat_48h = st.number_input("Previous Creatinine (within 48 hrs) (mg/dL)", min_value=0.0, step=0.1, value=1.0, help="For prospective measurement comparison")
+    if use_stub:
+        model, batch_model, cache = batch_extract.StubModel(), None, None
+    else:
+        model, batch_model, cache = get_gemini_model(api_key), extractor.make_model(extractor.BATCH_GENERATION_CONFIG, api_key=api_key), get_response_cache()
+    # One limiter for every model call of the run, whether the batcher or run_batch makes it
+    limiter = batch_extract.TokenBucket(rate)
+    batcher = None
+    if coalesce:
+        batcher = micro_batch.MicroBatcher(
+            batch_model or model, single_model=model, cache=cache,
+            max_workers=int(concurrency), limiter=limiter,
+        )
 
-        with col2:
-            st.subheader("💧 Urine Output Criteria")
-            u_vol = st.number_input("Urine Volume (mL)", min_value=0.0, step=10.0, value=500.0)
-            weight = st.number_input("Patient Weight (kg)", min_value=1.0, step=1.0, value=70.0)
-            duration_hrs = st.number_input("Collection Duration (hours)", min_value=1.0, step=1.0, value=12.0)
+    progress = batch_extract.Progress(len(documents))
+    progress_bar = st.progress(0.0, text=progress.describe())
+    table = st.empty()
+    rows = []
 
-        st.divider()
+    try:
+        for result in batch_extract.run_batch(documents, model, concurrency=int(concurrency), limiter=limiter, cache=cache, prefilter=prefilter, batcher=batcher):
+            progress.update(result)
+            rows.extend(batch_extract.result_rows(result))
+            progress_bar.progress(progress.done / progress.total, text=progress.describe())
+            # Redraw the table in steps so thousands of notes don't mean thousands of redraws
+            if progress.done == progress.total or progress.done % max(1, progress.total // 50) == 0:
+                table.dataframe(rows, use_container_width=True, hide_index=True)
+    finally:
+        if batcher is not None:
+            batcher.close()
 
-        # Calculations
-        crit1_met = False
-        crit1_val = 0.0
-        if base_creat > 0:
-            crit1_val = curr_creat / base_creat
-            if crit1_val >= 1.5:
-                crit1_met = True
-
-        crit2_met = False
-        crit2_diff = curr_creat - prev_creat_48h
-        if crit2_diff >= 0.3:
-            crit2_met = True
-
-        uop_rate = u_vol / weight / duration_hrs
-        crit3_met = False
-        if uop_rate < 0.5:
-            crit3_met = True
-
-        # Results Display
-        st.subheader("📊 Results")
-        
-        c1, c2, c3 = st.columns(3)
-        
-        with c1:
-            st.markdown("**Criterion 1**")
-            st.markdown(f"$\ge 1.5 \\times$ baseline")
-            if crit1_met:
-                st.success(f"MET (Ratio: {crit1_val:.2f})")
-            else:
-                st.info(f"Not Met (Ratio: {crit1_val:.2f})")
+    st.success(f"Processed {progress.total:,} note(s) in {progress.elapsed:,.1f}s ({progress.throughput:,.1f} notes/s).")
+    if progress.skipped:
+        st.warning(
+            f"{progress.skipped:,} note(s) were skipped without an AI call because the lexicon pre-filter found no known drugs in them. "
+            "Drugs outside the lexicon are not detected; untick the pre-filter to send every note to the AI."
+        )
+    if batcher is not None:
+        st.caption(batcher.stats.describe())
 
-        with c2:
-            st.markdown("**Criterion 2**")
-            st.markdown(f"$\ge 0.3$ mg/dL increase (48h)")
-            if crit2_met:
-                st.success(f"MET (Increase: {crit2_diff:.2f})")
-            else:
-                st.info(f"Not Met (Increase: {crit2_diff:.2f})")
+    import pandas as pd
+    st.download_button(
+        label="Download results (CSV)",
+        data=pd.DataFrame(rows, columns=["Document", "Detected Drug", "Related Disease / Indication", "Error"]).to_csv(index=False).encode("utf-8"),
+        file_name="drug_extraction_results.csv",
+        mime="text/csv",
+        key="batch_extraction_download"
+    )
 
-        with c3:
-            st.markdown("**Criterion 3**")
-            st.markdown(f"UOP < 0.5 ml/kg/hr")
-            if crit3_met:
-                st.success(f"MET (Rate: {uop_rate:.3f})")
-            else:
-                st.info(f"Not Met (Rate: {uop_rate:.3f})")
+def read_table(uploaded_file):
+    # Load an uploaded CSV or Parquet file into a DataFrame
+    import pandas as pd
 
-        st.divider()
+    if uploaded_file.name.lower().endswith(".parquet"):
+        return pd.read_parquet(uploaded_file)
+    return pd.read_csv(uploaded_file)
+
+def render_sofa_batch():
+    st.subheader("📁 Batch Scoring")
+    st.markdown(
+        "Upload a CSV or Parquet file of raw values (one row per patient) to score a whole census at once. "
+        "Recognised columns: " + ", ".join(f"`{c}`" for c in sofa.INPUT_COLUMNS) + ". "
+        "Missing columns or blank values score 0 for that organ."
+    )
+
+    batch_file = st.file_uploader("Census file", type=["csv", "parquet"], key="sofa_batch_file")
+    if batch_file is None:
+        return
+
+    try:
+        df = read_table(batch_file)
+    except Exception as e:
+        st.error(f"Could not read {batch_file.name}: {str(e)}")
+        return
+
+    if not any(c in df.columns for c in sofa.INPUT_COLUMNS):
+        st.error("None of the recognised SOFA columns were found in the file.")
+        return
+
+    try:
+        scores = sofa.score_batch(df)
+    except (TypeError, ValueError):
+        st.error("The SOFA columns must contain numbers only (blank cells are allowed).")
+        return
+    scored = df.copy()
+    for organ in sofa.ORGANS:
+        scored[f"sofa_{organ}"] = scores[organ]
+    scored["sofa_total"] = scores["total"]
+    scored["predicted_mortality"] = scores["mortality"]
+
+    input_columns = [c for c in sofa.INPUT_COLUMNS if c in df.columns]
+    output_columns = [f"sofa_{organ}" for organ in sofa.ORGANS] + ["sofa_total", "predicted_mortality"]
+    st.success(f"Scored {len(scored):,} row(s).")
+    st.dataframe(scored.head(1000), use_container_width=True, hide_index=True)
+    if len(scored) > 1000:
+        st.caption("Showing the first 1,000 rows. Download the file for the full results.")
+
+    st.download_button(
+        label="Download scored results (CSV)",
+        data=scored.to_csv(index=False).encode("utf-8"),
+        file_name=os.path.splitext(batch_file.name)[0] + "_sofa.csv",
+        mime="text/csv",
+        key="sofa_batch_download"
+    )
+
+    render_save_batch("sofa", batch_file.file_id, lambda: [
+        batch_entry("sofa", row, {c: row[c] for c in input_columns}, {c: row[c] for c in output_columns}, f"batch:{batch_file.name}")
+        for row in scored.to_dict("records")
+    ])
+
+def render_sofa_serial():
+    st.subheader("📈 Serial SOFA (ΔSOFA) Screening")
+    st.markdown(
+        "Upload a long-format CSV of timestamped measurements to track the rolling 24h SOFA of every patient "
+        "and flag a rise of 2 or more points from baseline. Columns: `patient_id`, `time` (ISO timestamp or hours), "
+        "`variable` (one of " + ", ".join(f"`{c}`" for c in sofa.INPUT_COLUMNS) + ") and `value`. "
+        "Rows must be in time order."
+    )
+
+    feed_file = st.file_uploader("Measurement feed", type=["csv"], key="sofa_serial_file")
+    if feed_file is None:
+        return
+
+    tracker = sofa_tracker.SofaTracker()
+    try:
+        flags = list(tracker.replay(sofa_tracker.iter_csv(feed_file)))
+    except (KeyError, ValueError) as e:
+        st.error(f"Could not process {feed_file.name}: {str(e)}")
+        return
+
+    flagged_now = [pid for pid, state in tracker.patients.items() if state.flagged]
+    st.success(f"Tracked {len(tracker.patients):,} patient(s): {len(flagged_now):,} currently have ΔSOFA ≥ {tracker.threshold}.")
+    if flags:
+        rows = [f._asdict() for f in flags[-1000:]]
+        for row in rows:
+            # ISO timestamps were converted to hours since the epoch; show them as dates again
+            if row["time"] > 24 * 365 * 10:
+                row["time"] = datetime.datetime.fromtimestamp(row["time"] * 3600).strftime("%Y-%m-%d %H:%M")
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        st.caption("Threshold crossings (flagged = True when ΔSOFA rises to the threshold, False when it falls back).")
+
+    render_save_batch("sofa_serial", feed_file.file_id, lambda: [
+        batch_entry("sofa", flag._asdict(), {"time": flag.time}, flag._asdict(), f"serial:{feed_file.name}") for flag in flags
+    ])
+
+def render_kdigo_stream():
+    st.subheader("📈 Time-Series Evaluation")
+    st.markdown(
+        "Upload a CSV of timestamped observations to stage every patient incrementally. "
+        "Columns: `patient_id`, `time` (ISO timestamp or hours), and any of `creatinine` (mg/dL), "
+        "`urine_ml` (volume since the previous urine sample) and `weight` (kg). Rows must be in time order per patient."
+    )
+
+    stream_file = st.file_uploader("Observation file", type=["csv"], key="kdigo_stream_file")
+    if stream_file is None:
+        return
+
+    stream = kdigo.KdigoStream()
+    try:
+        transitions = list(stream.process(kdigo.iter_csv(stream_file)))
+    except (KeyError, ValueError) as e:
+        st.error(f"Could not process {stream_file.name}: {str(e)}")
+        return
+
+    stages = stream.stages()
+    n_aki = sum(1 for stage in stages.values() if stage > 0)
+    st.success(f"Evaluated {len(stages):,} patient(s): {n_aki:,} currently meet KDIGO AKI criteria, {len(transitions):,} stage transition(s).")
+
+    if transitions:
+        rows = [t._asdict() for t in transitions]
+        st.dataframe(rows[:1000], use_container_width=True, hide_index=True)
+
+        import pandas as pd
+        st.download_button(
+            label="Download stage transitions (CSV)",
+            data=pd.DataFrame(rows).to_csv(index=False).encode("utf-8"),
+            file_name=os.path.splitext(stream_file.name)[0] + "_kdigo.csv",
+            mime="text/csv",
+            key="kdigo_stream_download"
+        )
+
+    render_save_batch("kdigo", stream_file.file_id, lambda: [
+        batch_entry("kdigo", t._asdict(), {"time": t.time}, t._asdict(), f"stream:{stream_file.name}") for t in transitions
+    ])
+
+def render_interval_batch():
+    st.subheader("📁 Batch Intervals")
+    st.markdown(
+        "Upload a CSV or Parquet file with start and end timestamp columns to compute intervals "
+        "(e.g. door-to-needle, length of stay) for a whole cohort."
+    )
+
+    batch_file = st.file_uploader("Cohort file", type=["csv", "parquet"], key="interval_batch_file")
+    if batch_file is None:
+        return
+
+    try:
+        df = read_table(batch_file)
+    except Exception as e:
+        st.error(f"Could not read {batch_file.name}: {str(e)}")
+        return
+
+    columns = list(df.columns)
+    if len(columns) < 2:
+        st.error("The file needs at least two columns (start and end timestamps).")
+        return
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        start_col = st.selectbox("Start column", columns, index=None, placeholder="Choose a column", key="interval_start_col")
+    with c2:
+        end_col = st.selectbox("End column", columns, index=None, placeholder="Choose a column", key="interval_end_col")
+    with c3:
+        batch_tz = st.selectbox("Time zone of naive timestamps", ["None (as written)"] + TIMEZONE_OPTIONS, key="interval_batch_tz")
+
+    if start_col is None or end_col is None:
+        st.info("Choose the start and end timestamp columns.")
+        return
+    try:
+        result = intervals.compute_batch(df[start_col], df[end_col], None if batch_tz == "None (as written)" else batch_tz)
+    except ValueError as e:
+        st.error(f"`{start_col}` and `{end_col}` must both be timestamp columns: {e}.")
+        return
+
+    out = df.copy()
+    out["duration_days"] = result["days"]
+    out["duration_hours"] = result["hours"]
+    out["duration_minutes"] = result["minutes"]
+    out["total_hours"] = result["total_hours"]
+    out["negative_interval"] = result["negative"]
+    out["invalid_timestamp"] = result["invalid"]
+
+    result_columns = ["duration_days", "duration_hours", "duration_minutes", "total_hours", "negative_interval", "invalid_timestamp"]
+    n_negative = int(result["negative"].sum())
+    n_invalid = int(result["invalid"].sum())
+    if n_negative:
+        st.error(f"⚠️ {n_negative:,} row(s) have an end time before the start time.")
+    if n_invalid:
+        st.warning(f"{n_invalid:,} row(s) have a missing, unparseable or DST-ambiguous timestamp.")
+
+    summary = intervals.summarize(result["total_seconds"])
+    st.success(f"Computed {summary['count']:,} valid interval(s) out of {len(out):,} row(s).")
+    if summary["count"]:
+        st.markdown("**Summary (minutes)**")
+        st.dataframe([{k: round(v, 1) if isinstance(v, float) else v for k, v in summary.items()}], use_container_width=True, hide_index=True)
+
+    st.dataframe(out.head(1000), use_container_width=True, hide_index=True)
+    st.download_button(
+        label="Download intervals (CSV)",
+        data=out.to_csv(index=False).encode("utf-8"),
+        file_name=os.path.splitext(batch_file.name)[0] + "_intervals.csv",
+        mime="text/csv",
+        key="interval_batch_download"
+    )
+
+    render_save_batch("interval", (batch_file.file_id, start_col, end_col, batch_tz), lambda: [
+        batch_entry("interval", row, {"start": row[start_col], "end": row[end_col], "tz": batch_tz}, {c: row[c] for c in result_columns}, f"batch:{batch_file.name}")
+        for row in out.to_dict("records")
+    ])
+
+@st.fragment
+@timing.timed("tab", tab="sofa")
+def render_sofa_tab():
+    st.header("Sequential Organ Failure Assessment (SOFA) Score")
+    st.markdown("""
+    The SOFA score is a mortality prediction score that is based on the degree of dysfunction of 6 organ systems.
+    Select the appropriate criteria for each organ system below.
+    """)
+    st.divider()
+
+    # UI Layout using columns
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("🫁 Respiration")
+        st.markdown("**PaO2/FiO2 ratio, mmHg**")
+        resp_selection = st.segmented_control("Respiration", list(RESPIRATION_OPTIONS.keys()), default="≥ 400 (0 pts)", label_visibility="collapsed")
+        resp_score = RESPIRATION_OPTIONS.get(resp_selection, 0)
+
+        st.subheader("🩸 Coagulation")
+        st.markdown("**Platelets, ×10³/µL**")
+        coag_selection = st.segmented_control("Coagulation", list(COAGULATION_OPTIONS.keys()), default="≥ 150 (0 pts)", label_visibility="collapsed")
+        coag_score = COAGULATION_OPTIONS.get(coag_selection, 0)
+
+        st.subheader("🧠 Central Nervous System")
+        st.markdown("**Glasgow Coma Scale (GCS)**")
+        cns_selection = st.segmented_control("CNS", list(CNS_OPTIONS.keys()), default="15 (0 pts)", label_visibility="collapsed")
+        cns_score = CNS_OPTIONS.get(cns_selection, 0)
+
+    with col2:
+        st.subheader("🧪 Liver")
+        st.markdown("**Bilirubin, mg/dL [μmol/L]**")
+        liver_selection = st.segmented_control("Liver", list(LIVER_OPTIONS.keys()), default="< 1.2 [< 20] (0 pts)", label_visibility="collapsed")
+        liver_score = LIVER_OPTIONS.get(liver_selection, 0)
+
+        st.subheader("❤️ Cardiovascular")
+        st.markdown("**Hypotension / Vasopressor Support** *(doses in µg/kg/min)*")
+        cardio_selection = st.segmented_control("Cardiovascular", list(CARDIOVASCULAR_OPTIONS.keys()), default="MAP ≥ 70 mmHg (0 pts)", label_visibility="collapsed")
+        cardio_score = CARDIOVASCULAR_OPTIONS.get(cardio_selection, 0)
+
+        st.subheader("💧 Renal")
+        st.markdown("**Creatinine, mg/dL [μmol/L] (or urine output)**")
+        renal_selection = st.segmented_control("Renal", list(RENAL_OPTIONS.keys()), default="< 1.2 [< 110] (0 pts)", label_visibility="collapsed")
+        renal_score = RENAL_OPTIONS.get(renal_selection, 0)
+
+    st.divider()
+
+    # Calculate Total Score
+    organ_scores = {
+        "respiration": resp_score,
+        "coagulation": coag_score,
+        "liver": liver_score,
+        "cardiovascular": cardio_score,
+        "cns": cns_score,
+        "renal": renal_score,
+    }
+    total_score = sum(organ_scores.values())
+
+    # Layout for Total Score and Mortality
+    score_col, empty_col = st.columns([1, 2])
+    
+    with score_col:
+        st.metric(label="Total SOFA Score", value=total_score)
         
-        is_aki = crit1_met or crit2_met or crit3_met
-        if is_aki:
-            st.error("### AKI Criteria MET")
-            st.markdown("The patient meets the KDIGO criteria for Acute Kidney Injury.")
+    # Simple Mortality estimate mapping
+    mortality = sofa.mortality_band(total_score)
+
+    st.info(f"**Predicted Mortality:** ~{mortality}")
+    st.caption("Mortality estimates are generalizations from historical critical care cohorts and vary widely based on patient condition.")
+
+    st.divider()
+
+    st.subheader("📋 Output Summary")
+    
+    # Format the summary text
+    summary_text = sofa.format_summary(organ_scores)
+
+    st.markdown("Use the copy button in the top right of the text block below to copy your results:")
+    # st.code provides an automatic "copy to clipboard" button on hover
+    st.code(summary_text, language="text")
+
+    render_save_result(
+        "sofa",
+        {"respiration": resp_selection, "coagulation": coag_selection, "liver": liver_selection,
+         "cardiovascular": cardio_selection, "cns": cns_selection, "renal": renal_selection},
+        dict(organ_scores, total=total_score, mortality=mortality),
+        summary_text,
+    )
+    render_result_history("sofa")
+
+    st.divider()
+    render_sofa_batch()
+
+    st.divider()
+    render_sofa_serial()
+
+@st.fragment
+@timing.timed("tab", tab="kdigo")
+def render_kdigo_tab():
+    st.header("Kidney Disease: Improving Global Outcomes (KDIGO) AKI")
+    st.markdown("""
+    The KDIGO 2012 guidelines define Acute Kidney Injury (AKI) based on serum creatinine changes and urine output.
+    """)
+    st.divider()
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("🧪 Creatinine Criteria")
+        curr_creat = st.number_input("Current Serum Creatinine (mg/dL)", min_value=0.0, step=0.1, value=1.0, help="Most recent creatinine level")
+        base_creat = st.number_input("Baseline Serum Creatinine (mg/dL)", min_value=0.0, step=0.1, value=1.0, help="Known baseline. If unknown, use the lowest creatinine level attained during admission.")
+        prev_creat_48h = st.number_input("Previous Creatinine (within 48 hrs) (mg/dL)", min_value=0.0, step=0.1, value=1.0, help="For prospective measurement comparison")
+
+    with col2:
+        st.subheader("💧 Urine Output Criteria")
+        u_vol = st.number_input("Urine Volume (mL)", min_value=0.0, step=10.0, value=500.0)
+        weight = st.number_input("Patient Weight (kg)", min_value=1.0, step=1.0, value=70.0)
+        duration_hrs = st.number_input("Collection Duration (hours)", min_value=1.0, step=1.0, value=12.0)
+
+    st.divider()
+
+    # Calculations
+    kdigo_result = kdigo.evaluate_criteria(curr_creat, base_creat, prev_creat_48h, u_vol, weight, duration_hrs)
+    crit1_met, crit1_val = kdigo_result["crit1_met"], kdigo_result["crit1_val"]
+    crit2_met, crit2_diff = kdigo_result["crit2_met"], kdigo_result["crit2_diff"]
+    crit3_met, uop_rate = kdigo_result["crit3_met"], kdigo_result["uop_rate"]
+
+    # Results Display
+    st.subheader("📊 Results")
+    
+    c1, c2, c3 = st.columns(3)
+    
+    with c1:
+        st.markdown("**Criterion 1**")
+        st.markdown(f"$\ge 1.5 \\times$ baseline")
+        if crit1_met:
+            st.success(f"MET (Ratio: {crit1_val:.2f})")
+        else:
+            st.info(f"Not Met (Ratio: {crit1_val:.2f})")
+
+    with c2:
+        st.markdown("**Criterion 2**")
+        st.markdown(f"$\ge 0.3$ mg/dL increase (48h)")
+        if crit2_met:
+            st.success(f"MET (Increase: {crit2_diff:.2f})")
+        else:
+            st.info(f"Not Met (Increase: {crit2_diff:.2f})")
+
+    with c3:
+        st.markdown("**Criterion 3**")
+        st.markdown(f"UOP < 0.5 ml/kg/hr")
+        if crit3_met:
+            st.success(f"MET (Rate: {uop_rate:.3f})")
         else:
-            st.success("### No AKI Criteria Met")
-            st.markdown("The values provided do not meet the KDIGO criteria for Acute Kidney Injury.")
-
-        st.subheader("📋 Output Summary")
-        summary_kdigo = (
-            f"Current Creatinine: {curr_creat} mg/dL\n"
-            f"Baseline Creatinine: {base_creat} mg/dL (Ratio: {crit1_val:.2f})\n"
-            f"Previous Creatinine (48h): {prev_creat_48h} mg/dL (Diff: {crit2_diff:.2f})\n"
-            f"Urine Output: {u_vol} mL over {duration_hrs}h (Rate: {uop_rate:.3f} ml/kg/hr)\n"
-            f"KDIGO AKI Status: {'MET' if is_aki else 'NOT MET'}"
+            st.info(f"Not Met (Rate: {uop_rate:.3f})")
+
+    st.divider()
+    
+    is_aki = kdigo_result["is_aki"]
+    if is_aki:
+        st.error("### AKI Criteria MET")
+        st.markdown("The patient meets the KDIGO criteria for Acute Kidney Injury.")
+    else:
+        st.success("### No AKI Criteria Met")
+        st.markdown("The values provided do not meet the KDIGO criteria for Acute Kidney Injury.")
+
+    st.subheader("📋 Output Summary")
+    summary_kdigo = kdigo.format_summary(curr_creat, base_creat, prev_creat_48h, u_vol, duration_hrs, kdigo_result)
+    st.code(summary_kdigo, language="text")
+
+    render_save_result(
+        "kdigo",
+        {"curr_creat": curr_creat, "base_creat": base_creat, "prev_creat_48h": prev_creat_48h,
+         "u_vol": u_vol, "weight": weight, "duration_hrs": duration_hrs},
+        kdigo_result,
+        summary_kdigo,
+    )
+    render_result_history("kdigo")
+
+    st.divider()
+    render_kdigo_stream()
+
+def render_streamed_extraction(model, user_text):
+    """Stream one extraction, appending each drug to the table as soon as the model completes it."""
+    status = st.empty()
+    table = st.empty()
+    status.caption("Analyzing medical text...")
+    stream = extractor.StreamedExtraction(model, user_text, cache=get_response_cache())
+    rows = []
+    for drug in stream:
+        rows.append(drug)
+        table.dataframe(rows, use_container_width=True, hide_index=True)
+    status.empty()
+
+    if rows and not stream.complete:
+        st.warning("The response was truncated; results recovered from the complete part.")
+    if not rows:
+        try:
+            extractor.parse_results(stream.response_text)
+        except json.JSONDecodeError:
+            st.error("Failed to parse AI response. Please try again.")
+            st.code(stream.response_text)
+            return None
+        st.info("The AI did not detect any medications in the provided text.")
+    else:
+        st.success(f"AI found {len(rows)} drug(s) in the text!")
+
+    if stream.from_cache:
+        st.caption("⚡ Served from the response cache.")
+    else:
+        first_row = f"{stream.first_item_seconds:.2f}s" if stream.first_item_seconds is not None else "–"
+        st.caption(f"Time to first row {first_row} · total {stream.total_seconds:.2f}s")
+    return rows
+
+def render_chunked_extraction(model, user_text):
+    """Long notes are split into overlapping chunks extracted in parallel and merged."""
+    with st.spinner("Analyzing medical text..."):
+        started = time.perf_counter()
+        result = extractor.extract_long(model, user_text, cache=get_response_cache())
+        elapsed = time.perf_counter() - started
+    extracted_results = result.drugs
+
+    if result.cached == result.chunks:
+        st.caption("⚡ Served from the response cache.")
+    st.caption(f"Long text split into {result.chunks} overlapping chunks and extracted in parallel in {elapsed:.2f}s.")
+    if result.truncated:
+        st.warning(f"{result.truncated} response(s) were truncated; results recovered from the complete part.")
+
+    if result.failed and not extracted_results:
+        st.error("Failed to parse AI response. Please try again.")
+        st.code(result.failed[0])
+        return None
+    if result.failed:
+        st.warning(f"{len(result.failed)} of {result.chunks} chunk(s) could not be parsed and were skipped.")
+    if extracted_results:
+        st.success(f"AI found {len(extracted_results)} drug(s) in the text!")
+        st.dataframe(extracted_results, use_container_width=True, hide_index=True)
+    else:
+        st.info("The AI did not detect any medications in the provided text.")
+    return extracted_results
+
+@st.fragment
+@timing.timed("tab", tab="extractor")
+def render_extractor_tab(api_key):
+    st.header("Drug Extractor & Disease Mapper (AI-Powered)")
+    st.markdown("Paste a medical paragraph below to extract drug names and match them to their related diseases using Google Gemini AI.")
+    
+    user_text = st.text_area("Input Medical Text Here:", height=200, placeholder="e.g. The patient presented with hypertension and was started on lisinopril and amlodipine. Given their history of afib, apixaban was continued...")
+    
+    with st.expander("Offline drug lexicon"):
+        lexicon_file = st.file_uploader("Custom lexicon CSV (columns: term, drug, indication)", type=["csv"], key="lexicon_file")
+        skip_without_candidates = st.checkbox(
+            "Skip the AI call when the lexicon finds no known drugs", value=False, key="lexicon_prefilter",
+            help="Saves AI calls on notes without medications, but any drug missing from the lexicon is missed too."
         )
-        st.code(summary_kdigo, language="text")
+    matcher = get_drug_matcher(lexicon_file.getvalue() if lexicon_file else None)
+    st.caption(f"Offline lexicon: {len(matcher):,} terms.")
+    
+    if st.button("Extract Drugs with AI", type="primary"):
+        if not user_text.strip():
+            st.warning("Please enter some text to extract drugs from.")
+        elif not api_key:
+            # No key: answer instantly from the offline lexicon instead
+            st.info("No Gemini API Key configured, showing offline lexicon matches instead.")
+            lexicon_results = matcher.drugs(user_text)
+            if lexicon_results:
+                st.success(f"Lexicon found {len(lexicon_results)} drug(s) in the text!")
+                st.dataframe(lexicon_results, use_container_width=True, hide_index=True)
+            else:
+                st.info("The lexicon did not match any known medications in the provided text.")
+        elif skip_without_candidates and not matcher.has_candidates(user_text):
+            st.warning(
+                f"The AI call was skipped: none of the {len(matcher):,} lexicon terms appear in this note. "
+                "Drugs outside the lexicon are not detected this way, so untick the lexicon pre-filter to force an AI extraction."
+            )
+        else:
+            try:
+                model = get_gemini_model(api_key)
+                if len(extractor.split_text(user_text)) > 1:
+                    extracted_results = render_chunked_extraction(model, user_text)
+                else:
+                    extracted_results = render_streamed_extraction(model, user_text)
 
-    with tab3:
-        st.header("Drug Extractor & Disease Mapper (AI-Powered)")
-        st.markdown("Paste a medical paragraph below to extract drug names and match them to their related diseases using Google Gemini AI.")
+                if extracted_results is not None:
+                    confirmed, ai_only, lexicon_only = drug_lexicon.cross_check(matcher, extracted_results, user_text)
+                    with st.expander(f"Lexicon cross-check: {len(confirmed)} confirmed, {len(ai_only)} AI only, {len(lexicon_only)} lexicon only"):
+                        st.markdown(f"**Confirmed by lexicon:** {', '.join(confirmed) or '–'}")
+                        st.markdown(f"**Found by AI only:** {', '.join(ai_only) or '–'}")
+                        st.markdown(f"**Found by lexicon only (possibly missed by AI):** {', '.join(lexicon_only) or '–'}")
+
+            except Exception as e:
+                st.error(f"An error occurred during AI extraction: {str(e)}")
+
+    st.divider()
+    render_extract_batch(api_key, matcher.has_candidates if skip_without_candidates else None)
+
+@st.fragment
+@timing.timed("tab", tab="interval")
+def render_interval_tab():
+    st.header("⏳ Time Interval Duration Calculator")
+    st.markdown("Calculate the exact duration (days, hours, minutes) between two dates and times. Useful for determining elapsed clinical time.")
+    
+    col_start, col_end = st.columns(2)
+    
+    with col_start:
+        st.subheader("Start Time")
         
-        user_text = st.text_area("Input Medical Text Here:", height=200, placeholder="e.g. The patient presented with hypertension and was started on lisinopril and amlodipine. Given their history of afib, apixaban was continued...")
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
         
-        if st.button("Extract Drugs with AI", type="primary"):
-            if not user_text.strip():
-                st.warning("Please enter some text to extract drugs from.")
-            elif not api_key:
-                st.error("Please provide a Gemini API Key in the sidebar to use the AI Extractor.")
-            else:
-                with st.spinner("Analyzing medical text..."):
-                    try:
-                        import google.generativeai as genai
-                        import json
-                        
-                        # Use Gemini to extract drugs and map to indications
-                        generation_config = {
-                            "temperature": 0.1,
-                            "top_p": 0.95,
-                            "top_k": 64,
-                            "max_output_tokens": 1024,
-                            "response_mime_type": "application/json",
-                        }
-                        
-                        model = genai.GenerativeModel(
-                            model_name="gemini-2.5-flash",
-                            generation_config=generation_config
-                        )
-                        
-                        prompt = f"""
-                        You are a clinical AI assistant. Your task is to extract all medication/drug names from the clinical text provided below.
-                        For each drug identified, provide the most likely 'Related Disease / Indication' for which it is being used, based on the context or standard medical knowledge.
-                        
-                        Return the result as a JSON array of objects. 
-                        Each object must have exactly two keys: "Detected Drug" and "Related Disease / Indication".
-                        If no drugs are found, return an empty array [].
-                        Do not include any other text besides the JSON array.
-                        
-                        Clinical Text:
-                        "{user_text}"
-                        """
-                        
-                        # Corrected model version if necessary (user had "gemini-2.5-flash" in original, 
-                        # but genai usually uses "gemini-1.5-flash" or similar. 
-                        # I'll stick to what was in the file or update to a standard one if I'm sure)
-                        # Actually the file had "gemini-2.5-flash" (maybe a typo or future/custom version in their env?)
-                        # I'll keep it as is to avoid breaking their current setup if it works.
-                        
-                        response = model.generate_content(prompt)
-                        
-                        try:
-                            extracted_results = json.loads(response.text)
-                            if extracted_results:
-                                st.success(f"AI found {len(extracted_results)} drug(s) in the text!")
-                                st.dataframe(extracted_results, use_container_width=True, hide_index=True)
-                            else:
-                                st.info("The AI did not detect any medications in the provided text.")
-                        except json.JSONDecodeError:
-                            st.error("Failed to parse AI response. Please try again.")
-                            st.code(response.text)
-                            
-                    except Exception as e:
-                        st.error(f"An error occurred during AI extraction: {str(e)}")
+        st.markdown("**Start Date**")
+        s_year_col, _ = st.columns([1, 2])
+        with s_year_col:
+            start_year = st.number_input("Year", min_value=2000, max_value=2100, value=yesterday.year, key="sy")
+            
+        start_month_str = st.segmented_control("Month", MONTH_OPTIONS, default=calendar.month_abbr[yesterday.month], key="smo")
+        
+        # Dynamically calculate the number of days based on the selected year and month
+        start_month_num = MONTH_NUMBERS[start_month_str] if start_month_str else yesterday.month
+        start_max_days = days_in_month(start_year, start_month_num)
+        start_day_options = DAY_OPTIONS[start_max_days]
+        
+        # Snap to maximum valid day if previous selection exceeds new month's limit
+        current_start_day = min(yesterday.day, start_max_days)
+        start_day_str = st.segmented_control("Day", start_day_options, default=str(current_start_day).zfill(2), key="sda")
+        
+        st.markdown("**Start Time (24h)**")
+        
+        start_hour_str = st.segmented_control("Hour", HOUR_OPTIONS, default="08", key="sh")
+        start_min_str = st.segmented_control("Minute", MINUTE_OPTIONS, default="00", key="sm")
+        
+        try:
+            start_month = MONTH_NUMBERS[start_month_str] if start_month_str else yesterday.month
+            start_day = int(start_day_str) if start_day_str else yesterday.day
+            start_date = datetime.date(start_year, start_month, start_day)
+        except ValueError:
+            st.error("⚠️ Invalid Start Date (e.g. Feb 30). Defaulting to 1st of month.")
+            start_date = datetime.date(start_year, start_month, 1)
 
-    with tab4:
-        st.header("⏳ Time Interval Duration Calculator")
-        st.markdown("Calculate the exact duration (days, hours, minutes) between two dates and times. Useful for determining elapsed clinical time.")
+        start_hour = int(start_hour_str) if start_hour_str else 0
+        start_minute = int(start_min_str) if start_min_str else 0
+        start_time = datetime.time(start_hour, start_minute)
         
-        # Options for Date and Time Toggles
-        month_options = [calendar.month_abbr[i] for i in range(1, 13)]
-        hour_options = [str(i).zfill(2) for i in range(24)]
-        minute_options = [str(i).zfill(2) for i in range(0, 60, 5)] # 5-minute increments
+    with col_end:
+        st.subheader("End Time")
         
-        col_start, col_end = st.columns(2)
+        today = datetime.date.today()
         
-        with col_start:
-            st.subheader("Start Time")
-            
-            yesterday = datetime.date.today() - datetime.timedelta(days=1)
-            
-            st.markdown("**Start Date**")
-            s_year_col, _ = st.columns([1, 2])
-            with s_year_col:
-                start_year = st.number_input("Year", min_value=2000, max_value=2100, value=yesterday.year, key="sy")
-                
-            start_month_str = st.segmented_control("Month", month_options, default=calendar.month_abbr[yesterday.month], key="smo")
-            
-            # Dynamically calculate the number of days based on the selected year and month
-            start_month_num = list(calendar.month_abbr).index(start_month_str) if start_month_str else yesterday.month
-            start_max_days = calendar.monthrange(start_year, start_month_num)[1]
-            start_day_options = [str(i).zfill(2) for i in range(1, start_max_days + 1)]
-            
-            # Snap to maximum valid day if previous selection exceeds new month's limit
-            current_start_day = min(yesterday.day, start_max_days)
-            start_day_str = st.segmented_control("Day", start_day_options, default=str(current_start_day).zfill(2), key="sda")
-            
-            st.markdown("**Start Time (24h)**")
-            
-            start_hour_str = st.segmented_control("Hour", hour_options, default="08", key="sh")
-            start_min_str = st.segmented_control("Minute", minute_options, default="00", key="sm")
-            
-            try:
-                start_month = list(calendar.month_abbr).index(start_month_str) if start_month_str else yesterday.month
-                start_day = int(start_day_str) if start_day_str else yesterday.day
-                start_date = datetime.date(start_year, start_month, start_day)
-            except ValueError:
-                st.error("⚠️ Invalid Start Date (e.g. Feb 30). Defaulting to 1st of month.")
-                start_date = datetime.date(start_year, start_month, 1)
- 
-            start_hour = int(start_hour_str) if start_hour_str else 0
-            start_minute = int(start_min_str) if start_min_str else 0
-            start_time = datetime.time(start_hour, start_minute)
-            
-        with col_end:
-            st.subheader("End Time")
-            
-            today = datetime.date.today()
-            
-            st.markdown("**End Date**")
-            e_year_col, _ = st.columns([1, 2])
-            with e_year_col:
-                end_year = st.number_input("Year", min_value=2000, max_value=2100, value=today.year, key="ey")
-                
-            end_month_str = st.segmented_control("Month", month_options, default=calendar.month_abbr[today.month], key="emo")
-            
-            # Dynamically calculate the number of days based on the selected year and month
-            end_month_num = list(calendar.month_abbr).index(end_month_str) if end_month_str else today.month
-            end_max_days = calendar.monthrange(end_year, end_month_num)[1]
-            end_day_options = [str(i).zfill(2) for i in range(1, end_max_days + 1)]
-            
-            # Snap to maximum valid day if previous selection exceeds new month's limit
-            current_end_day = min(today.day, end_max_days)
-            end_day_str = st.segmented_control("Day", end_day_options, default=str(current_end_day).zfill(2), key="eda")
+        st.markdown("**End Date**")
+        e_year_col, _ = st.columns([1, 2])
+        with e_year_col:
+            end_year = st.number_input("Year", min_value=2000, max_value=2100, value=today.year, key="ey")
             
-            st.markdown("**End Time (24h)**")
-            
-            now_hour = str(datetime.datetime.now().hour).zfill(2)
-            now_min_val = (datetime.datetime.now().minute // 5) * 5
-            now_min = str(now_min_val).zfill(2)
- 
-            end_hour_str = st.segmented_control("Hour", hour_options, default=now_hour, key="eh")
-            end_min_str = st.segmented_control("Minute", minute_options, default=now_min, key="em")
-            
-            try:
-                end_month = list(calendar.month_abbr).index(end_month_str) if end_month_str else today.month
-                end_day = int(end_day_str) if end_day_str else today.day
-                end_date = datetime.date(end_year, end_month, end_day)
-            except ValueError:
-                st.error("⚠️ Invalid End Date (e.g. Feb 30). Defaulting to 1st of month.")
-                end_date = datetime.date(end_year, end_month, 1)
-            
-            end_hour = int(end_hour_str) if end_hour_str else datetime.datetime.now().hour
-            end_minute = int(end_min_str) if end_min_str else now_min_val
-            end_time = datetime.time(end_hour, end_minute)
-            
-        st.divider()
+        end_month_str = st.segmented_control("Month", MONTH_OPTIONS, default=calendar.month_abbr[today.month], key="emo")
         
-        # Combine date and time
-        start_datetime = datetime.datetime.combine(start_date, start_time)
-        end_datetime = datetime.datetime.combine(end_date, end_time)
+        # Dynamically calculate the number of days based on the selected year and month
+        end_month_num = MONTH_NUMBERS[end_month_str] if end_month_str else today.month
+        end_max_days = days_in_month(end_year, end_month_num)
+        end_day_options = DAY_OPTIONS[end_max_days]
         
-        if end_datetime < start_datetime:
-            st.error("⚠️ End time must be after the start time!")
-        else:
-            duration = end_datetime - start_datetime
-            
-            # Calculate components
-            total_seconds = int(duration.total_seconds())
-            days = duration.days
-            hours, remainder = divmod(total_seconds - (days * 86400), 3600)
-            minutes, seconds = divmod(remainder, 60)
-            
-            total_hours = total_seconds / 3600
-            total_minutes = total_seconds / 60
-            
-            st.metric(label="Total Elapsed Duration", value=f"{days} days, {hours} hours, {minutes} minutes")
-            
-            st.markdown("### Alternatively:")
-            st.write(f"- **{total_hours:,.2f}** total hours")
-            st.write(f"- **{total_minutes:,.0f}** total minutes")
-            st.write(f"- **{total_seconds:,}** total seconds")
- 
- 
-    with tab5:
-        st.header("📂 Document Upload & Storage")
-        st.markdown("Upload clinical documents, reports, or images to store them locally for this session.")
+        # Snap to maximum valid day if previous selection exceeds new month's limit
+        current_end_day = min(today.day, end_max_days)
+        end_day_str = st.segmented_control("Day", end_day_options, default=str(current_end_day).zfill(2), key="eda")
         
-        # Define upload directory
-        upload_dir = "uploads"
-        if not os.path.exists(upload_dir):
-            os.makedirs(upload_dir)
-            
-        uploaded_files = st.file_uploader("Choose files to upload", accept_multiple_files=True)
+        st.markdown("**End Time (24h)**")
         
-        if uploaded_files:
-            for uploaded_file in uploaded_files:
-                file_path = os.path.join(upload_dir, uploaded_file.name)
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-            st.success(f"Successfully saved {len(uploaded_files)} file(s) to `{upload_dir}/`")
-            
+        now_hour = str(datetime.datetime.now().hour).zfill(2)
+        now_min_val = (datetime.datetime.now().minute // 5) * 5
+        now_min = str(now_min_val).zfill(2)
+
+        end_hour_str = st.segmented_control("Hour", HOUR_OPTIONS, default=now_hour, key="eh")
+        end_min_str = st.segmented_control("Minute", MINUTE_OPTIONS, default=now_min, key="em")
+        
+        try:
+            end_month = MONTH_NUMBERS[end_month_str] if end_month_str else today.month
+            end_day = int(end_day_str) if end_day_str else today.day
+            end_date = datetime.date(end_year, end_month, end_day)
+        except ValueError:
+            st.error("⚠️ Invalid End Date (e.g. Feb 30). Defaulting to 1st of month.")
+            end_date = datetime.date(end_year, end_month, 1)
+        
+        end_hour = int(end_hour_str) if end_hour_str else datetime.datetime.now().hour
+        end_minute = int(end_min_str) if end_min_str else now_min_val
+        end_time = datetime.time(end_hour, end_minute)
+        
+    tz_col, _ = st.columns([1, 2])
+    with tz_col:
+        tz = st.selectbox("Time zone", TIMEZONE_OPTIONS, index=TIMEZONE_OPTIONS.index("UTC"), key="interval_tz", help="Wall-clock times are interpreted in this zone so durations across daylight-saving changes are exact.")
+
+    st.divider()
+    
+    # Combine date and time
+    start_datetime = datetime.datetime.combine(start_date, start_time)
+    end_datetime = datetime.datetime.combine(end_date, end_time)
+    try:
+        total_seconds = int(intervals.elapsed_seconds(start_datetime, end_datetime, tz))
+    except intervals.WallTimeError as e:
+        total_seconds = None
+        st.error(f"⚠️ {e}. Pick a time outside the daylight-saving change.")
+
+    if total_seconds is not None and total_seconds < 0:
+        st.error("⚠️ End time must be after the start time!")
+    elif total_seconds is not None:
+        # Calculate components
+        days, hours, minutes, seconds = intervals.breakdown(total_seconds)
+        
+        total_hours = total_seconds / 3600
+        total_minutes = total_seconds / 60
+        
+        st.metric(label="Total Elapsed Duration", value=f"{days} days, {hours} hours, {minutes} minutes")
+        
+        st.markdown("### Alternatively:")
+        st.write(f"- **{total_hours:,.2f}** total hours")
+        st.write(f"- **{total_minutes:,.0f}** total minutes")
+        st.write(f"- **{total_seconds:,}** total seconds")
+
+        render_save_result(
+            "interval",
+            {"start": start_datetime.isoformat(), "end": end_datetime.isoformat(), "tz": tz},
+            {"total_seconds": total_seconds, "days": days, "hours": hours, "minutes": minutes},
+            f"{start_datetime:%Y-%m-%d %H:%M} to {end_datetime:%Y-%m-%d %H:%M} ({tz}): {days} days, {hours} hours, {minutes} minutes",
+        )
+    render_result_history("interval")
+
+    st.divider()
+    render_interval_batch()
+
+HISTORY_KINDS = {"sofa": "SOFA", "kdigo": "KDIGO", "interval": "time interval"}
+
+def render_result_history(kind):
+    st.divider()
+    st.subheader("🗂️ Result History")
+    patient_id, encounter_id = current_patient()
+    if not (patient_id or encounter_id):
+        st.caption("Enter a patient or encounter ID in the sidebar to save results to a patient's history and see it here.")
+        return
+
+    log = get_result_log()
+    filters = {"patient_id": patient_id or None, "encounter_id": encounter_id or None}
+    if st.toggle(f"{HISTORY_KINDS[kind]} results only", value=True, key=f"history_only_{kind}"):
+        filters["kind"] = kind
+    history = log.history(limit=200, **filters)
+    if log.error:
+        st.warning(f"Some results could not be saved: {log.error}")
+    if not history:
+        st.caption("No results recorded yet for this patient.")
+        return
+
+    st.dataframe([
+        {
+            "Time": datetime.datetime.fromtimestamp(entry["recorded"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "Calculator": HISTORY_KINDS[entry["kind"]],
+            "Source": entry["source"],
+            "Patient": entry["patient_id"],
+            "Encounter": entry["encounter_id"],
+            "Result": entry["summary"] or json.dumps(entry["outputs"]),
+        }
+        for entry in history
+    ], use_container_width=True, hide_index=True)
+    total = log.count(**filters)
+    if total > len(history):
+        st.caption(f"Showing the latest {len(history):,} of {total:,} results. Download the file for all of them.")
+    st.download_button(
+        label="Download history (CSV)",
+        data=functools.partial(log.export_csv_bytes, **filters),
+        file_name=f"history_{patient_id or encounter_id}.csv",
+        mime="text/csv",
+        key=f"history_download_{kind}"
+    )
+
+def render_patient_context():
+    st.divider()
+    st.subheader("🧑‍⚕️ Patient")
+    st.text_input("Patient ID", key="patient_id", help="Results you save are added to this patient's history.")
+    st.text_input("Encounter ID", key="encounter_id")
+
+def render_storage_stats(store):
+    stats = store.storage_stats()
+    if not stats["documents"]:
+        return
+    # Compression ratio is over distinct contents; the savings also include deduplication
+    ratio = stats["unique_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 1.0
+    saved = stats["bytes"] - stats["stored_bytes"]
+    st.caption(
+        f"Storage ({UPLOAD_CODEC}): {format_bytes(stats['bytes'])} in {stats['documents']:,} document(s) stored as "
+        f"{format_bytes(stats['stored_bytes'])} · compression {ratio:.1f}× · "
+        f"{format_bytes(saved)} ({saved / max(1, stats['bytes']):.0%}) less disk I/O"
+    )
+
+def render_document_search(index):
+    st.subheader("🔎 Search Documents")
+    query = st.text_input("Search saved documents", key="doc_search", placeholder="e.g. apixaban atrial fibrillation")
+    if not query.strip():
+        return
+    started = time.perf_counter()
+    hits = index.search(query)
+    elapsed = (time.perf_counter() - started) * 1000
+    st.caption(f"{len(hits)} best match(es) in {elapsed:.1f} ms · {index.count():,} document(s) indexed")
+    if not hits:
+        st.info("No saved documents match the search.")
+    for hit in hits:
+        # The snippet is already HTML-escaped, with the matched words wrapped in <mark>
+        st.markdown(f"**📄 {html.escape(hit['name'])}**<br>{hit['snippet'] or '<i>(file name match)</i>'}", unsafe_allow_html=True)
+
+def render_document_jobs(store, queue, api_key):
+    st.subheader("🧪 Drug Extraction")
+    st.markdown(
+        "Extract the text of stored documents (plain text, HTML or DOCX) and run drug extraction on them in the "
+        "background. Unchanged documents reuse their earlier results."
+    )
+
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        use_stub = st.checkbox("Use offline stub model", key="doc_jobs_stub", help="Process documents locally without calling Gemini.")
+    with c2:
+        if st.button("Extract drugs from all documents", key="doc_jobs_run"):
+            if not use_stub and not api_key:
+                st.error("Please provide a Gemini API Key in the sidebar, or use the offline stub model.")
+            else:
+                names = [doc["name"] for doc in store.list()]
+                supported = [name for name in names if doc_jobs.is_supported(name)]
+                statuses = [queue.submit(name, use_stub=use_stub, api_key=api_key) for name in supported]
+                reused = statuses.count("done")
+                st.caption(
+                    f"Queued {statuses.count('queued'):,} document(s), reused {reused:,} unchanged result(s), "
+                    f"skipped {len(names) - len(supported):,} unsupported file(s)."
+                )
+
+    # Poll the jobs database while work is outstanding; the workers never touch the script thread
+    counts = queue.counts()
+    active = counts["queued"] + counts["running"]
+    st.fragment(render_job_progress, run_every=1.0 if active else None)(queue)
+
+def render_job_progress(queue):
+    counts = queue.counts()
+    total = sum(counts.values())
+    if not total:
+        return
+    finished = counts["done"] + counts["failed"]
+    st.progress(finished / total, text=" · ".join(f"{JOB_ICONS[status]} {counts[status]:,} {status}" for status in doc_jobs.STATUSES))
+
+    jobs = queue.latest()
+    rows = []
+    for job in sorted(jobs.values(), key=lambda job: job["name"]):
+        if job["status"] == "failed":
+            rows.append({"Document": job["name"], "Detected Drug": None, "Related Disease / Indication": None, "Error": job["error"]})
+        for drug in job["drugs"]:
+            rows.append({
+                "Document": job["name"],
+                "Detected Drug": drug.get("Detected Drug"),
+                "Related Disease / Indication": drug.get("Related Disease / Indication"),
+                "Error": None,
+            })
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+@st.fragment
+@timing.timed("tab", tab="documents")
+def render_documents_tab(api_key):
+    st.header("📂 Document Upload & Storage")
+    st.markdown("Upload clinical documents, reports, or images to store them locally for this session.")
+    
+    # Content-addressed store: identical bytes are only written once. Every user
+    # (or anonymous session) has its own namespace with a byte quota, created
+    # on the first save so page views alone leave nothing on disk.
+    get_upload_sweeper()
+    upload_dir = upload_store.namespace_dir(UPLOAD_BASE_DIR, current_namespace())
+    store = queue = index = None
+    if os.path.isdir(upload_dir):
+        store, queue, index = get_namespace_resources(upload_dir)
+        
+    uploaded_files = st.file_uploader("Choose files to upload", accept_multiple_files=True)
+    
+    if uploaded_files:
+        # The uploader keeps returning the same files on every rerun; only store each one once
+        saved_ids = st.session_state.setdefault("saved_upload_ids", {})
+        new_files = [f for f in uploaded_files if f.file_id not in saved_ids]
+        if new_files and store is None:
+            store, queue, index = get_namespace_resources(upload_dir)
+        saved = 0
+        for uploaded_file in new_files:
+            try:
+                stored_name, _, _ = store.save(uploaded_file.name, uploaded_file)
+            except upload_store.QuotaExceeded as e:
+                st.error(f"Storage quota reached, not saved: {e}")
+                saved_ids[uploaded_file.file_id] = None
+                continue
+            index.index_document(store, stored_name)
+            saved_ids[uploaded_file.file_id] = stored_name
+            saved += 1
+        if saved:
+            st.success(f"Successfully saved {saved} file(s) to `{upload_dir}/`")
+
+    used = store.usage() if store is not None else 0
+    st.progress(min(1.0, used / UPLOAD_QUOTA_BYTES), text=f"{format_bytes(used)} of {format_bytes(UPLOAD_QUOTA_BYTES)} used")
+    st.caption(f"Documents not opened for {UPLOAD_TTL_SECONDS / 3600:g} hours are removed automatically.")
+    if store is None:
+        st.info("No documents uploaded yet.")
+        return
+    render_storage_stats(store)
+        
+    st.divider()
+    render_document_search(index)
+
+    st.divider()
+    st.subheader("📋 Saved Documents")
+    
+    n_docs = store.count()
+    if n_docs:
+        sort_col, order_col, size_col, page_col = st.columns([2, 1, 1, 1])
+        with sort_col:
+            sort_label = st.selectbox("Sort by", list(DOCUMENT_SORTS.keys()), key="doc_sort")
+        with order_col:
+            descending = st.toggle("Descending", value=sort_label != "Name", key="doc_desc")
+        with size_col:
+            page_size = st.selectbox("Per page", [10, 25, 50, 100], index=1, key="doc_page_size")
+        n_pages = (n_docs + page_size - 1) // page_size
+        # A bigger page size or deleted documents can leave the stored page past the end
+        if st.session_state.get("doc_page", 1) > n_pages:
+            st.session_state["doc_page"] = n_pages
+        with page_col:
+            page = st.number_input("Page", min_value=1, max_value=n_pages, step=1, key="doc_page")
+        st.caption(f"{n_docs:,} document(s) · page {page} of {n_pages}")
+
+        # Only the current page is read from the catalog; file bytes are read on download
+        docs = store.list(offset=(page - 1) * page_size, limit=page_size, sort=DOCUMENT_SORTS[sort_label], descending=descending)
+        jobs = queue.latest({doc["name"] for doc in docs})
+        for doc in docs:
+            file = doc["name"]
+            col1, col2, col3 = st.columns([3, 1, 1])
+            with col1:
+                modified = datetime.datetime.fromtimestamp(doc["modified"]).strftime("%Y-%m-%d %H:%M")
+                st.text(f"📄 {file}")
+                job = jobs.get(file)
+                job_status = f" · {JOB_ICONS[job['status']]} {job['status']}" if job else ""
+                stored = f" · {doc['codec']} {doc['size'] / max(1, doc['stored_size']):.1f}×" if doc["codec"] else ""
+                st.caption(f"{format_bytes(doc['size'])}{stored} · {doc['mime']} · {modified}{job_status}")
+            with col2:
+                st.download_button(
+                    label="Download",
+                    data=functools.partial(store.read_bytes, file),
+                    file_name=file,
+                    mime=doc["mime"],
+                    on_click="ignore",
+                    key=f"dl_{file}"
+                )
+            with col3:
+                # The callback runs before the fragment reruns, so the listing is already up to date
+                st.button("Delete", key=f"del_{file}", on_click=delete_document, args=(store, queue, index, file))
+
         st.divider()
-        st.subheader("📋 Saved Documents")
+        render_document_jobs(store, queue, api_key)
+    else:
+        st.info("No documents uploaded yet.")
+
+@timing.timed("rerun")
+def main():
+    if METRICS_PORT:
+        get_metrics_server(METRICS_PORT)
+
+    # Custom CSS to wrap segmented control items so they fit the container width
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+    st.title("⚕️ Medical Calculator & Tools")
+    
+    # Check for API key in secrets, otherwise ask in sidebar
+    try:
+        api_key = st.secrets["GEMINI_API_KEY"]
+    except Exception:
+        api_key = ""
         
-        saved_files = os.listdir(upload_dir)
-        if saved_files:
-            for file in saved_files:
-                col1, col2, col3 = st.columns([3, 1, 1])
-                file_path = os.path.join(upload_dir, file)
-                with col1:
-                    st.text(f"📄 {file}")
-                with col2:
-                    try:
-                        with open(file_path, "rb") as f:
-                            st.download_button(
-                                label="Download",
-                                data=f,
-                                file_name=file,
-                                key=f"dl_{file}"
-                            )
-                    except Exception as e:
-                        st.error(f"Error reading {file}")
-                with col3:
-                    if st.button("Delete", key=f"del_{file}"):
-                        os.remove(file_path)
-                        st.rerun()
+    with st.sidebar:
+        st.header("⚙️ Settings")
+        if not api_key:
+            api_key = st.text_input("Gemini API Key", type="password", help="Enter your Google Gemini API Key to enable AI features (e.g., drug extraction).")
+            if not api_key:
+                st.warning("Please enter your Gemini API Key to use AI features.")
         else:
-            st.info("No documents uploaded yet.")
+            st.success("API Key loaded from secrets.")
+
+        render_patient_context()
+        render_cache_stats()
+            
+    if api_key:
+        try:
+            get_gemini_model(api_key)
+        except ImportError:
+            st.sidebar.error("Please install google-generativeai to use AI features.")
+    
+    # Create Layout Tabs. Each tab is a fragment, so interacting with one only reruns that tab.
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["sofa scale calculator", "KDIGO AKI calculation", "show only drug extractor", "time interval", "Upload Documents"])
+    
+    with tab1:
+        render_sofa_tab()
+
+    with tab2:
+        render_kdigo_tab()
+
+    with tab3:
+        render_extractor_tab(api_key)
+
+    with tab4:
+        render_interval_tab()
+
+    with tab5:
+        render_documents_tab(api_key)
 
 if __name__ == "__main__":
     main()
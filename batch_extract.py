@@ -0,0 +1,290 @@
+"""
+Bounded-concurrency batch drug extraction.
+
+Documents are fanned out over a thread pool (the Gemini SDK is blocking),
+with a shared token-bucket rate limiter and exponential-backoff retries on
+transient API errors. Results are yielded as they complete so callers can
+stream them into a table.
+
+The model is anything with a `generate_content(prompt)` method returning an
+object with a `.text` attribute, so `StubModel` can stand in for Gemini to
+benchmark the pipeline offline:
+
+    python batch_extract.py --documents 2000 --concurrency 32 --rate 200
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import extractor
+import timing
+
+TEXT_EXTENSIONS = (".txt", ".md", ".csv")
+
+# google.api_core exception class names worth retrying
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+    "DeadlineExceeded", "InternalServerError", "GatewayTimeout", "Aborted",
+}
+
+Result = namedtuple("Result", ["document", "drugs", "error", "attempts", "latency", "from_cache"])
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+    def update(self, result):
+        self.done += 1
+        if result.error:
+            self.failed += 1
+        elif result.attempts == 0:
+            # Never sent to the model (dropped by the prefilter)
+            self.skipped += 1
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self):
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        return (self.total - self.done) / self.throughput if self.throughput > 0 else None
+
+    def describe(self):
+        eta = f"{self.eta:,.0f}s" if self.eta is not None else "–"
+        skipped = f" · {self.skipped:,} skipped" if self.skipped else ""
+        return f"{self.done:,}/{self.total:,} documents · {self.throughput:,.1f} docs/s · ETA {eta} · {self.failed:,} failed{skipped}"
+
+
+class StubModel:
+    """Offline stand-in for a Gemini model: matches a few drug names after a simulated delay."""
+
+    DRUGS = {
+        "lisinopril": "Hypertension", "amlodipine": "Hypertension", "apixaban": "Atrial fibrillation",
+        "metformin": "Type 2 diabetes", "atorvastatin": "Hyperlipidemia", "furosemide": "Heart failure",
+        "vancomycin": "Bacterial infection", "norepinephrine": "Septic shock", "heparin": "Anticoagulation",
+    }
+
+    def __init__(self, latency=0.5, jitter=0.2, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def generate_content(self, prompt, stream=False):
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        if random.random() < self.failure_rate:
+            raise ConnectionError("stub transient failure")
+        notes = re.findall(r'<note id="([^"]*)">\n(.*?)\n</note>', prompt, re.S)
+        if notes:
+            # Batched prompt: answer every note separately, keyed by its id
+            text = json.dumps([{"id": note_id, "drugs": self._find(note)} for note_id, note in notes])
+        else:
+            text = json.dumps(self._find(prompt))
+        if stream:
+            return self._stream(text, delay)
+        time.sleep(delay)
+        return _StubResponse(text)
+
+    def _find(self, text):
+        words = set(re.findall(r"[a-z]+", text.lower()))
+        return [
+            {"Detected Drug": drug.capitalize(), "Related Disease / Indication": indication}
+            for drug, indication in self.DRUGS.items() if drug in words
+        ]
+
+    def _stream(self, text, delay):
+        # A quarter of the latency before the first piece, the rest spread over ~40-char pieces
+        pieces = [text[i:i + 40] for i in range(0, len(text), 40)]
+        time.sleep(delay / 4)
+        for piece in pieces:
+            time.sleep(delay * 0.75 / len(pieces))
+            yield _StubResponse(piece)
+
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def is_transient(exc):
+    return isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in TRANSIENT_ERRORS
+
+
+def extract_with_retry(model, document, text, limiter=None, cache=None, max_retries=4, base_delay=1.0, max_delay=30.0, batcher=None, stop=None):
+    started = time.monotonic()
+    attempts = 0
+    while True:
+        if stop is not None and stop.is_set():
+            return Result(document, [], "Cancelled", attempts, time.monotonic() - started, False)
+        attempts += 1
+        try:
+            if batcher is not None and batcher.accepts(text):
+                # Short note: coalesced with other pending notes (the batcher applies its own rate limit)
+                return Result(document, batcher.extract(text), None, attempts, time.monotonic() - started, False)
+            # Chunks run serially here so the pool size stays the overall concurrency bound.
+            # The limiter is taken per model call: a long note split into chunks makes several.
+            result = extractor.extract_long(model, text, cache=cache, max_workers=1, limiter=limiter)
+            if result.failed and not result.drugs:
+                raise ValueError("could not parse model response as JSON")
+            return Result(document, result.drugs, None, attempts, time.monotonic() - started, result.cached == result.chunks)
+        except Exception as e:
+            if attempts > max_retries or not is_transient(e):
+                return Result(document, [], f"{type(e).__name__}: {e}", attempts, time.monotonic() - started, False)
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempts - 1))))
+
+
+def run_batch(documents, model, concurrency=8, rate=None, cache=None, max_retries=4, base_delay=1.0, prefilter=None, batcher=None, limiter=None):
+    """
+    Extract drugs from every (name, text) pair in `documents`.
+
+    Yields `Result`s in completion order. At most `concurrency` requests are
+    in flight, and if `rate` is given model calls are limited to that many
+    per second across all workers (pass `limiter` instead to share one
+    `TokenBucket`, e.g. with the batcher). Documents for which
+    `prefilter(text)` is false (e.g. no lexicon drug candidates) are
+    returned empty without a model call. With a `micro_batch.MicroBatcher`,
+    short notes are packed into shared model calls.
+
+    Documents are read and submitted lazily, a couple of pool-fulls ahead.
+    When the consumer stops early (closes the generator, e.g. on a Streamlit
+    rerun), queued documents are cancelled and running ones do not retry, so
+    no further notes are sent to the model.
+    """
+    if limiter is None and rate:
+        limiter = TokenBucket(rate)
+    window = 2 * concurrency
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    documents = iter(documents)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    name, text = next(documents)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if prefilter is not None and not prefilter(text):
+                    yield Result(name, [], None, 0, 0.0, False)
+                    continue
+                pending.add(pool.submit(extract_with_retry, model, name, text, limiter, cache, max_retries, base_delay, batcher=batcher, stop=stop))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def result_rows(result):
+    # Flatten one Result into table rows (one per detected drug)
+    if result.error:
+        return [{"Document": result.document, "Detected Drug": None, "Related Disease / Indication": None, "Error": result.error}]
+    return [
+        {
+            "Document": result.document,
+            "Detected Drug": drug.get("Detected Drug"),
+            "Related Disease / Indication": drug.get("Related Disease / Indication"),
+            "Error": None,
+        }
+        for drug in result.drugs
+    ]
+
+
+def read_notes(name, data):
+    """
+    Split one uploaded/stored file into (name, text) notes.
+
+    CSV files with a `text` column give one note per row (named by an `id`
+    column when present); any other file is a single note.
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
+    if name.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(data))
+        if reader.fieldnames and "text" in reader.fieldnames:
+            return [
+                (f"{name}#{row.get('id') or i + 1}", row["text"])
+                for i, row in enumerate(reader) if row["text"] and row["text"].strip()
+            ]
+    return [(name, data)] if data.strip() else []
+
+
+def read_folder(path):
+    notes = []
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(TEXT_EXTENSIONS):
+            with open(entry.path, "rb") as f:
+                notes.extend(read_notes(entry.name, f.read()))
+    return notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch extraction against the offline stub model.")
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=None, help="max requests per second")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    model = StubModel(latency=args.latency, jitter=args.latency / 2, failure_rate=args.failure_rate)
+    documents = [(f"note-{i}", f"Patient {i} continued on lisinopril and metformin.") for i in range(args.documents)]
+
+    progress = Progress(len(documents))
+    latencies = []
+    for result in run_batch(documents, model, concurrency=args.concurrency, rate=args.rate, base_delay=0.05):
+        progress.update(result)
+        latencies.append(result.latency)
+
+    latencies.sort()
+    print(progress.describe())
+    print(f"latency p50 {timing.percentile(latencies, 50):.3f}s · p95 {timing.percentile(latencies, 95):.3f}s · p99 {timing.percentile(latencies, 99):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Benchmark suite for the whole app.
+
+Runs headless: calculator throughput, extraction latency against the
+offline stub model, upload store I/O for synthetic upload directories of
+increasing size, and per-tab rerun latency of the Streamlit app through
+`AppTest` (with Gemini replaced by the stub, so no key or network is
+needed). Everything runs in a temporary directory.
+
+Alongside its own measurements the report includes the `timing` spans the
+app recorded while being driven (per tab, per Gemini call, per file
+operation), so the numbers match what /metrics shows in production.
+
+    python bench.py
+    python bench.py --only tabs,files --documents 100,1000,10000 --json bench.json --prometheus bench.prom
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_extract
+import doc_search
+import extractor
+import intervals
+import kdigo
+import micro_batch
+import sofa
+import sofa_tracker
+import timing
+import upload_store
+
+SECTIONS = ("calculators", "extraction", "files", "tabs")
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+NAMESPACE = "bench"
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pct = lambda p: timing.percentile(samples, p) * 1000
+    return {"n": len(samples), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "max_ms": max(samples, default=0.0) * 1000}
+
+
+def _rate(n, seconds):
+    return n / seconds if seconds > 0 else float("inf")
+
+
+def synthetic_sofa_table(n, seed=0):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "pao2_fio2": rng.uniform(60, 500, n), "resp_support": rng.random(n) < 0.5,
+        "platelets": rng.uniform(5, 400, n), "bilirubin": rng.uniform(0.2, 15, n),
+        "map": rng.uniform(40, 110, n), "norepinephrine": rng.choice([0, 0, 0.05, 0.2], n),
+        "gcs": rng.integers(3, 16, n), "creatinine": rng.uniform(0.4, 6, n), "urine_output": rng.uniform(0, 3000, n),
+    })
+
+
+def bench_calculators(rows):
+    results = {}
+    table = synthetic_sofa_table(rows)
+    started = time.perf_counter()
+    sofa.score_batch(table)
+    results["sofa_batch_rows_per_s"] = _rate(rows, time.perf_counter() - started)
+
+    rng = random.Random(0)
+    inputs = [(rng.uniform(0.5, 4), rng.uniform(0.5, 1.5), rng.uniform(0.5, 3), rng.uniform(0, 1500), rng.uniform(40, 120), rng.choice([6, 12, 24]))
+              for _ in range(min(rows, 100000))]
+    started = time.perf_counter()
+    for args in inputs:
+        kdigo.evaluate_criteria(*args)
+    results["kdigo_evaluations_per_s"] = _rate(len(inputs), time.perf_counter() - started)
+
+    base = datetime.datetime(2024, 1, 1)
+    starts = [(base + datetime.timedelta(minutes=rng.randint(0, 500000))) for _ in range(rows)]
+    ends = [(start + datetime.timedelta(minutes=rng.randint(0, 20000))).isoformat() for start in starts]
+    starts = [start.isoformat() for start in starts]
+    started = time.perf_counter()
+    intervals.compute_batch(starts, ends, "America/New_York")
+    results["interval_batch_rows_per_s"] = _rate(rows, time.perf_counter() - started)
+
+    feed = list(sofa_tracker.synthetic_feed(max(1, rows // 200), 1))
+    started = time.perf_counter()
+    for _ in sofa_tracker.SofaTracker().replay(feed):
+        pass
+    results["sofa_tracker_observations_per_s"] = _rate(len(feed), time.perf_counter() - started)
+
+    for name, value in results.items():
+        print(f"  {name:<34} {value:>14,.0f}")
+    return results
+
+
+def bench_extraction(notes, latency, concurrency):
+    model = batch_extract.StubModel(latency=latency, jitter=latency / 4)
+    texts = [f"Note {i}: started lisinopril, continued heparin, metformin held." for i in range(notes)]
+    results = {}
+
+    def single(text):
+        started = time.perf_counter()
+        extractor.extract(model, text)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results["single_call"] = percentiles(list(pool.map(single, texts)))
+
+    first_items = []
+    totals = []
+    for text in texts[:max(1, notes // 5)]:
+        stream = extractor.StreamedExtraction(model, text)
+        for _ in stream:
+            pass
+        first_items.append(stream.first_item_seconds or stream.total_seconds)
+        totals.append(stream.total_seconds)
+    results["stream_first_item"] = percentiles(first_items)
+    results["stream_total"] = percentiles(totals)
+
+    batcher = micro_batch.MicroBatcher(model, max_wait=0.05)
+
+    def coalesced(text):
+        started = time.perf_counter()
+        batcher.extract(text)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results["micro_batched"] = percentiles(list(pool.map(coalesced, texts)))
+    batcher.close()
+    results["micro_batched"]["calls"] = batcher.stats.summary()["calls"]
+
+    for name, stats in results.items():
+        print(f"  {name:<20} n={stats['n']:<5} p50 {stats['p50_ms']:8.1f} ms · p95 {stats['p95_ms']:8.1f} ms · p99 {stats['p99_ms']:8.1f} ms")
+    return results
+
+
+def populate_store(root, documents, words=300, codec=None):
+    store = upload_store.UploadStore(root, codec=codec)
+    payloads = [(name, text.encode("utf-8")) for name, text in doc_search.synthetic_documents(documents, words, seed=len(root))]
+    started = time.perf_counter()
+    for name, data in payloads:
+        store.save(name, io.BytesIO(data))
+    elapsed = time.perf_counter() - started
+    return store, payloads, elapsed
+
+
+def bench_files(workdir, sizes, codec):
+    results = []
+    for documents in sizes:
+        root = os.path.join(workdir, f"files-{documents}")
+        store, payloads, elapsed = populate_store(root, documents, codec=codec)
+        n_bytes = sum(len(data) for _, data in payloads)
+
+        list_times = []
+        for sort in upload_store.SORT_COLUMNS:
+            started = time.perf_counter()
+            store.list(limit=50, sort=sort)
+            list_times.append(time.perf_counter() - started)
+
+        sample = random.Random(0).sample(payloads, min(200, len(payloads)))
+        started = time.perf_counter()
+        read = sum(len(store.read_bytes(name)) for name, _ in sample)
+        read_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        store.storage_stats()
+        stats_elapsed = time.perf_counter() - started
+
+        row = {
+            "documents": documents,
+            "save_docs_per_s": _rate(documents, elapsed),
+            "save_mb_per_s": _rate(n_bytes / 1e6, elapsed),
+            "list_page": percentiles(list_times),
+            "read_mb_per_s": _rate(read / 1e6, read_elapsed),
+            "storage_stats_ms": stats_elapsed * 1000,
+        }
+        results.append(row)
+        print(f"  {documents:>7,} docs: save {row['save_docs_per_s']:8,.0f} docs/s ({row['save_mb_per_s']:5.1f} MB/s) · "
+              f"list page p50 {row['list_page']['p50_ms']:6.2f} ms · read {row['read_mb_per_s']:6.1f} MB/s · "
+              f"stats {row['storage_stats_ms']:6.2f} ms")
+    return results
+
+
+def _tab_script(tab):
+    # Runs inside AppTest: one tab on its own, the way a fragment rerun executes it
+    import app
+
+    if tab == "sofa":
+        app.render_sofa_tab()
+    elif tab == "kdigo":
+        app.render_kdigo_tab()
+    elif tab == "extractor":
+        app.render_extractor_tab("bench-stub-key")
+    elif tab == "interval":
+        app.render_interval_tab()
+    else:
+        app.render_documents_tab("")
+
+
+def _use_stub_gemini(latency):
+    # Every model the app builds becomes the offline stub; nothing imports google.generativeai
+    extractor.make_model = lambda generation_config=None, api_key=None: batch_extract.StubModel(latency=latency, jitter=latency / 4)
+
+
+def _timed_runs(at, reruns):
+    samples = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_tabs(workdir, sizes, reruns, latency, codec):
+    from streamlit.testing.v1 import AppTest
+
+    _use_stub_gemini(latency)
+    results = {}
+
+    def app_test(script=None, tab=None, namespace=NAMESPACE):
+        at = AppTest.from_file(APP_PATH, default_timeout=120) if script is None else AppTest.from_function(script, args=(tab,), default_timeout=120)
+        at.session_state["upload_namespace"] = namespace
+        started = time.perf_counter()
+        at.run()
+        cold = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(f"{tab or 'app'} raised: {at.exception[0].value}")
+        return at, cold
+
+    at, cold = app_test()
+    results["main"] = dict(percentiles(_timed_runs(at, reruns)), cold_ms=cold * 1000)
+    for tab in ("sofa", "kdigo", "extractor", "interval"):
+        at, cold = app_test(_tab_script, tab)
+        results[tab] = dict(percentiles(_timed_runs(at, reruns)), cold_ms=cold * 1000)
+
+    # Extraction through the tab, stub latency included
+    at, _ = app_test(_tab_script, "extractor")
+    samples = []
+    for i in range(max(3, reruns // 4)):
+        at.text_area[0].input(f"Started lisinopril and heparin; metformin held ({i}).")
+        at.checkbox(key="lexicon_prefilter").uncheck()
+        started = time.perf_counter()
+        next(b for b in at.button if b.label == "Extract Drugs with AI").click().run()
+        samples.append(time.perf_counter() - started)
+    results["extractor_click"] = percentiles(samples)
+
+    # The documents tab lists the namespace's uploads, so time it per directory size
+    for documents in sizes:
+        namespace = f"{NAMESPACE}-{documents}"
+        populate_store(upload_store.namespace_dir(os.environ["UPLOAD_BASE_DIR"], "session-" + namespace), documents, codec=codec)
+        at, cold = app_test(_tab_script, "documents", namespace)
+        results[f"documents[{documents}]"] = dict(percentiles(_timed_runs(at, reruns)), cold_ms=cold * 1000)
+
+    for name, stats in results.items():
+        cold = f" · cold {stats['cold_ms']:8.1f} ms" if "cold_ms" in stats else ""
+        print(f"  {name:<20} p50 {stats['p50_ms']:8.1f} ms · p95 {stats['p95_ms']:8.1f} ms{cold}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--only", default=",".join(SECTIONS), help="comma-separated sections: " + ", ".join(SECTIONS))
+    parser.add_argument("--rows", type=int, default=100000, help="rows for calculator throughput")
+    parser.add_argument("--notes", type=int, default=200, help="notes for extraction latency")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--documents", default="100,1000,5000", help="comma-separated synthetic upload directory sizes")
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--codec", default=upload_store.default_codec(), help="gzip, zstd or none")
+    parser.add_argument("--json", help="write all results and timing spans to this file")
+    parser.add_argument("--prometheus", help="write the timing spans in Prometheus text format to this file")
+    args = parser.parse_args()
+
+    sections = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown section(s): {', '.join(sorted(unknown))}")
+    sizes = [int(n) for n in args.documents.split(",") if n.strip()]
+    codec = None if args.codec == "none" else args.codec
+
+    workdir = tempfile.mkdtemp(prefix="app-bench-")
+    # The app reads these when it is imported, so set them before any AppTest run
+    os.environ["UPLOAD_BASE_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["RESULT_LOG_PATH"] = os.path.join(workdir, "result_log.sqlite3")
+    os.environ["UPLOAD_CODEC"] = args.codec
+    os.environ.pop("METRICS_PORT", None)
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    cwd = os.getcwd()
+    # The Gemini response cache lives under the working directory
+    os.chdir(workdir)
+
+    report = {"started": datetime.datetime.now().isoformat(timespec="seconds"), "args": vars(args)}
+    try:
+        if "calculators" in sections:
+            print(f"Calculator throughput ({args.rows:,} rows)")
+            report["calculators"] = bench_calculators(args.rows)
+        if "extraction" in sections:
+            print(f"Extraction latency (stub model, {args.latency:g}s, {args.concurrency} concurrent)")
+            report["extraction"] = bench_extraction(args.notes, args.latency, args.concurrency)
+        if "files" in sections:
+            print(f"Upload store I/O (codec {args.codec})")
+            report["files"] = bench_files(workdir, sizes, codec)
+        if "tabs" in sections:
+            print(f"Rerun latency through AppTest ({args.reruns} reruns each)")
+            report["tabs"] = bench_tabs(workdir, sizes, args.reruns, args.latency, codec)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report["spans"] = timing.snapshot()
+    print("Timing spans")
+    for row in report["spans"]:
+        labels = ", ".join(f"{k}={v}" for k, v in row.items() if k not in ("span", "count", "errors") and not k.endswith("_ms"))
+        print(f"  {row['span']:<8} {labels:<28} n={row['count']:<6} p50 {row['p50_ms']:8.2f} ms · p95 {row['p95_ms']:8.2f} ms · errors {row['errors']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.prometheus:
+        with open(args.prometheus, "w", encoding="utf-8") as f:
+            f.write(timing.prometheus_text())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Background drug extraction for stored documents.
+
+Documents in the upload store are queued as jobs and processed by a pool of
+worker processes, so text extraction (HTML/DOCX parsing) and the model calls
+never block the Streamlit script thread. Workers record job state
+(queued -> running -> done/failed) and results in a small SQLite database
+next to the upload catalog, which the Upload Documents tab polls for
+progress.
+
+Results are also kept per content hash and model, so re-processing a file
+whose bytes have not changed (or the same file under another name) reuses
+the earlier result instead of extracting it again.
+"""
+import contextlib
+import html.parser
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+import batch_extract
+import extractor
+import timing
+import upload_store
+
+JOBS_FILE = ".jobs.sqlite3"
+STUB_MODEL = "stub"
+STATUSES = ("queued", "running", "done", "failed")
+
+PLAIN_TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".log", ".json", ".xml")
+HTML_EXTENSIONS = (".html", ".htm")
+DOCX_EXTENSIONS = (".docx",)
+SUPPORTED_EXTENSIONS = PLAIN_TEXT_EXTENSIONS + HTML_EXTENSIONS + DOCX_EXTENSIONS
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# Jobs databases this process has already opened; the app may build a new
+# queue for the same namespace after its cached one was evicted
+_opened = set()
+_opened_guard = threading.Lock()
+
+
+class _HTMLText(html.parser.HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "table"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip:
+            self.skip -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+
+def html_to_text(data):
+    parser = _HTMLText()
+    parser.feed(data)
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def docx_to_text(fileobj):
+    # A .docx is a zip; the body text is in the w:t runs of word/document.xml
+    with zipfile.ZipFile(fileobj) as docx:
+        root = ElementTree.fromstring(docx.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{_WORD_NS}p"):
+        runs = []
+        for node in paragraph.iter():
+            if node.tag == f"{_WORD_NS}t":
+                runs.append(node.text or "")
+            elif node.tag == f"{_WORD_NS}tab":
+                runs.append("\t")
+            elif node.tag in (f"{_WORD_NS}br", f"{_WORD_NS}cr"):
+                runs.append("\n")
+        paragraphs.append("".join(runs))
+    return "\n".join(paragraphs).strip()
+
+
+def extract_text(name, fileobj):
+    """Plain text of a stored document, chosen by file extension."""
+    lower = name.lower()
+    if lower.endswith(DOCX_EXTENSIONS):
+        return docx_to_text(fileobj)
+    data = fileobj.read().decode("utf-8", errors="replace")
+    if lower.endswith(HTML_EXTENSIONS):
+        return html_to_text(data)
+    if lower.endswith(PLAIN_TEXT_EXTENSIONS):
+        return data
+    raise ValueError(f"unsupported document type: {os.path.splitext(name)[1] or name}")
+
+
+def is_supported(name):
+    return name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def model_key(use_stub):
+    # Results are reused only for the same model and prompt version
+    return STUB_MODEL if use_stub else f"{extractor.MODEL_NAME}/v{extractor.PROMPT_VERSION}"
+
+
+@contextlib.contextmanager
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _finish(db_path, job_id, sha256, model, status, drugs=None, chars=0, error=None):
+    now = time.time()
+    with _connect(db_path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, drugs = ?, chars = ?, error = ?, finished = ? WHERE id = ?",
+            (status, json.dumps(drugs) if drugs is not None else None, chars, error, now, job_id)
+        )
+        if status == "done":
+            conn.execute(
+                "INSERT OR REPLACE INTO results (sha256, model, drugs, chars, created) VALUES (?, ?, ?, ?, ?)",
+                (sha256, model, json.dumps(drugs), chars, now)
+            )
+
+
+@timing.timed("job", op="extract_document")
+def run_job(db_path, job_id, blob_path, codec, name, sha256, model, api_key=None):
+    """Worker entry point: extract the document's text, then its drugs, and record the outcome."""
+    with _connect(db_path) as conn:
+        conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?", (time.time(), job_id))
+    try:
+        with upload_store.open_blob(blob_path, codec) as f:
+            text = extract_text(name, f)
+        if not text.strip():
+            _finish(db_path, job_id, sha256, model, "done", [], 0)
+            return
+
+        if model == STUB_MODEL:
+            gemini, cache = batch_extract.StubModel(), None
+        else:
+            import gemini_cache
+
+            gemini, cache = extractor.make_model(api_key=api_key), gemini_cache.ResponseCache()
+        result = batch_extract.extract_with_retry(gemini, name, text, cache=cache)
+        if result.error:
+            _finish(db_path, job_id, sha256, model, "failed", chars=len(text), error=result.error)
+        else:
+            _finish(db_path, job_id, sha256, model, "done", result.drugs, len(text))
+    except Exception as e:
+        _finish(db_path, job_id, sha256, model, "failed", error=f"{type(e).__name__}: {e}")
+
+
+def make_pool(workers=2):
+    # Spawned workers: forking a multi-threaded Streamlit server is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def forget(db_path, names):
+    # Job history for deleted documents; per-content results stay reusable
+    with _connect(db_path) as conn:
+        conn.executemany("DELETE FROM jobs WHERE name = ?", [(name,) for name in names])
+
+
+class JobQueue:
+    """
+    Extraction jobs for documents in an `upload_store.UploadStore`, run on
+    a process pool. Only the queue's own process submits jobs; the workers
+    write their progress straight to the jobs database.
+    """
+
+    def __init__(self, store, workers=2, db_path=None, pool=None):
+        self.store = store
+        self.db_path = db_path or os.path.join(store.root, JOBS_FILE)
+        with _connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, sha256 TEXT NOT NULL, model TEXT NOT NULL,"
+                " status TEXT NOT NULL, reused INTEGER NOT NULL DEFAULT 0, drugs TEXT, chars INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT, created REAL NOT NULL, started REAL, finished REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_name ON jobs (name, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " sha256 TEXT NOT NULL, model TEXT NOT NULL, drugs TEXT NOT NULL, chars INTEGER NOT NULL,"
+                " created REAL NOT NULL, PRIMARY KEY (sha256, model))"
+            )
+            # Jobs left behind by a previous server process will never finish,
+            # but a queue reopened in this process may still have some running
+            with _opened_guard:
+                first_open = os.path.abspath(self.db_path) not in _opened
+                _opened.add(os.path.abspath(self.db_path))
+            if first_open:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'interrupted by a server restart', finished = ?"
+                    " WHERE status IN ('queued', 'running')",
+                    (time.time(),)
+                )
+        # Queues for several upload namespaces can share one pool
+        self.pool = pool or make_pool(workers)
+
+    def submit(self, name, use_stub=False, api_key=None):
+        """
+        Queue extraction for the stored document `name` and return its job
+        status. Documents already queued or running are left alone, and an
+        unchanged document with a stored result is marked done immediately.
+        """
+        sha256 = self.store.lookup(name)
+        if sha256 is None:
+            raise FileNotFoundError(name)
+        model = model_key(use_stub)
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            latest = conn.execute(
+                "SELECT status, sha256, model FROM jobs WHERE name = ? ORDER BY id DESC LIMIT 1", (name,)
+            ).fetchone()
+            if latest and latest[0] in ("queued", "running") and latest[1:] == (sha256, model):
+                return latest[0]
+            cached = conn.execute("SELECT drugs, chars FROM results WHERE sha256 = ? AND model = ?", (sha256, model)).fetchone()
+            if cached:
+                conn.execute(
+                    "INSERT INTO jobs (name, sha256, model, status, reused, drugs, chars, created, started, finished)"
+                    " VALUES (?, ?, ?, 'done', 1, ?, ?, ?, ?, ?)",
+                    (name, sha256, model, cached[0], cached[1], now, now, now)
+                )
+                return "done"
+            job_id = conn.execute(
+                "INSERT INTO jobs (name, sha256, model, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (name, sha256, model, now)
+            ).lastrowid
+
+        blob_path, codec = self.store.locate(sha256)
+        future = self.pool.submit(run_job, self.db_path, job_id, blob_path, codec, name, sha256, model, api_key)
+        future.add_done_callback(lambda f: self._check_crash(f, job_id, sha256, model))
+        return "queued"
+
+    def _check_crash(self, future, job_id, sha256, model):
+        # run_job records its own failures; this catches a worker that died outright
+        error = future.exception()
+        if error is not None:
+            _finish(self.db_path, job_id, sha256, model, "failed", error=f"{type(error).__name__}: {error}")
+
+    def latest(self, names=None):
+        """Latest job per document name as dicts (drugs decoded), optionally for `names` only."""
+        query = "SELECT * FROM jobs WHERE id IN (SELECT MAX(id) FROM jobs GROUP BY name)"
+        with _connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(query).fetchall()
+        jobs = {}
+        for row in rows:
+            if names is None or row["name"] in names:
+                job = dict(row)
+                job["drugs"] = json.loads(job["drugs"]) if job["drugs"] else []
+                jobs[job["name"]] = job
+        return jobs
+
+    def counts(self):
+        """Number of documents whose latest job is in each status."""
+        with _connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE id IN (SELECT MAX(id) FROM jobs GROUP BY name) GROUP BY status"
+            ).fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def forget(self, name):
+        forget(self.db_path, [name])
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
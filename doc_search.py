@@ -0,0 +1,217 @@
+"""
+Full-text search over stored documents.
+
+An SQLite FTS5 table (porter-stemmed, so "infections" finds "infection")
+holds the extracted text of every document in the upload store, keyed by
+document name. It is updated incrementally as documents are saved and
+deleted, and `sync` reconciles it with the catalog on startup. Queries are
+answered from the inverted index with bm25 ranking and highlighted snippets
+and do not touch the blobs.
+
+    python doc_search.py --documents 20000
+"""
+import argparse
+import contextlib
+import html
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import doc_jobs
+import timing
+
+SEARCH_FILE = ".search.sqlite3"
+# Snippet markers that cannot occur in document text; swapped for <mark> after escaping
+_MARK_START, _MARK_END = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def to_match_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, and the last
+    one also matches as a prefix so results update while typing.
+    """
+    words = _TOKEN.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def highlight_html(snippet):
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+class SearchIndex:
+    def __init__(self, root="uploads", path=None):
+        self.path = path or os.path.join(root, SEARCH_FILE)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+                " name, body, tokenize = 'porter unicode61')"
+            )
+            # FTS5 can only look rows up by rowid, so keep name -> rowid separately
+            conn.execute("CREATE TABLE IF NOT EXISTS indexed (name TEXT PRIMARY KEY, doc_id INTEGER NOT NULL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, name, text):
+        self.add_many([(name, text)])
+
+    @timing.timed("search", op="index")
+    def add_many(self, documents):
+        """Index (name, text) pairs in one transaction, replacing earlier entries for the same names."""
+        with self._connect() as conn:
+            for name, text in documents:
+                self._remove(conn, name)
+                doc_id = conn.execute("INSERT INTO documents_fts (name, body) VALUES (?, ?)", (name, text)).lastrowid
+                conn.execute("INSERT INTO indexed (name, doc_id) VALUES (?, ?)", (name, doc_id))
+
+    def _remove(self, conn, name):
+        row = conn.execute("SELECT doc_id FROM indexed WHERE name = ?", (name,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM documents_fts WHERE rowid = ?", row)
+            conn.execute("DELETE FROM indexed WHERE name = ?", (name,))
+
+    def remove(self, name):
+        with self._connect() as conn:
+            self._remove(conn, name)
+
+    def names(self):
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT name FROM indexed")}
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+
+    @timing.timed("search", op="query")
+    def search(self, text, limit=20):
+        """
+        Best-ranked documents for a free-text query as dicts with name,
+        score (bm25, lower is better) and an HTML snippet with the matched
+        words in <mark> tags. Filename matches weigh more than body matches.
+        """
+        query = to_match_query(text)
+        if query is None:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT name, bm25(documents_fts, 5.0, 1.0) AS score,"
+                " snippet(documents_fts, 1, ?, ?, '…', 16)"
+                " FROM documents_fts WHERE documents_fts MATCH ? ORDER BY score LIMIT ?",
+                (_MARK_START, _MARK_END, query, limit)
+            ).fetchall()
+        return [{"name": name, "score": score, "snippet": highlight_html(snippet)} for name, score, snippet in rows]
+
+    def index_document(self, store, name):
+        self.add(name, document_text(store, name))
+
+    def sync(self, store):
+        """Index catalog documents missing from the index and drop entries for deleted ones."""
+        catalog = {doc["name"] for doc in store.list()}
+        indexed = self.names()
+        missing = catalog - indexed
+        if missing:
+            self.add_many((name, document_text(store, name)) for name in sorted(missing))
+        for name in indexed - catalog:
+            self.remove(name)
+        return len(missing), len(indexed - catalog)
+
+    def optimize(self):
+        # Merge the b-tree segments left behind by many small incremental updates
+        with self._connect() as conn:
+            conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+
+
+def document_text(store, name):
+    # Unsupported or unreadable files are still findable by name
+    if not doc_jobs.is_supported(name):
+        return ""
+    try:
+        with store.open(name) as f:
+            return doc_jobs.extract_text(name, f)
+    except Exception:
+        return ""
+
+
+VOCABULARY = (
+    "patient presented with hypertension sepsis pneumonia atrial fibrillation heart failure diabetes "
+    "acute kidney injury started continued stopped lisinopril amlodipine apixaban metformin atorvastatin "
+    "furosemide vancomycin norepinephrine heparin insulin ceftriaxone piperacillin tazobactam blood "
+    "pressure creatinine lactate culture negative positive febrile tachycardic stable discharged "
+    "follow up clinic daily twice dose mg iv po history of chronic obstructive pulmonary disease"
+).split()
+
+
+def synthetic_documents(n, words=300, vocabulary_size=20000, seed=0):
+    # Zipf-distributed words, so common words are in most notes and the clinical terms are rarer
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(vocabulary_size)]
+    for i, term in enumerate(VOCABULARY):
+        vocabulary[50 + i * 40] = term
+    weights = [1.0 / (rank + 1) for rank in range(vocabulary_size)]
+    for i in range(n):
+        yield f"note_{i:06d}.txt", " ".join(rng.choices(vocabulary, weights, k=words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexing throughput and query latency of the document search index.")
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="doc-search-bench-")
+    try:
+        index = SearchIndex(workdir)
+        documents = list(synthetic_documents(args.documents, args.words))
+        n_bytes = sum(len(text) for _, text in documents)
+
+        started = time.perf_counter()
+        for i in range(0, len(documents), args.batch_size):
+            index.add_many(documents[i:i + args.batch_size])
+        elapsed = time.perf_counter() - started
+        print(f"indexed {len(documents):,} documents ({n_bytes / 1e6:.1f} MB) in {elapsed:.2f}s "
+              f"({len(documents) / elapsed:,.0f} docs/s, {n_bytes / 1e6 / elapsed:.1f} MB/s)")
+
+        started = time.perf_counter()
+        for name, text in documents[:200]:
+            index.add(name, text)
+        elapsed = time.perf_counter() - started
+        print(f"incremental single-document updates: {elapsed / 200 * 1000:.2f} ms each")
+
+        index.optimize()
+        print(f"index size {os.path.getsize(index.path) / 1e6:.1f} MB")
+
+        rng = random.Random(1)
+        queries = [" ".join(rng.sample(VOCABULARY, rng.choice([1, 2, 3]))) for _ in range(args.queries)]
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        pct = lambda p: timing.percentile(latencies, p) * 1000
+        print(f"{len(queries):,} queries (top 20 with snippets): p50 {pct(50):.2f} ms · p95 {pct(95):.2f} ms · p99 {pct(99):.2f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Gemini drug/indication extraction used by the drug extractor tab.
+
+The model name, generation config and prompt template live here so that
+every caller (the tab, batch jobs, the response cache key) agrees on them.
+Bump PROMPT_VERSION whenever PROMPT_TEMPLATE changes so cached responses
+produced by the old prompt are no longer served.
+
+`StreamedExtraction` streams the response and yields each drug object as
+soon as it is complete, so the tab can fill its table while generating.
+"""
+import json
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import timing
+
+# Long notes are split into chunks of roughly this many characters, with the
+# tail of each chunk repeated at the start of the next so a drug mentioned
+# across a boundary is still seen with its context.
+CHUNK_CHARS = 6000
+CHUNK_OVERLAP = 500
+
+_SECTION_BREAK = re.compile(r"\n\s*\n|\n(?=[A-Z][A-Za-z /&-]{2,40}:)")
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+ChunkedResult = namedtuple("ChunkedResult", ["drugs", "chunks", "truncated", "failed", "cached"])
+
+MODEL_NAME = "gemini-2.5-flash"
+PROMPT_VERSION = 1
+
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 1024,
+    "response_mime_type": "application/json",
+}
+
+PROMPT_TEMPLATE = """
+You are a clinical AI assistant. Your task is to extract all medication/drug names from the clinical text provided below.
+For each drug identified, provide the most likely 'Related Disease / Indication' for which it is being used, based on the context or standard medical knowledge.
+
+Return the result as a JSON array of objects.
+Each object must have exactly two keys: "Detected Drug" and "Related Disease / Indication".
+If no drugs are found, return an empty array [].
+Do not include any other text besides the JSON array.
+
+Clinical Text:
+"{user_text}"
+"""
+
+
+# Several short notes in one request (see micro_batch.py). Answers are keyed by
+# note id so they can be handed back to each caller.
+BATCH_PROMPT_TEMPLATE = """
+You are a clinical AI assistant. Below are several independent clinical notes, each wrapped in <note id="..."></note> tags.
+For each note, extract all medication/drug names from that note only, and for each drug provide the most likely 'Related Disease / Indication' for which it is being used, based on the note's context or standard medical knowledge.
+
+Return the result as a JSON array with exactly one object per note.
+Each object must have exactly two keys: "id" (the note's id, as a string) and "drugs" (a JSON array of objects, each with exactly two keys: "Detected Drug" and "Related Disease / Indication").
+If a note mentions no drugs, return an empty "drugs" array for it.
+Do not include any other text besides the JSON array.
+
+Clinical Notes:
+{notes}
+"""
+
+# Room for the answers to many notes
+BATCH_GENERATION_CONFIG = dict(GENERATION_CONFIG, max_output_tokens=8192)
+
+
+def build_prompt(user_text):
+    return PROMPT_TEMPLATE.replace("{user_text}", user_text)
+
+
+def build_batch_prompt(notes):
+    """Prompt for (note_id, text) pairs; note text cannot close its own tag."""
+    blocks = [f'<note id="{note_id}">\n{text.replace("</note>", "</ note>")}\n</note>' for note_id, text in notes]
+    return BATCH_PROMPT_TEMPLATE.replace("{notes}", "\n".join(blocks))
+
+
+def parse_batch_results(response_text):
+    """
+    Demultiplex a batched response into {note_id: drugs}. Notes missing from
+    the answer (e.g. cut off by the output limit) are simply absent.
+    Raises json.JSONDecodeError when nothing usable can be recovered.
+    """
+    items, _ = parse_results(response_text)
+    results = {}
+    for item in items:
+        if isinstance(item, dict) and "id" in item and isinstance(item.get("drugs"), list):
+            results[str(item["id"])] = [drug for drug in item["drugs"] if isinstance(drug, dict)]
+    return results
+
+
+def make_model(generation_config=None, api_key=None):
+    import google.generativeai as genai
+
+    model = genai.GenerativeModel(
+        model_name=MODEL_NAME,
+        generation_config=generation_config or GENERATION_CONFIG
+    )
+    if api_key:
+        # Give the model its own client for this key. genai.configure() sets one key for the
+        # whole process, so sessions with different keys would end up using each other's.
+        from google.ai import generativelanguage as glm
+
+        model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return model
+
+
+def cache_key(cache, model, user_text):
+    """
+    Response cache key for `user_text` answered by `model`. The model's own
+    generation config is part of the key, so e.g. the batch model (larger
+    output limit) and the single-note model never share entries.
+    """
+    # make_model passes a plain dict, which genai keeps as _generation_config; the stub has none
+    config = getattr(model, "_generation_config", None) or GENERATION_CONFIG
+    return cache.make_key(user_text, MODEL_NAME, config, PROMPT_VERSION)
+
+
+def extract(model, user_text, cache=None, limiter=None):
+    """
+    Run extraction for `user_text` and return (response_text, from_cache).
+
+    Only responses that parse as a JSON array are stored, so a malformed
+    answer is retried on the next request instead of being served from the
+    cache. A `limiter` (e.g. `batch_extract.TokenBucket`) is acquired right
+    before the model call, so cache hits do not use up the rate limit.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(cache, model, user_text)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, True
+
+    if limiter is not None:
+        limiter.acquire()
+    with timing.span("gemini", call="extract"):
+        response_text = model.generate_content(build_prompt(user_text)).text
+
+    if cache is not None and _is_json_array(response_text):
+        cache.put(key, response_text)
+    return response_text, False
+
+
+def _pieces(text, max_chars):
+    # Section/paragraph boundaries first, then sentences, then hard splits
+    for section in _SECTION_BREAK.split(text):
+        section = section.strip()
+        if not section:
+            continue
+        if len(section) <= max_chars:
+            yield section
+            continue
+        for sentence in _SENTENCE_END.split(section):
+            for start in range(0, len(sentence), max_chars):
+                yield sentence[start:start + max_chars]
+
+
+def split_text(text, max_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Split `text` into chunks of at most ~`max_chars` on section/sentence boundaries, with overlap."""
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    current = []
+    size = 0
+    for piece in _pieces(text, max_chars):
+        if current and size + len(piece) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            # Carry trailing pieces forward as overlap
+            carried = []
+            carried_size = 0
+            for prev in reversed(current):
+                if carried_size + len(prev) > overlap:
+                    break
+                carried.insert(0, prev)
+                carried_size += len(prev) + 1
+            current, size = carried, carried_size
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _is_json_array(text):
+    try:
+        return isinstance(json.loads(text), list)
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_results(response_text):
+    """
+    Parse a JSON array of drug objects, returning (drugs, truncated).
+
+    If the response was cut off (e.g. by max_output_tokens) every complete
+    object before the cut is recovered and `truncated` is True. Raises
+    json.JSONDecodeError when nothing usable can be recovered, including a
+    response that is valid JSON but not an array.
+    """
+    try:
+        parsed = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        error = e
+    else:
+        if not isinstance(parsed, list):
+            raise json.JSONDecodeError("expected a JSON array", response_text, 0)
+        return [item for item in parsed if isinstance(item, dict)], False
+
+    start = response_text.find("[")
+    if start < 0:
+        raise error
+    decoder = json.JSONDecoder()
+    drugs = []
+    pos = start + 1
+    while True:
+        while pos < len(response_text) and response_text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(response_text) or response_text[pos] == "]":
+            break
+        try:
+            item, pos = decoder.raw_decode(response_text, pos)
+        except json.JSONDecodeError:
+            break
+        if isinstance(item, dict):
+            drugs.append(item)
+    if not drugs:
+        raise error
+    return drugs, True
+
+
+class ArrayStreamParser:
+    """
+    Incremental parser for a streamed JSON array of objects.
+
+    `feed` takes the next piece of response text and returns the objects
+    that became complete with it. Only the new piece is scanned (string/
+    escape/brace state is carried over) and only the pieces of the object
+    still being read are kept, so parsing the whole stream is linear in its
+    length.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, piece):
+        items = []
+        # Where the object being read starts within this piece (0 if it began in an earlier one)
+        item_start = 0
+        for pos, ch in enumerate(piece):
+            if self.finished:
+                break
+            if not self.started:
+                self.started = ch == "["
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                if self.depth == 0:
+                    item_start = pos
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(piece[item_start:pos + 1])
+                    try:
+                        item = json.loads("".join(self.parts))
+                    except json.JSONDecodeError:
+                        item = None
+                    self.parts = []
+                    if isinstance(item, dict):
+                        items.append(item)
+            elif ch == "]" and self.depth == 0:
+                self.finished = True
+        if self.depth:
+            self.parts.append(piece[item_start:])
+        return items
+
+
+class StreamedExtraction:
+    """
+    Iterate over drugs as the model generates them.
+
+    After iteration, `response_text` holds the full response and
+    `first_item_seconds` / `total_seconds` the time to the first complete
+    object and to the end of the stream. A cached response is replayed
+    without calling the model. `complete` is False when the stream ended
+    before the closing bracket (e.g. the output token limit was hit).
+    """
+
+    def __init__(self, model, user_text, cache=None):
+        self.model = model
+        self.user_text = user_text
+        self.cache = cache
+        self.response_text = ""
+        self.from_cache = False
+        self.complete = False
+        self.first_item_seconds = None
+        self.total_seconds = None
+
+    def _pieces(self):
+        key = None
+        if self.cache is not None:
+            key = cache_key(self.cache, self.model, self.user_text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.from_cache = True
+                yield cached
+                return
+
+        pieces = []
+        started = time.perf_counter()
+        for chunk in self.model.generate_content(build_prompt(self.user_text), stream=True):
+            pieces.append(chunk.text)
+            yield chunk.text
+        timing.observe("gemini", time.perf_counter() - started, call="stream")
+
+        # Same rule as `extract`: only cache responses that are a JSON array
+        if self.cache is not None and _is_json_array("".join(pieces)):
+            self.cache.put(key, "".join(pieces))
+
+    def __iter__(self):
+        started = time.perf_counter()
+        parser = ArrayStreamParser()
+        pieces = []
+        for piece in self._pieces():
+            pieces.append(piece)
+            for item in parser.feed(piece):
+                if self.first_item_seconds is None:
+                    self.first_item_seconds = time.perf_counter() - started
+                    if not self.from_cache:
+                        timing.observe("gemini", self.first_item_seconds, call="stream_first_item")
+                yield item
+        self.total_seconds = time.perf_counter() - started
+        self.response_text = "".join(pieces)
+        self.complete = parser.finished
+
+
+def _drug_key(name):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", str(name).lower()).split())
+
+
+def merge_results(result_lists):
+    """Merge per-chunk drug lists, deduplicating drugs by normalized name and combining indications."""
+    merged = {}
+    for drugs in result_lists:
+        for drug in drugs:
+            name = drug.get("Detected Drug") if isinstance(drug, dict) else None
+            if not name:
+                continue
+            entry = merged.setdefault(_drug_key(name), {"Detected Drug": name, "indications": {}})
+            indication = (drug.get("Related Disease / Indication") or "").strip()
+            if indication:
+                entry["indications"].setdefault(indication.lower(), indication)
+    return [
+        {"Detected Drug": entry["Detected Drug"], "Related Disease / Indication": "; ".join(entry["indications"].values())}
+        for entry in merged.values()
+    ]
+
+
+def extract_long(model, user_text, cache=None, max_workers=8, max_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP, limiter=None):
+    """
+    Extract drugs from arbitrarily long text.
+
+    The text is chunked and every chunk is extracted in parallel, so latency
+    is bounded by the slowest chunk rather than the document length. Chunks
+    whose response cannot be parsed at all are returned in `failed`.
+    """
+    chunks = split_text(user_text, max_chars, overlap)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        responses = list(pool.map(lambda chunk: extract(model, chunk, cache=cache, limiter=limiter), chunks))
+
+    result_lists = []
+    truncated = 0
+    failed = []
+    for response_text, _ in responses:
+        try:
+            drugs, was_truncated = parse_results(response_text)
+        except json.JSONDecodeError:
+            failed.append(response_text)
+            continue
+        result_lists.append(drugs)
+        truncated += was_truncated
+
+    cached = sum(1 for _, from_cache in responses if from_cache)
+    return ChunkedResult(merge_results(result_lists), len(chunks), truncated, failed, cached)
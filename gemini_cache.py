@@ -0,0 +1,130 @@
+"""
+Persistent SQLite cache for Gemini responses.
+
+Entries are keyed on a SHA-256 of the normalized input text together with
+the model name, generation config and prompt template version, so any
+change to how a request is built misses the cache. Entries expire after
+`ttl_seconds`, and once the cache exceeds `max_entries` or `max_bytes` the
+least recently used entries are evicted. Hit/miss counters are stored in
+the database so they are shared by every session and survive restarts.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_PATH = os.path.join(".cache", "gemini_responses.sqlite3")
+
+
+def normalize_text(text):
+    # Collapse whitespace so re-pasted or re-wrapped notes hit the same entry
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_PATH, ttl_seconds=30 * 86400, max_entries=10000, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(text, model_name, generation_config, prompt_version):
+        payload = json.dumps(
+            [normalize_text(text), model_name, generation_config, prompt_version],
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+            return row[0]
+
+    def get_any(self, keys):
+        """
+        Values cached under any of `keys` (e.g. the same text under two
+        models), in the order of `keys`. Counted as one hit or one miss.
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._connect() as conn:
+            found = dict(conn.execute(
+                f"SELECT key, value FROM responses WHERE key IN ({', '.join('?' * len(keys))}) AND created >= ?",
+                (*keys, now - self.ttl_seconds)
+            ))
+            if not found:
+                conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+                return []
+            conn.executemany("UPDATE responses SET accessed = ? WHERE key = ?", [(now, key) for key in found])
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+        return [found[key] for key in keys if key in found]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Walk entries from least to most recently used until both caps are met
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def stats(self):
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM stats"))
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        counters.update(entries=entries, bytes=size)
+        return counters
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("UPDATE stats SET value = 0")
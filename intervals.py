@@ -0,0 +1,167 @@
+"""
+Elapsed-time arithmetic for the time interval tab.
+
+Wall-clock timestamps are localized to a time zone and converted to UTC
+before subtracting, so an interval that spans a DST change is its true
+length (a night shift across the spring-forward change is 11 hours, not 12).
+
+`compute_batch` does the same for whole columns of start/end timestamps in
+one vectorized pass over `datetime64[ns]` arrays, e.g. door-to-needle or
+length-of-stay intervals for a cohort.
+"""
+import datetime
+import re
+import zoneinfo
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 86400
+PERCENTILES = (5, 25, 50, 75, 90, 95, 99)
+
+
+def breakdown(total_seconds):
+    """Split a non-negative number of seconds into (days, hours, minutes, seconds)."""
+    days, remainder = divmod(int(total_seconds), SECONDS_PER_DAY)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return days, hours, minutes, seconds
+
+
+class WallTimeError(ValueError):
+    """A wall-clock time that does not exist, or occurs twice, in the chosen time zone."""
+
+
+def check_wall_time(value, zone):
+    """
+    Raise `WallTimeError` if the naive datetime `value` is skipped (spring
+    forward) or repeated (fall back) in `zone`, where `replace(tzinfo=...)`
+    would silently pick the first offset.
+    """
+    first = value.replace(tzinfo=zone, fold=0)
+    if first.utcoffset() == value.replace(tzinfo=zone, fold=1).utcoffset():
+        return
+    # A real wall time survives the trip through UTC; a skipped one comes back shifted
+    if first.astimezone(datetime.timezone.utc).astimezone(zone).replace(tzinfo=None) == value:
+        raise WallTimeError(f"{value:%Y-%m-%d %H:%M} occurs twice in {zone.key} (clocks fall back), so the duration is ambiguous")
+    raise WallTimeError(f"{value:%Y-%m-%d %H:%M} does not exist in {zone.key} (clocks spring forward past it)")
+
+
+def elapsed_seconds(start, end, tz=None):
+    """
+    Seconds from `start` to `end` (naive wall-clock datetimes) in time zone `tz`.
+
+    Aware datetimes sharing a tzinfo subtract as wall time in Python, so both
+    ends are converted to UTC first. With no `tz` the naive difference is used.
+    Raises `WallTimeError` for a wall time the DST change skips or repeats,
+    the cases `compute_batch` marks invalid.
+    """
+    if tz:
+        zone = zoneinfo.ZoneInfo(tz)
+        check_wall_time(start, zone)
+        check_wall_time(end, zone)
+        start = start.replace(tzinfo=zone).astimezone(datetime.timezone.utc)
+        end = end.replace(tzinfo=zone).astimezone(datetime.timezone.utc)
+    return (end - start).total_seconds()
+
+
+# A UTC offset or "Z" right after the time part (not the day of a date such as 2024-03-10)
+_OFFSET_PATTERN = re.compile(r"\d:\d{2}(?::\d{2}(?:\.\d+)?)?\s*(?:Z|[+-]\d{2}(?::?\d{2})?)$")
+
+
+def _localize(parsed, tz):
+    # Naive datetime64 series -> naive UTC; skipped or repeated wall times become NaT
+    if tz:
+        parsed = parsed.dt.tz_localize(tz, ambiguous="NaT", nonexistent="NaT").dt.tz_convert("UTC").dt.tz_localize(None)
+    return parsed
+
+
+def _parse_naive(text):
+    try:
+        parsed = pd.to_datetime(text, errors="coerce", format="mixed")
+    except (TypeError, ValueError):
+        # Offsets in a spelling the pattern does not know; parse row by row
+        parsed = text.map(lambda v: pd.to_datetime(v, errors="coerce"))
+        parsed = pd.to_datetime(parsed.map(lambda v: v.tz_convert("UTC").tz_localize(None) if getattr(v, "tz", None) else v))
+    if parsed.dt.tz is not None:
+        return parsed.dt.tz_convert("UTC").dt.tz_localize(None), True
+    return parsed, False
+
+
+def to_utc_datetime64(values, tz=None):
+    """
+    Parse a column of timestamps into naive-UTC `datetime64[ns]`.
+
+    Each value is handled on its own: one with an explicit UTC offset is
+    converted directly, a naive one is localized to `tz` when given (wall
+    times that do not exist or are ambiguous because of a DST change become
+    NaT), otherwise taken as-is. Unparseable values become NaT. Numeric
+    columns raise ValueError rather than being read as epoch nanoseconds.
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        raise ValueError("expected timestamps, got a numeric column")
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if series.dt.tz is not None:
+            return series.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+        return _localize(series, tz).to_numpy(dtype="datetime64[ns]")
+
+    # Only strings (and date/datetime objects, via isoformat) are timestamps; numbers become NaT
+    text = [v.isoformat() if hasattr(v, "isoformat") else v for v in series.tolist()]
+    text = pd.Series([v.strip() if isinstance(v, str) else None for v in text], index=series.index, dtype=object)
+    aware = np.array([v is not None and _OFFSET_PATTERN.search(v) is not None for v in text], dtype=bool)
+
+    result = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    if aware.any():
+        result[aware] = pd.to_datetime(text[aware], errors="coerce", format="mixed", utc=True).dt.tz_localize(None)
+    if (~aware).any():
+        parsed, had_offsets = _parse_naive(text[~aware])
+        result[~aware] = parsed if had_offsets else _localize(parsed, tz)
+    return result.to_numpy(dtype="datetime64[ns]")
+
+
+def compute_batch(start, end, tz=None):
+    """
+    Compute intervals for paired start/end timestamp columns.
+
+    Returns a dict of NumPy arrays: total_seconds (NaN where either end is
+    missing or invalid), days/hours/minutes breakdown (-1 where the interval
+    is invalid or negative), and boolean `negative` and `invalid` flags.
+    """
+    start64 = to_utc_datetime64(start, tz)
+    end64 = to_utc_datetime64(end, tz)
+
+    delta = end64 - start64                      # timedelta64[ns], NaT propagates
+    invalid = np.isnat(delta)
+    total_seconds = delta.astype("timedelta64[s]").astype(float)
+    total_seconds[invalid] = np.nan
+    negative = ~invalid & (total_seconds < 0)
+
+    valid = ~invalid & ~negative
+    seconds = np.where(valid, np.nan_to_num(total_seconds), 0).astype(np.int64)
+    days, remainder = np.divmod(seconds, SECONDS_PER_DAY)
+    hours, remainder = np.divmod(remainder, 3600)
+    minutes = remainder // 60
+
+    return {
+        "total_seconds": total_seconds,
+        "total_hours": total_seconds / 3600,
+        "days": np.where(valid, days, -1),
+        "hours": np.where(valid, hours, -1),
+        "minutes": np.where(valid, minutes, -1),
+        "negative": negative,
+        "invalid": invalid,
+    }
+
+
+def summarize(total_seconds, percentiles=PERCENTILES):
+    """Summary statistics in minutes over valid, non-negative intervals."""
+    seconds = np.asarray(total_seconds, dtype=float)
+    seconds = seconds[~np.isnan(seconds) & (seconds >= 0)]
+    if not len(seconds):
+        return {"count": 0}
+    minutes = seconds / 60
+    summary = {"count": int(len(minutes)), "mean": float(minutes.mean()), "min": float(minutes.min()), "max": float(minutes.max())}
+    for p, value in zip(percentiles, np.percentile(minutes, percentiles)):
+        summary[f"p{p}"] = float(value)
+    return summary
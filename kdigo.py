@@ -0,0 +1,281 @@
+"""
+KDIGO 2012 AKI criteria.
+
+`creatinine_criteria` / `urine_criteria` are the single-observation checks
+used by the KDIGO tab and are the reference implementation.
+`KdigoStream` is an incremental evaluator for continuous feeds of
+creatinine and urine output: every patient keeps sliding-window state
+(monotonic deques for the 48h and 7-day creatinine minimum, running sums
+for the 6/12/24h urine windows), so each new observation is handled in
+O(1) amortized time without re-scanning history. A creatinine value with
+no earlier reading in the past 7 days starts a new baseline and resets the
+creatinine stage to 0.
+"""
+import csv
+import datetime
+import io
+import sys
+from collections import deque, namedtuple
+
+CREAT_WINDOW_48H = 48.0
+CREAT_WINDOW_7D = 7 * 24.0
+UOP_WINDOWS = (6.0, 12.0, 24.0)
+
+Transition = namedtuple("Transition", ["patient_id", "time", "from_stage", "to_stage", "source"])
+
+
+def creatinine_criteria(curr_creat, base_creat, prev_creat_48h):
+    # Criterion 1: >= 1.5x baseline; Criterion 2: >= 0.3 mg/dL rise within 48h.
+    # Without a reading in the last 48h (prev_creat_48h None) criterion 2 cannot apply.
+    crit1_met = False
+    crit1_val = 0.0
+    if base_creat > 0:
+        crit1_val = curr_creat / base_creat
+        if crit1_val >= 1.5:
+            crit1_met = True
+
+    crit2_met = False
+    crit2_diff = None
+    if prev_creat_48h is not None:
+        crit2_diff = curr_creat - prev_creat_48h
+        if crit2_diff >= 0.3:
+            crit2_met = True
+
+    return crit1_met, crit1_val, crit2_met, crit2_diff
+
+
+def urine_criteria(u_vol, weight, duration_hrs):
+    # Criterion 3: urine output < 0.5 mL/kg/h over the collection period
+    uop_rate = u_vol / weight / duration_hrs
+    crit3_met = False
+    if uop_rate < 0.5:
+        crit3_met = True
+    return crit3_met, uop_rate
+
+
+def evaluate_criteria(curr_creat, base_creat, prev_creat_48h, u_vol, weight, duration_hrs):
+    crit1_met, crit1_val, crit2_met, crit2_diff = creatinine_criteria(curr_creat, base_creat, prev_creat_48h)
+    crit3_met, uop_rate = urine_criteria(u_vol, weight, duration_hrs)
+    return {
+        "crit1_met": crit1_met,
+        "crit1_val": crit1_val,
+        "crit2_met": crit2_met,
+        "crit2_diff": crit2_diff,
+        "crit3_met": crit3_met,
+        "uop_rate": uop_rate,
+        "is_aki": crit1_met or crit2_met or crit3_met,
+    }
+
+
+def format_summary(curr_creat, base_creat, prev_creat_48h, u_vol, duration_hrs, result):
+    """Plain-text summary of an `evaluate_criteria` result, as shown in the KDIGO tab."""
+    return (
+        f"Current Creatinine: {curr_creat} mg/dL\n"
+        f"Baseline Creatinine: {base_creat} mg/dL (Ratio: {result['crit1_val']:.2f})\n"
+        f"Previous Creatinine (48h): {prev_creat_48h} mg/dL (Diff: {result['crit2_diff']:.2f})\n"
+        f"Urine Output: {u_vol} mL over {duration_hrs}h (Rate: {result['uop_rate']:.3f} ml/kg/hr)\n"
+        f"KDIGO AKI Status: {'MET' if result['is_aki'] else 'NOT MET'}"
+    )
+
+
+def creatinine_stage(curr_creat, base_creat, prev_creat_48h):
+    crit1_met, ratio, crit2_met, _ = creatinine_criteria(curr_creat, base_creat, prev_creat_48h)
+    if not (crit1_met or crit2_met):
+        return 0
+    if ratio >= 3.0 or curr_creat >= 4.0:
+        return 3
+    if ratio >= 2.0:
+        return 2
+    return 1
+
+
+def urine_stage(sums, weight):
+    # sums maps window length (hours) -> urine volume over that window, or None if not yet covered
+    sum6, sum12, sum24 = (sums.get(w) for w in UOP_WINDOWS)
+    if (sum24 is not None and sum24 / weight / 24.0 < 0.3) or sum12 == 0:
+        return 3
+    if sum12 is not None and urine_criteria(sum12, weight, 12.0)[0]:
+        return 2
+    if sum6 is not None and urine_criteria(sum6, weight, 6.0)[0]:
+        return 1
+    return 0
+
+
+def to_hours(t):
+    # Timestamps may be datetimes, ISO strings or plain numbers of hours
+    if isinstance(t, datetime.datetime):
+        return t.timestamp() / 3600.0
+    if isinstance(t, str):
+        try:
+            return float(t)
+        except ValueError:
+            return datetime.datetime.fromisoformat(t).timestamp() / 3600.0
+    return float(t)
+
+
+class _WindowMin:
+    __slots__ = ("window", "items")
+
+    def __init__(self, window):
+        self.window = window
+        self.items = deque()  # (t, value) with strictly increasing values
+
+    def push(self, t, value):
+        items = self.items
+        while items and items[-1][1] >= value:
+            items.pop()
+        items.append((t, value))
+
+    def expire(self, now):
+        items = self.items
+        while items and items[0][0] < now - self.window:
+            items.popleft()
+
+    def min(self):
+        return self.items[0][1] if self.items else None
+
+
+class _WindowSum:
+    __slots__ = ("window", "items", "total")
+
+    def __init__(self, window):
+        self.window = window
+        self.items = deque()
+        self.total = 0.0
+
+    def push(self, t, value):
+        self.items.append((t, value))
+        self.total += value
+
+    def expire(self, now):
+        items = self.items
+        while items and items[0][0] <= now - self.window:
+            self.total -= items.popleft()[1]
+
+
+class _PatientState:
+    __slots__ = ("weight", "creat_48h", "creat_7d", "uop", "uop_start", "creat_stage", "uop_stage", "stage")
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.creat_48h = _WindowMin(CREAT_WINDOW_48H)
+        self.creat_7d = _WindowMin(CREAT_WINDOW_7D)
+        self.uop = [_WindowSum(w) for w in UOP_WINDOWS]
+        self.uop_start = None
+        self.creat_stage = 0
+        self.uop_stage = 0
+        self.stage = 0
+
+
+class KdigoStream:
+    """
+    Incremental KDIGO staging over per-patient observation streams.
+
+    Observations for a patient must arrive in time order. Each `add_*`
+    call returns a `Transition` when the patient's stage changes, else None.
+    """
+
+    def __init__(self, default_weight=70.0):
+        self.default_weight = default_weight
+        self.patients = {}
+
+    def _state(self, patient_id, weight=None):
+        state = self.patients.get(patient_id)
+        if state is None:
+            state = self.patients[patient_id] = _PatientState(weight or self.default_weight)
+        elif weight:
+            state.weight = weight
+        return state
+
+    def _update(self, patient_id, t, state, source):
+        stage = max(state.creat_stage, state.uop_stage)
+        if stage == state.stage:
+            return None
+        transition = Transition(patient_id, t, state.stage, stage, source)
+        state.stage = stage
+        return transition
+
+    def add_creatinine(self, patient_id, t, value, weight=None):
+        state = self._state(patient_id, weight)
+        now = to_hours(t)
+        state.creat_48h.expire(now)
+        state.creat_7d.expire(now)
+
+        # Compare against prior values only, then add the new one to the windows
+        base = state.creat_7d.min()
+        prev = state.creat_48h.min()
+        # With no reading in the past 7 days this value starts a new baseline, so an
+        # old stage must not linger: there is no current creatinine evidence of AKI
+        state.creat_stage = creatinine_stage(value, base, prev) if base is not None else 0
+        state.creat_48h.push(now, value)
+        state.creat_7d.push(now, value)
+        return self._update(patient_id, t, state, "creatinine")
+
+    def add_urine(self, patient_id, t, volume_ml, weight=None):
+        state = self._state(patient_id, weight)
+        now = to_hours(t)
+        if state.uop_start is None:
+            # The first sample only marks the start of monitoring
+            state.uop_start = now
+            return None
+
+        sums = {}
+        for window in state.uop:
+            window.push(now, volume_ml)
+            window.expire(now)
+            sums[window.window] = window.total if now - state.uop_start >= window.window else None
+        state.uop_stage = urine_stage(sums, state.weight)
+        return self._update(patient_id, t, state, "urine")
+
+    def process(self, observations):
+        """Consume (patient_id, time, creatinine, urine_ml, weight) rows and yield transitions."""
+        for patient_id, t, creat, urine, weight in observations:
+            if creat is not None:
+                transition = self.add_creatinine(patient_id, t, creat, weight)
+                if transition:
+                    yield transition
+            if urine is not None:
+                transition = self.add_urine(patient_id, t, urine, weight)
+                if transition:
+                    yield transition
+
+    def stages(self):
+        return {patient_id: state.stage for patient_id, state in self.patients.items()}
+
+
+def _optional_float(value):
+    if value is None or value.strip() == "":
+        return None
+    return float(value)
+
+
+def iter_csv(fileobj):
+    """
+    Stream observation rows from a CSV without loading it into memory.
+
+    Expected columns: patient_id, time, and any of creatinine (mg/dL),
+    urine_ml (volume since the previous urine sample) and weight (kg).
+    """
+    if isinstance(fileobj, (bytes, bytearray)):
+        fileobj = io.StringIO(fileobj.decode("utf-8"))
+    elif not isinstance(fileobj, io.TextIOBase):
+        fileobj = io.TextIOWrapper(fileobj, encoding="utf-8")
+
+    for row in csv.DictReader(fileobj):
+        yield (
+            row["patient_id"],
+            row["time"],
+            _optional_float(row.get("creatinine")),
+            _optional_float(row.get("urine_ml")),
+            _optional_float(row.get("weight")),
+        )
+
+
+if __name__ == "__main__":
+    # python kdigo.py observations.csv > transitions.csv
+    stream = KdigoStream()
+    writer = csv.writer(sys.stdout)
+    writer.writerow(Transition._fields)
+    with open(sys.argv[1], newline="") as f:
+        for transition in stream.process(iter_csv(f)):
+            writer.writerow(transition)
@@ -0,0 +1,361 @@
+"""
+Append-only history of calculator results.
+
+SOFA, KDIGO and time interval results that a user saves (from the
+calculator tabs or a batch upload) are appended to an SQLite log in WAL mode, indexed by patient
+ID, encounter ID and time, so one patient's history is an index range scan
+however large the log grows. Rows can only be inserted; triggers reject
+updates and deletes.
+
+Writes never block the caller: `record` puts the row on a queue and a
+single writer thread inserts whatever has accumulated in one transaction,
+so many concurrent sessions share a few commits per second instead of one
+fsync per result. Reads do not wait for the queue; a caller that needs its
+own rows to be visible waits on the event `record` returns.
+
+    python result_log.py --sessions 32 --results 2000
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import timing
+
+DEFAULT_PATH = os.path.join(".cache", "result_log.sqlite3")
+KINDS = ("sofa", "kdigo", "interval")
+EXPORT_COLUMNS = ["id", "recorded", "kind", "source", "patient_id", "encounter_id", "summary", "inputs", "outputs"]
+
+_INSERT = (
+    "INSERT INTO results (recorded, kind, source, patient_id, encounter_id, summary, inputs, outputs)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _json_default(value):
+    # numpy scalars and pandas timestamps from the batch paths
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def to_json(value):
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def clean_id(value):
+    # Blank cells and NaN from a census file mean "no ID"
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+class Written(threading.Event):
+    """Set once queued rows are committed or have failed; `error` says why they were not written."""
+
+    def __init__(self):
+        super().__init__()
+        self.error = None
+
+
+class ResultLog:
+    def __init__(self, path=DEFAULT_PATH, batch_size=500, max_wait=0.1):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, recorded REAL NOT NULL, kind TEXT NOT NULL,"
+                " source TEXT NOT NULL, patient_id TEXT, encounter_id TEXT, summary TEXT,"
+                " inputs TEXT NOT NULL, outputs TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_patient ON results (patient_id, recorded)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_encounter ON results (encounter_id, recorded)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_recorded ON results (recorded)")
+            for action in ("UPDATE", "DELETE"):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS results_no_{action.lower()} BEFORE {action} ON results"
+                    " BEGIN SELECT RAISE(ABORT, 'the result log is append-only'); END"
+                )
+        self.queue = queue.Queue()
+        self.written = 0
+        self.commits = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, name="result-log-writer", daemon=True)
+        self.thread.start()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, kind, inputs, outputs, summary=None, patient_id=None, encounter_id=None, source="calculator", recorded=None):
+        """Queue one result for writing; see `record_many` for the returned event."""
+        return self.record_many([dict(
+            kind=kind, inputs=inputs, outputs=outputs, summary=summary,
+            patient_id=patient_id, encounter_id=encounter_id, source=source, recorded=recorded,
+        )])
+
+    def record_many(self, entries):
+        """
+        Queue dicts with the same keys as `record`'s arguments (a batch job's
+        rows). Returns immediately with a `Written` event that is set once
+        the rows have been committed, or with its `error` set once they
+        could not be.
+        """
+        now = time.time()
+        rows = []
+        for entry in entries:
+            if entry["kind"] not in KINDS:
+                raise ValueError(f"unknown result kind: {entry['kind']}")
+            rows.append((
+                entry.get("recorded") or now, entry["kind"], entry.get("source") or "calculator",
+                clean_id(entry.get("patient_id")), clean_id(entry.get("encounter_id")), entry.get("summary"),
+                to_json(entry.get("inputs") or {}), to_json(entry.get("outputs") or {}),
+            ))
+        done = Written()
+        if rows and not self.thread.is_alive():
+            done.error = self.error or "the result log writer has stopped"
+            done.set()
+        elif rows:
+            self.queue.put((rows, done))
+        else:
+            done.set()
+        return done
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # WAL makes NORMAL durable against application crashes; only an OS crash can lose the last commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            pending = [self.queue.get()]
+            if pending[0] is None:
+                self.queue.task_done()
+                break
+            # Give concurrent sessions a moment to add to the same transaction
+            n_rows = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while n_rows < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    self.queue.task_done()
+                    break
+                pending.append(item)
+                n_rows += len(item[0])
+            try:
+                with timing.span("file", op="result_log_commit"), conn:
+                    for rows, _ in pending:
+                        conn.executemany(_INSERT, rows)
+                self.written += n_rows
+                self.commits += 1
+            except Exception as e:
+                # Keep the writer alive; the error is shown in the history panel and to the savers
+                self.error = f"{type(e).__name__}: {e}"
+                for _, done in pending:
+                    done.error = self.error
+            finally:
+                for _, done in pending:
+                    done.set()
+                    self.queue.task_done()
+            if stop:
+                break
+        conn.close()
+
+    def flush(self):
+        """Wait until everything queued so far has been written."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _where(self, patient_id=None, encounter_id=None, kind=None, since=None, until=None):
+        clauses, params = [], []
+        for column, value in (("patient_id", patient_id), ("encounter_id", encounter_id), ("kind", kind)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("recorded >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("recorded < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def history(self, patient_id=None, encounter_id=None, kind=None, since=None, until=None, limit=1000):
+        """
+        Newest-first results as dicts (inputs/outputs decoded), filtered by
+        any of the arguments. Rows still on the write queue are not included.
+        """
+        where, params = self._where(patient_id, encounter_id, kind, since, until)
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT * FROM results{where} ORDER BY recorded DESC, id DESC LIMIT ?", params + [limit]
+            ).fetchall()
+        history = []
+        for row in rows:
+            entry = dict(row)
+            entry["inputs"] = json.loads(entry["inputs"])
+            entry["outputs"] = json.loads(entry["outputs"])
+            history.append(entry)
+        return history
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+
+    def export_csv(self, fileobj, **filters):
+        """
+        Write matching results oldest first as CSV to a text file object and
+        return the row count. Rows are streamed from the cursor, so exporting
+        a long history to a file does not load it into memory.
+        """
+        where, params = self._where(**filters)
+        writer = csv.writer(fileobj)
+        writer.writerow(EXPORT_COLUMNS)
+        n = 0
+        with self._connect() as conn:
+            cursor = conn.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM results{where} ORDER BY recorded, id", params)
+            for row in cursor:
+                writer.writerow((row[0], _iso(row[1])) + row[2:])
+                n += 1
+        return n
+
+    def export_csv_bytes(self, **filters):
+        """
+        The same CSV as bytes, for `st.download_button`, which needs the whole
+        file in memory. Use `export_csv` with a file to stream a large export.
+        """
+        buffer = io.BytesIO()
+        # Encode while writing, so there is no second full copy as a str
+        text = io.TextIOWrapper(buffer, encoding="utf-8", newline="", write_through=True)
+        self.export_csv(text, **filters)
+        text.detach()
+        return buffer.getvalue()
+
+
+def _iso(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp % 1 * 1000):03d}"
+
+
+def _synthetic_entry(rng, patients):
+    kind = rng.choice(KINDS)
+    patient = rng.randrange(patients)
+    if kind == "sofa":
+        outputs = {organ: rng.randint(0, 4) for organ in ("respiration", "coagulation", "liver", "cardiovascular", "cns", "renal")}
+        outputs["total"] = sum(outputs.values())
+        inputs = {"pao2_fio2": rng.uniform(60, 500), "platelets": rng.uniform(5, 400), "gcs": rng.randint(3, 15)}
+    elif kind == "kdigo":
+        inputs = {"curr_creat": rng.uniform(0.5, 4), "base_creat": rng.uniform(0.5, 1.5), "u_vol": rng.uniform(0, 1500)}
+        outputs = {"is_aki": rng.random() < 0.3, "uop_rate": rng.uniform(0, 2)}
+    else:
+        inputs = {"start": "2024-03-09T20:00", "end": "2024-03-10T08:00", "tz": "America/New_York"}
+        outputs = {"total_seconds": rng.randint(0, 10 ** 6)}
+    return dict(kind=kind, inputs=inputs, outputs=outputs, summary=f"{kind} result", patient_id=f"P{patient:06d}", encounter_id=f"E{patient:06d}-1")
+
+
+def _session(log, seed, results, patients, per_call):
+    rng = random.Random(seed)
+    for _ in range(results // per_call):
+        log.record_many([_synthetic_entry(rng, patients) for _ in range(per_call)])
+
+
+def _direct_session(path, seed, results, patients):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path, timeout=60)
+    for _ in range(results):
+        entry = _synthetic_entry(rng, patients)
+        with conn:
+            conn.execute(_INSERT, (time.time(), entry["kind"], "calculator", entry["patient_id"], entry["encounter_id"],
+                                   entry["summary"], to_json(entry["inputs"]), to_json(entry["outputs"])))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent writes and per-patient queries of the result log.")
+    parser.add_argument("--sessions", type=int, default=32, help="concurrent writer threads")
+    parser.add_argument("--results", type=int, default=2000, help="results recorded per session")
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="result-log-bench-")
+    try:
+        # Baseline: every session inserts and commits its own results, as a naive per-rerun insert would
+        baseline = ResultLog(os.path.join(workdir, "direct.sqlite3"))
+        baseline.close()
+        n = max(1, min(args.results, 20000 // args.sessions))
+        started = time.perf_counter()
+        threads = [threading.Thread(target=_direct_session, args=(baseline.path, i, n, args.patients)) for i in range(args.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        print(f"one commit per result:  {n * args.sessions:,} results from {args.sessions} sessions in {elapsed:.2f}s "
+              f"({n * args.sessions / elapsed:,.0f}/s)")
+
+        log = ResultLog(os.path.join(workdir, "results.sqlite3"))
+        started = time.perf_counter()
+        threads = [threading.Thread(target=_session, args=(log, i, args.results, args.patients, 1)) for i in range(args.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.flush()
+        elapsed = time.perf_counter() - started
+        print(f"batched writer:         {log.written:,} results from {args.sessions} sessions in {elapsed:.2f}s "
+              f"({log.written / elapsed:,.0f}/s, {log.written / max(1, log.commits):,.0f} results/commit)")
+
+        rng = random.Random(1)
+        latencies = []
+        for _ in range(args.queries):
+            patient = f"P{rng.randrange(args.patients):06d}"
+            started = time.perf_counter()
+            log.history(patient_id=patient)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        pct = lambda p: timing.percentile(latencies, p) * 1000
+        print(f"{args.queries:,} per-patient history queries: p50 {pct(50):.2f} ms · p95 {pct(95):.2f} ms · p99 {pct(99):.2f} ms")
+
+        started = time.perf_counter()
+        exported = log.export_csv(io.StringIO())
+        elapsed = time.perf_counter() - started
+        print(f"full CSV export: {exported:,} rows in {elapsed:.2f}s ({exported / elapsed:,.0f} rows/s)")
+        log.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
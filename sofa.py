@@ -0,0 +1,195 @@
+"""
+Vectorized SOFA scoring over raw (un-binned) values.
+
+This module has no Streamlit dependency so it can be used for whole ICU
+census files as well as from the calculator tab. Every input is a column
+(list, NumPy array or pandas Series) and every organ is binned in one
+`np.searchsorted` pass against a threshold array, so scoring 100k+ rows is
+a handful of array operations rather than a Python loop per patient.
+
+Missing values (NaN / absent columns) score 0 for that organ, which is the
+usual convention for an unmeasured organ system. A missing `resp_support`
+means "not recorded" and does not cap the respiration score (as in
+`sofa_tracker`); only an explicit 0/False caps it at 2. Either way a row
+scores the same alone or in any batch.
+"""
+import numpy as np
+
+# Input columns understood by score_batch (all optional)
+INPUT_COLUMNS = (
+    "pao2_fio2",        # PaO2/FiO2 ratio, mmHg
+    "resp_support",     # 1/True if on mechanical ventilation / CPAP, 0/False if not; missing = not recorded
+    "platelets",        # ×10³/µL
+    "bilirubin",        # mg/dL
+    "map",              # mean arterial pressure, mmHg
+    "dopamine",         # µg/kg/min
+    "dobutamine",       # µg/kg/min (any dose)
+    "epinephrine",      # µg/kg/min
+    "norepinephrine",   # µg/kg/min
+    "gcs",              # Glasgow Coma Scale
+    "creatinine",       # mg/dL
+    "urine_output",     # mL/day
+)
+
+ORGANS = ("respiration", "coagulation", "liver", "cardiovascular", "cns", "renal")
+
+# Threshold arrays. "Descending" organs score higher as the value falls,
+# "ascending" organs score higher as the value rises.
+RESPIRATION_EDGES = np.array([100.0, 200.0, 300.0, 400.0])
+COAGULATION_EDGES = np.array([20.0, 50.0, 100.0, 150.0])
+CNS_EDGES = np.array([6.0, 10.0, 13.0, 15.0])
+LIVER_EDGES = np.array([1.2, 2.0, 6.0, 12.0])
+RENAL_EDGES = np.array([1.2, 2.0, 3.5, 5.0])
+
+# Vasopressor dose edges (side="left": a dose equal to the edge stays in the lower band)
+DOPAMINE_EDGES = np.array([0.0, 5.0, 15.0])
+DOPAMINE_POINTS = np.array([0, 2, 3, 4])
+CATECHOLAMINE_EDGES = np.array([0.0, 0.1])
+CATECHOLAMINE_POINTS = np.array([0, 3, 4])
+
+# Urine output (mL/day) overrides for the renal score (side="right": < 500 scores 3, < 200 scores 4)
+UOP_EDGES = np.array([200.0, 500.0])
+UOP_POINTS = np.array([4, 3, 0])
+
+# Mortality bands keyed on the upper bound of each total score range
+MORTALITY_EDGES = np.array([1, 3, 5, 7, 9, 11, 14])
+MORTALITY_LABELS = np.array(["0.0%", "6.4%", "20.2%", "21.5%", "33.3%", "50.0%", "95.2%", ">95.2%"])
+
+
+def _column(data, name, n):
+    if name in data:
+        return np.asarray(data[name], dtype=float)
+    return np.full(n, np.nan)
+
+
+def _n_rows(data):
+    for name in INPUT_COLUMNS:
+        if name in data:
+            return len(data[name])
+    return 0
+
+
+def _descending(values, edges):
+    points = len(edges) - np.searchsorted(edges, values, side="right")
+    return np.where(np.isnan(values), 0, points)
+
+
+def _ascending(values, edges):
+    points = np.searchsorted(edges, values, side="right")
+    return np.where(np.isnan(values), 0, points)
+
+
+def _lookup(values, edges, points, side="left"):
+    scored = points[np.searchsorted(edges, np.nan_to_num(values, nan=0.0), side=side)]
+    return np.where(np.isnan(values), 0, scored)
+
+
+def score_respiration(pao2_fio2, resp_support=None):
+    pf = np.asarray(pao2_fio2, dtype=float)
+    points = _descending(pf, RESPIRATION_EDGES)
+    if resp_support is not None:
+        # 3 and 4 points require respiratory support; an explicit "no support" caps the ratio at 2.
+        # NaN (not recorded) is left uncapped, the same as an absent column.
+        support = np.asarray(resp_support, dtype=float)
+        unsupported = ~np.isnan(support) & (support <= 0)
+        points = np.where(unsupported, np.minimum(points, 2), points)
+    return points
+
+
+def score_coagulation(platelets):
+    return _descending(np.asarray(platelets, dtype=float), COAGULATION_EDGES)
+
+
+def score_liver(bilirubin):
+    return _ascending(np.asarray(bilirubin, dtype=float), LIVER_EDGES)
+
+
+def score_cardiovascular(map_mmhg, dopamine, dobutamine, epinephrine, norepinephrine):
+    map_mmhg = np.asarray(map_mmhg, dtype=float)
+    points = np.where(map_mmhg < 70, 1, 0)
+    points = np.maximum(points, _lookup(np.asarray(dopamine, dtype=float), DOPAMINE_EDGES, DOPAMINE_POINTS))
+    points = np.maximum(points, np.where(np.nan_to_num(np.asarray(dobutamine, dtype=float)) > 0, 2, 0))
+    points = np.maximum(points, _lookup(np.asarray(epinephrine, dtype=float), CATECHOLAMINE_EDGES, CATECHOLAMINE_POINTS))
+    points = np.maximum(points, _lookup(np.asarray(norepinephrine, dtype=float), CATECHOLAMINE_EDGES, CATECHOLAMINE_POINTS))
+    return points
+
+
+def score_cns(gcs):
+    return _descending(np.asarray(gcs, dtype=float), CNS_EDGES)
+
+
+def score_renal(creatinine, urine_output=None):
+    points = _ascending(np.asarray(creatinine, dtype=float), RENAL_EDGES)
+    if urine_output is not None:
+        points = np.maximum(points, _lookup(np.asarray(urine_output, dtype=float), UOP_EDGES, UOP_POINTS, side="right"))
+    return points
+
+
+def mortality_band(total_score):
+    """Map total SOFA score(s) to the predicted mortality label(s)."""
+    totals = np.asarray(total_score)
+    labels = MORTALITY_LABELS[np.searchsorted(MORTALITY_EDGES, totals, side="left")]
+    return labels if labels.ndim else str(labels)
+
+
+def score_batch(data):
+    """
+    Score every row of a columnar table of raw values.
+
+    `data` is any mapping of column name -> array-like (a dict or a pandas
+    DataFrame). Returns a dict of NumPy arrays with one entry per organ,
+    plus "total" and "mortality".
+    """
+    n = _n_rows(data)
+    col = lambda name: _column(data, name, n)
+
+    scores = {
+        "respiration": score_respiration(col("pao2_fio2"), data["resp_support"] if "resp_support" in data else None),
+        "coagulation": score_coagulation(col("platelets")),
+        "liver": score_liver(col("bilirubin")),
+        "cardiovascular": score_cardiovascular(col("map"), col("dopamine"), col("dobutamine"), col("epinephrine"), col("norepinephrine")),
+        "cns": score_cns(col("gcs")),
+        "renal": score_renal(col("creatinine"), col("urine_output")),
+    }
+    total = np.zeros(n, dtype=int)
+    for organ in ORGANS:
+        scores[organ] = scores[organ].astype(int)
+        total += scores[organ]
+    scores["total"] = total
+    scores["mortality"] = mortality_band(total)
+    return scores
+
+
+def rows_to_columns(rows):
+    """Turn a list of per-patient dicts into columns (NaN where a value is missing)."""
+    columns = {}
+    for name in INPUT_COLUMNS:
+        if any(name in row for row in rows):
+            columns[name] = [np.nan if row.get(name) is None else row[name] for row in rows]
+    if not columns:
+        columns["pao2_fio2"] = [np.nan] * len(rows)
+    return columns
+
+
+def score_patient(values):
+    """Score one patient's raw values; returns plain ints plus the mortality label."""
+    scores = score_batch(rows_to_columns([values]))
+    result = {organ: int(scores[organ][0]) for organ in ORGANS}
+    result["total"] = int(scores["total"][0])
+    result["mortality"] = str(scores["mortality"][0])
+    return result
+
+
+def format_summary(scores):
+    """Plain-text summary of per-organ points, as shown in the SOFA tab."""
+    total = scores.get("total", sum(scores[organ] for organ in ORGANS))
+    return (
+        "SOFA SCORE\n"
+        f"PaO2/FIO2 - {scores['respiration']}\n"
+        f"Platelet count - {scores['coagulation']}\n"
+        f"Bilirubin (mg/dL) - {scores['liver']}\n"
+        f"MAP (mmHg) or vasopressor - {scores['cardiovascular']}\n"
+        f"Glasgow Coma Scale Score - {scores['cns']}\n"
+        f"Creatinine (mg/dl)- {scores['renal']}\n"
+        f"Total - {total}"
+    )
@@ -0,0 +1,83 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import api
+
+
+def test_interval_unknown_tz_is_a_request_error():
+    item = {"start": "2024-03-09T20:00", "end": "2024-03-10T08:00", "tz": "Mars/Olympus_Mons"}
+    with pytest.raises(api.RequestError, match="unknown time zone"):
+        api.score_interval([item])
+    with pytest.raises(api.RequestError):
+        api.score_interval([item, dict(item, tz="UTC")])
+
+
+def test_interval_across_dst():
+    item = {"start": "2024-03-09T20:00", "end": "2024-03-10T08:00", "tz": "America/New_York"}
+    assert api.score_interval([item])[0]["total_seconds"] == 11 * 3600
+
+
+@pytest.fixture
+def server(monkeypatch):
+    def broken(items):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(api.ROUTES, "/v1/broken", broken)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), api.ScoringHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(port, path, payload):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_unknown_tz_returns_400(server):
+    status, body = _post(server, "/v1/interval", {"start": "2024-03-09T20:00", "end": "2024-03-10T08:00", "tz": "Nowhere/Town"})
+    assert status == 400 and "unknown time zone" in body["error"]
+
+
+def test_handler_crash_returns_500(server):
+    assert _post(server, "/v1/broken", {}) == (500, {"error": "internal error"})
+
+
+@pytest.mark.parametrize("start", ["2024-03-10T02:30", "2024-11-03T01:30"])
+def test_dst_gap_and_overlap_answer_the_same_alone_and_in_a_batch(server, start):
+    item = {"start": start, "end": "2024-11-03T08:00" if start.startswith("2024-11") else "2024-03-10T08:00", "tz": "America/New_York"}
+    other = {"start": "2024-01-01T00:00", "end": "2024-01-01T01:00", "tz": "America/New_York"}
+    status, alone = _post(server, "/v1/interval", item)
+    assert status == 200 and alone == {"error": "invalid or DST-ambiguous timestamp"}
+    status, batch = _post(server, "/v1/interval", [item, other])
+    assert status == 200 and batch[0] == alone and batch[1]["total_seconds"] == 3600
+
+
+def test_numeric_interval_fields_are_a_request_error():
+    with pytest.raises(api.RequestError, match="ISO timestamps"):
+        api.score_interval([{"start": 5, "end": 6}])
+
+
+@pytest.mark.parametrize("length", ["-1", "abc", "1e3", "+5", "²"])
+def test_malformed_content_length_returns_400(server, length):
+    conn = http.client.HTTPConnection("127.0.0.1", server, timeout=5)
+    conn.putrequest("POST", "/v1/interval")
+    conn.putheader("Content-Length", length)
+    conn.endheaders()
+    response = conn.getresponse()
+    assert response.status == 400 and json.loads(response.read()) == {"error": "invalid Content-Length"}
+
+
+def test_oversized_body_returns_413(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server, timeout=5)
+    conn.putrequest("POST", "/v1/interval")
+    conn.putheader("Content-Length", str(api.MAX_BODY_BYTES + 1))
+    conn.endheaders()
+    assert conn.getresponse().status == 413
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import batch_extract
+import extractor
+
+
+class _CountingModel(batch_extract.StubModel):
+    def __init__(self, latency):
+        super().__init__(latency=latency, jitter=0.0)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self.lock:
+            self.calls += 1
+        return super().generate_content(prompt, stream)
+
+
+class _CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+def test_closing_early_stops_sending_notes():
+    model = _CountingModel(latency=0.2)
+    results = batch_extract.run_batch([(f"d{i}", f"on heparin {i}") for i in range(40)], model, concurrency=4)
+    next(results)
+    started = time.monotonic()
+    results.close()
+    assert time.monotonic() - started < 0.5
+    time.sleep(0.5)
+    assert model.calls <= 8
+
+
+def test_documents_are_read_lazily():
+    consumed = []
+
+    def documents():
+        for i in range(100):
+            consumed.append(i)
+            yield f"d{i}", f"on heparin {i}"
+
+    results = batch_extract.run_batch(documents(), _CountingModel(latency=0.0), concurrency=2)
+    next(results)
+    assert len(consumed) <= 6
+    assert len(list(results)) == 99
+
+
+def test_limiter_is_taken_per_chunk():
+    limiter = _CountingLimiter()
+    long_note = "\n\n".join(f"Paragraph {i}: continue heparin. " + "x" * 1000 for i in range(10))
+    chunks = len(extractor.split_text(long_note))
+    assert chunks > 1
+    [result] = batch_extract.run_batch([("long", long_note)], _CountingModel(latency=0.0), limiter=limiter)
+    assert result.error is None and limiter.acquired == chunks
@@ -0,0 +1,57 @@
+import io
+
+import pytest
+
+import doc_search
+import upload_store
+
+
+@pytest.fixture
+def index(tmp_path):
+    return doc_search.SearchIndex(str(tmp_path))
+
+
+def test_match_query_prefixes_the_last_word():
+    assert doc_search.to_match_query("atrial fib") == '"atrial" "fib"*'
+    assert doc_search.to_match_query('"); DROP --') == '"DROP"*'
+    assert doc_search.to_match_query("  ...  ") is None
+
+
+def test_search_is_stemmed_and_ranked(index):
+    index.add_many([
+        ("a.txt", "patient treated for infection with vancomycin"),
+        ("infections.txt", "follow up in clinic"),
+        ("b.txt", "no acute issues"),
+    ])
+    names = [hit["name"] for hit in index.search("infections")]
+    # A filename match outranks a body match
+    assert names == ["infections.txt", "a.txt"]
+    assert [hit["name"] for hit in index.search("vanco")] == ["a.txt"]
+
+
+def test_snippets_are_escaped_and_highlighted(index):
+    index.add("a.html", "<b>heparin</b> drip")
+    [hit] = index.search("heparin")
+    assert "&lt;b&gt;<mark>heparin</mark>&lt;/b&gt;" in hit["snippet"]
+
+
+def test_reindexing_a_name_replaces_it(index):
+    index.add("a.txt", "lisinopril")
+    index.add("a.txt", "amlodipine")
+    assert index.count() == 1
+    assert index.search("lisinopril") == [] and len(index.search("amlodipine")) == 1
+    index.remove("a.txt")
+    assert index.count() == 0 and index.search("amlodipine") == []
+
+
+def test_sync_follows_the_catalog(tmp_path, index):
+    store = upload_store.UploadStore(str(tmp_path))
+    store.save("kept.txt", io.BytesIO(b"apixaban for atrial fibrillation"))
+    store.save("scan.pdf", io.BytesIO(b"%PDF-1.7"))
+    index.add("gone.txt", "deleted while the index was not maintained")
+    assert index.sync(store) == (2, 1)
+    assert index.names() == {"kept.txt", "scan.pdf"}
+    # Unsupported files are indexed by name only
+    assert [hit["name"] for hit in index.search("scan")] == ["scan.pdf"]
+    assert [hit["name"] for hit in index.search("apixaban")] == ["kept.txt"]
+    assert index.sync(store) == (0, 0)
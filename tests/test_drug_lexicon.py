@@ -0,0 +1,65 @@
+import pytest
+
+import drug_lexicon
+
+LEXICON = b"""term,drug,indication
+insulin,Insulin,Diabetes / hyperglycemia
+insulin glargine,Insulin glargine,Diabetes
+heparin,Heparin,Anticoagulation
+warfarin,Warfarin,Anticoagulation
+coumadin,Warfarin,Anticoagulation
+"""
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return drug_lexicon.DrugMatcher.from_csv(LEXICON)
+
+
+def test_leftmost_longest_match_wins(matcher):
+    [match] = matcher.find("Started Insulin Glargine 10 units at night")
+    assert (match.term, match.drug) == ("Insulin Glargine", "Insulin glargine")
+
+
+def test_whole_words_only(matcher):
+    assert matcher.find("heparinized saline flush") == []
+    assert [m.drug for m in matcher.find("(heparin), then warfarin.")] == ["Heparin", "Warfarin"]
+    assert not matcher.has_candidates("no anticoagulants")
+
+
+def test_spans_point_into_the_original_text(matcher):
+    # "İ" lowercases to two characters; offsets must still index the note itself
+    text = "İV heparin"
+    [match] = matcher.find(text)
+    assert text[match.start:match.end] == "heparin" == match.term
+
+
+def test_brand_names_map_to_one_drug(matcher):
+    assert matcher.drugs("Coumadin (warfarin) 5 mg") == [
+        {"Detected Drug": "Warfarin", "Related Disease / Indication": "Anticoagulation"}
+    ]
+    assert matcher.normalize("coumadin") == "Warfarin" and matcher.normalize("Zosyn") == "Zosyn"
+
+
+def test_cross_check(matcher):
+    ai = [{"Detected Drug": "Coumadin"}, {"Detected Drug": "Lisinopril"}]
+    confirmed, ai_only, lexicon_only = drug_lexicon.cross_check(matcher, ai, "On warfarin and heparin, lisinopril held")
+    assert (confirmed, ai_only, lexicon_only) == (["Warfarin"], ["Lisinopril"], ["Heparin"])
+
+
+def test_default_lexicon_loads():
+    matcher = drug_lexicon.DrugMatcher.from_csv()
+    assert len(matcher) > 100 and matcher.normalize("tylenol") == "Acetaminophen"
+
+
+@pytest.mark.parametrize("text", ["Insulin\nglargine 10 units", "insulin  glargine", "x\t\tINSULIN \r\n GLARGINE."])
+def test_terms_match_across_whitespace_runs(matcher, text):
+    [match] = matcher.find(text)
+    assert match.drug == "Insulin glargine"
+    assert text[match.start:match.end] == match.term
+    assert " ".join(match.term.lower().split()) == "insulin glargine"
+
+
+def test_spans_after_folded_whitespace_point_into_the_original_text(matcher):
+    text = "Plan:\n\n\n  heparin   drip,\n\nthen   warfarin"
+    assert [text[m.start:m.end] for m in matcher.find(text)] == ["heparin", "warfarin"]
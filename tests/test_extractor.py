@@ -0,0 +1,77 @@
+import json
+
+import extractor
+import gemini_cache
+
+
+class _Model:
+    def __init__(self, generation_config):
+        self._generation_config = generation_config
+
+
+def test_cache_key_includes_generation_config(tmp_path):
+    cache = gemini_cache.ResponseCache(str(tmp_path / "cache.sqlite3"))
+    single = extractor.cache_key(cache, _Model(extractor.GENERATION_CONFIG), "on lisinopril")
+    batch = extractor.cache_key(cache, _Model(extractor.BATCH_GENERATION_CONFIG), "on lisinopril")
+    assert single != batch
+    # Models without a config of their own (the offline stub) use the default one
+    assert extractor.cache_key(cache, object(), "on lisinopril") == single
+
+
+def test_parse_results_rejects_non_arrays():
+    for text in ['{"Detected Drug": "Heparin"}', '"heparin"', "42", "null"]:
+        try:
+            extractor.parse_results(text)
+        except json.JSONDecodeError:
+            continue
+        raise AssertionError(f"accepted {text!r}")
+
+
+def test_extract_long_treats_object_chunk_as_failed():
+    class ObjectModel:
+        def generate_content(self, prompt):
+            return type("Response", (), {"text": '{"Detected Drug": "Heparin"}'})()
+
+    result = extractor.extract_long(ObjectModel(), "Started heparin.")
+    assert result.drugs == [] and len(result.failed) == 1
+
+
+def test_merge_results_skips_non_objects():
+    merged = extractor.merge_results([[{"Detected Drug": "Heparin", "Related Disease / Indication": "VTE"}, "x", 3]])
+    assert merged == [{"Detected Drug": "Heparin", "Related Disease / Indication": "VTE"}]
+
+
+def test_array_stream_parser_handles_any_split():
+    drugs = [
+        {"Detected Drug": "lisinopril", "Related Disease / Indication": "Hypertension {stage 2}"},
+        {"Detected Drug": "say \"hi\" \\", "Related Disease / Indication": "[nested] {\"x\": 1}", "extra": {"a": [1, {"b": 2}]}},
+        {"Detected Drug": "apixaban", "Related Disease / Indication": "AF"},
+    ]
+    text = "```json\n" + json.dumps(drugs) + "\n```"
+    for size in (1, 2, 3, 7, 64, len(text)):
+        parser = extractor.ArrayStreamParser()
+        items = []
+        for i in range(0, len(text), size):
+            items.extend(parser.feed(text[i:i + size]))
+        assert items == drugs and parser.finished and not parser.parts
+
+
+def test_array_stream_parser_stops_at_closing_bracket():
+    parser = extractor.ArrayStreamParser()
+    assert parser.feed('[{"a": 1}, {"b"') == [{"a": 1}]
+    assert parser.feed(': 2}] {"c": 3}') == [{"b": 2}]
+    assert parser.finished
+
+
+def test_streamed_extraction_keeps_response_text():
+    class _Chunk:
+        def __init__(self, text):
+            self.text = text
+
+    class _StreamModel:
+        def generate_content(self, prompt, stream=False):
+            return [_Chunk('[{"Detected Drug": "heparin", '), _Chunk('"Related Disease / Indication": "DVT"}]')]
+
+    stream = extractor.StreamedExtraction(_StreamModel(), "on heparin")
+    assert [drug["Detected Drug"] for drug in stream] == ["heparin"]
+    assert stream.complete and extractor.parse_results(stream.response_text)[0] == [{"Detected Drug": "heparin", "Related Disease / Indication": "DVT"}]
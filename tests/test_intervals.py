@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+import intervals
+
+NY = "America/New_York"
+
+
+def _dt(text):
+    return datetime.datetime.fromisoformat(text)
+
+
+def test_elapsed_seconds_across_dst():
+    assert intervals.elapsed_seconds(_dt("2024-03-09T20:00"), _dt("2024-03-10T08:00"), NY) == 11 * 3600
+    assert intervals.elapsed_seconds(_dt("2024-11-02T20:00"), _dt("2024-11-03T08:00"), NY) == 13 * 3600
+    assert intervals.elapsed_seconds(_dt("2024-03-09T20:00"), _dt("2024-03-10T08:00")) == 12 * 3600
+
+
+@pytest.mark.parametrize("start, end, problem", [
+    ("2024-03-10T02:30", "2024-03-10T08:00", "does not exist"),
+    ("2024-03-09T20:00", "2024-03-10T02:00", "does not exist"),
+    ("2024-11-03T01:30", "2024-11-03T08:00", "occurs twice"),
+])
+def test_elapsed_seconds_rejects_skipped_and_repeated_times(start, end, problem):
+    with pytest.raises(intervals.WallTimeError, match=problem):
+        intervals.elapsed_seconds(_dt(start), _dt(end), NY)
+    # The batch path flags the same rows
+    assert intervals.compute_batch([start], [end], NY)["invalid"][0]
+
+
+def test_edges_of_the_dst_gap_are_valid():
+    assert intervals.elapsed_seconds(_dt("2024-03-10T01:59"), _dt("2024-03-10T03:00"), NY) == 60
+    assert intervals.elapsed_seconds(_dt("2024-11-03T00:59"), _dt("2024-11-03T02:00"), NY) == 2 * 3600 + 60
+
+
+def test_compute_batch_localizes_naive_rows_next_to_offset_rows():
+    result = intervals.compute_batch(
+        ["2024-03-09T20:00", "2024-03-09T20:00Z", "2024-03-09"],
+        ["2024-03-10T08:00", "2024-03-10T08:00+01:00", "2024-03-11"],
+        NY,
+    )
+    assert result["total_hours"].tolist() == [11.0, 11.0, 47.0]
+    assert not result["invalid"].any()
+
+
+def test_compute_batch_matches_a_single_naive_column():
+    mixed = intervals.compute_batch(["2024-03-09T20:00", "2024-01-01T00:00+00:00"], ["2024-03-10T08:00", "2024-01-01T01:00Z"], NY)
+    alone = intervals.compute_batch(["2024-03-09T20:00"], ["2024-03-10T08:00"], NY)
+    assert mixed["total_seconds"][0] == alone["total_seconds"][0] == 11 * 3600
+
+
+def test_compute_batch_refuses_numeric_columns():
+    with pytest.raises(ValueError, match="numeric"):
+        intervals.compute_batch([1, 2], [3, 4])
+    # Stray numbers in a text column are invalid rows, not epoch nanoseconds
+    result = intervals.compute_batch(["2024-01-01T00:00", 5], ["2024-01-01T01:00", "2024-01-01T01:00"])
+    assert result["invalid"].tolist() == [False, True]
+
+
+def test_compute_batch_accepts_datetime_columns():
+    import pandas as pd
+
+    start = pd.Series(pd.to_datetime(["2024-03-09T20:00"]))
+    end = pd.Series(pd.to_datetime(["2024-03-10T08:00"])).dt.tz_localize(NY)
+    assert intervals.compute_batch(start, end, NY)["total_hours"][0] == 11.0
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+import kdigo
+
+
+def test_creatinine_criteria_thresholds():
+    assert kdigo.creatinine_criteria(1.5, 1.0, 1.5) == (True, 1.5, False, 0.0)
+    crit1_met, _, crit2_met, diff = kdigo.creatinine_criteria(1.3, 1.0, 1.0)
+    assert not crit1_met and crit2_met and diff == pytest.approx(0.3)
+    assert kdigo.creatinine_criteria(1.0, 0.0, 1.0)[:2] == (False, 0.0)
+
+
+def test_creatinine_criteria_without_48h_reading():
+    assert kdigo.creatinine_criteria(2.0, 1.0, None) == (True, 2.0, False, None)
+
+
+def test_urine_criteria_threshold():
+    assert kdigo.urine_criteria(420.0, 70.0, 12.0) == (False, 0.5)
+    assert kdigo.urine_criteria(419.0, 70.0, 12.0)[0]
+
+
+def test_stream_without_creatinine_in_last_48h():
+    stream = kdigo.KdigoStream()
+    assert stream.add_creatinine("a", 0, 1.0) is None
+    transition = stream.add_creatinine("a", 72, 2.0)
+    assert transition == kdigo.Transition("a", 72, 0, 2, "creatinine")
+
+
+def test_stage_resets_after_a_gap_in_creatinine():
+    stream = kdigo.KdigoStream()
+    stream.add_creatinine("a", 0, 1.0)
+    assert stream.add_creatinine("a", 24, 2.5).to_stage == 2
+    # Nothing in the 7 days before: a normal value starts a new baseline and clears the stage
+    transition = stream.add_creatinine("a", 224, 1.0)
+    assert transition == kdigo.Transition("a", 224, 2, 0, "creatinine")
+    assert stream.add_creatinine("a", 424, 1.0) is None
+    assert stream.stages() == {"a": 0}
+
+
+def _reference_creatinine_stage(history, t, value):
+    # Brute force over every earlier reading, using the single-observation criteria
+    base = [v for s, v in history if s >= t - kdigo.CREAT_WINDOW_7D]
+    prev = [v for s, v in history if s >= t - kdigo.CREAT_WINDOW_48H]
+    if not base:
+        return 0
+    return kdigo.creatinine_stage(value, min(base), min(prev) if prev else None)
+
+
+def _reference_urine_stage(samples, t, weight):
+    start = samples[0][0]
+    sums = {}
+    for window in kdigo.UOP_WINDOWS:
+        covered = t - start >= window
+        sums[window] = sum(v for s, v in samples[1:] if s > t - window) if covered else None
+    return kdigo.urine_stage(sums, weight)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_stream_matches_reference(seed):
+    rng = random.Random(seed)
+    weight = rng.uniform(50, 110)
+    stream = kdigo.KdigoStream(default_weight=weight)
+    creatinine, urine = [], []
+    creat_stage = uop_stage = 0
+    t = 0.0
+    for _ in range(300):
+        t += rng.choice([1.0, 1.0, 2.0, 6.0, 30.0, 200.0])
+        if rng.random() < 0.3:
+            value = round(rng.uniform(0.6, 4.5), 2)
+            creat_stage = _reference_creatinine_stage(creatinine, t, value)
+            stream.add_creatinine("p", t, value)
+            creatinine.append((t, value))
+            assert stream.patients["p"].creat_stage == creat_stage
+        else:
+            volume = rng.choice([0.0, rng.uniform(0, 30), rng.uniform(20, 120)])
+            stream.add_urine("p", t, volume)
+            urine.append((t, volume))
+            if len(urine) > 1:
+                uop_stage = _reference_urine_stage(urine, t, weight)
+            assert stream.patients["p"].uop_stage == pytest.approx(uop_stage)
+        assert stream.stages()["p"] == max(creat_stage, uop_stage)
@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+
+import batch_extract
+import extractor
+import gemini_cache
+import micro_batch
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Model:
+    """Counts calls; batched prompts get `batch_answer`, single notes an empty list."""
+
+    def __init__(self, batch_answer=None, batch_error=None):
+        self.batch_answer = batch_answer
+        self.batch_error = batch_error
+        self.batch_calls = 0
+        self.single_calls = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, prompt):
+        with self.lock:
+            if "<note id=" in prompt:
+                self.batch_calls += 1
+                if self.batch_error is not None:
+                    raise self.batch_error
+                return _Response(self.batch_answer)
+            self.single_calls += 1
+        return _Response("[]")
+
+
+def _extract_all(batcher, texts):
+    futures = [batcher.submit(text) for text in texts]
+    return [future.exception(timeout=5) or future.result() for future in futures]
+
+
+def test_transient_batch_error_reaches_every_caller_without_fallback():
+    model = _Model(batch_error=ConnectionError("429"))
+    batcher = micro_batch.MicroBatcher(model, max_wait=0.2)
+    results = _extract_all(batcher, [f"note {i}" for i in range(16)])
+    batcher.close()
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert model.batch_calls == 1 and model.single_calls == 0
+
+
+def test_unparseable_answer_falls_back_per_note():
+    model = _Model(batch_answer="not json")
+    batcher = micro_batch.MicroBatcher(model, max_wait=0.2)
+    assert _extract_all(batcher, ["a", "b", "c"]) == [[], [], []]
+    batcher.close()
+    assert model.batch_calls == 1 and model.single_calls == 3
+    assert batcher.stats.summary()["fallback_calls"] == 3
+
+
+def test_missing_ids_fall_back_only_for_those_notes():
+    model = _Model(batch_answer='[{"id": "1", "drugs": [{"Detected Drug": "Heparin"}]}]')
+    batcher = micro_batch.MicroBatcher(model, max_wait=0.2)
+    assert _extract_all(batcher, ["a", "b"]) == [[{"Detected Drug": "Heparin"}], []]
+    batcher.close()
+    assert model.single_calls == 1
+
+
+def test_cache_failure_still_resolves_every_future():
+    class _BrokenCache:
+        make_key = staticmethod(lambda *parts: repr(parts))
+
+        def get_any(self, keys):
+            return []
+
+        def put(self, key, value):
+            raise OSError("disk full")
+
+    model = _Model(batch_answer='[{"id": "1", "drugs": []}, {"id": "2", "drugs": []}]')
+    batcher = micro_batch.MicroBatcher(model, cache=_BrokenCache(), max_wait=0.2)
+    futures = [batcher.submit("a"), batcher.submit("b")]
+    for future in futures:
+        future.exception(timeout=5)  # resolved one way or the other, never left pending
+    batcher.close()
+
+
+def test_retry_recovers_from_a_transient_batch_error():
+    model = batch_extract.StubModel(latency=0.0, jitter=0.0)
+    calls = []
+    original = model.generate_content
+
+    def flaky(prompt, stream=False):
+        calls.append(prompt)
+        if len(calls) == 1:
+            raise ConnectionError("stub 429")
+        return original(prompt, stream)
+
+    model.generate_content = flaky
+    batcher = micro_batch.MicroBatcher(model, max_wait=0.05)
+    notes = [(f"n{i}", f"on heparin {i}") for i in range(4)]
+    results = list(batch_extract.run_batch(notes, model, concurrency=4, base_delay=0.01, batcher=batcher))
+    batcher.close()
+    assert all(r.error is None and r.drugs for r in results)
+    assert len(calls) <= 1 + len(notes)  # the retry, not a burst of per-note fallback calls
+
+
+def test_each_note_counts_one_cache_lookup(tmp_path):
+    cache = gemini_cache.ResponseCache(str(tmp_path / "cache.sqlite3"))
+    model = _Model(batch_answer='[{"id": "1", "drugs": [{"Detected Drug": "Heparin"}]}, {"id": "2", "drugs": []}]')
+    model._generation_config = extractor.BATCH_GENERATION_CONFIG
+    # Each note is looked up under the single-note and the batch model's keys
+    single_model = _Model()
+    batcher = micro_batch.MicroBatcher(model, single_model=single_model, cache=cache, max_wait=0.2)
+    _extract_all(batcher, ["a", "b"])
+    batcher.close()  # futures resolve before their answers are cached
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (0, 2)
+    batcher = micro_batch.MicroBatcher(model, single_model=single_model, cache=cache, max_wait=0.2)
+    assert _extract_all(batcher, ["a", "b"]) == [[{"Detected Drug": "Heparin"}], []]
+    batcher.close()
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 2)
+    assert model.batch_calls == 1
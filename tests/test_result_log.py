@@ -0,0 +1,84 @@
+import csv
+import io
+import sqlite3
+
+import pytest
+
+import result_log
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = result_log.ResultLog(str(tmp_path / "results.sqlite3"))
+    yield log
+    log.close()
+
+
+def test_record_event_is_set_once_committed(log):
+    done = log.record("sofa", {"gcs": 12}, {"total": 3}, "SOFA 3", patient_id=" P1 ")
+    assert done.wait(5)
+    [entry] = log.history(patient_id="P1")
+    assert entry["inputs"] == {"gcs": 12} and entry["outputs"] == {"total": 3}
+    assert log.count(patient_id="P1") == 1 and log.count(patient_id="P2") == 0
+
+
+def test_record_many_cleans_ids(log):
+    log.record_many([
+        dict(kind="interval", inputs={}, outputs={}, patient_id=float("nan"), encounter_id="E1"),
+        dict(kind="kdigo", inputs={}, outputs={}, patient_id="", encounter_id=None),
+    ]).wait(5)
+    assert [(e["patient_id"], e["encounter_id"]) for e in log.history()] == [(None, None), (None, "E1")]
+    assert result_log.clean_id("  ") is None and result_log.clean_id(7) == "7"
+
+
+def test_log_is_append_only(log):
+    log.record("kdigo", {}, {}).wait(5)
+    conn = sqlite3.connect(log.path)
+    for statement in ("UPDATE results SET summary = 'x'", "DELETE FROM results"):
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute(statement)
+    conn.close()
+
+
+def test_export_csv_bytes_matches_export_csv(log):
+    log.record_many([dict(kind="sofa", inputs={"note": "ä, \"quoted\""}, outputs={"total": i}, patient_id="P1") for i in range(3)]).wait(5)
+    text = io.StringIO(newline="")
+    assert log.export_csv(text, patient_id="P1") == 3
+    data = log.export_csv_bytes(patient_id="P1")
+    assert data.decode("utf-8") == text.getvalue()
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8"))))
+    assert rows[0] == result_log.EXPORT_COLUMNS and len(rows) == 4
+
+
+def test_unknown_kind_is_rejected(log):
+    with pytest.raises(ValueError):
+        log.record("apache", {}, {})
+
+
+def test_failed_commit_is_reported_on_the_event(log):
+    conn = sqlite3.connect(log.path)
+    conn.execute("DROP TABLE results")
+    conn.close()
+    written = log.record("sofa", {}, {})
+    assert written.wait(5) and "no such table" in written.error
+    assert log.error == written.error
+
+
+def test_writer_survives_unexpected_errors(log, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("disk on fire")
+
+    with monkeypatch.context() as m:
+        m.setattr(result_log.timing, "span", broken)
+        written = log.record("sofa", {}, {})
+        assert written.wait(5) and written.error == "RuntimeError: disk on fire"
+    written = log.record("sofa", {}, {})
+    assert written.wait(5) and written.error is None
+    assert log.count() == 1
+
+
+def test_record_after_close_fails_immediately(tmp_path):
+    log = result_log.ResultLog(str(tmp_path / "results.sqlite3"))
+    log.close()
+    written = log.record("sofa", {}, {})
+    assert written.is_set() and written.error
@@ -0,0 +1,44 @@
+import math
+
+import pytest
+
+import sofa
+import sofa_tracker
+
+
+@pytest.mark.parametrize("urine_output, points", [(0, 4), (199, 4), (200, 3), (499, 3), (500, 0), (2000, 0)])
+def test_urine_output_edges(urine_output, points):
+    assert sofa.score_renal([0.0], [urine_output])[0] == points
+    assert sofa_tracker.score_measurement("urine_output", urine_output) == points
+
+
+def test_missing_urine_output_scores_zero():
+    assert sofa.score_renal([0.0], [math.nan])[0] == 0
+
+
+@pytest.mark.parametrize("variable, value", [
+    ("pao2_fio2", 150), ("platelets", 45), ("bilirubin", 6.0), ("gcs", 9), ("creatinine", 3.5),
+    ("map", 65), ("dopamine", 5.0), ("norepinephrine", 0.1), ("urine_output", 200),
+])
+def test_tracker_scores_match_batch(variable, value):
+    organ = sofa_tracker.VARIABLE_ORGAN[variable]
+    assert sofa_tracker.score_measurement(variable, value) == sofa.score_batch({variable: [value]})[organ][0]
+
+
+def test_non_numeric_column_raises_value_error():
+    with pytest.raises(ValueError):
+        sofa.score_batch({"gcs": ["x", 3]})
+
+
+@pytest.mark.parametrize("support, points", [(None, 4), (math.nan, 4), (1, 4), (True, 4), (0, 2), (False, 2)])
+def test_respiration_support(support, points):
+    assert sofa.score_patient({"pao2_fio2": 80, "resp_support": support})["respiration"] == points
+
+
+def test_patient_scores_the_same_alone_and_in_a_mixed_batch():
+    patient = {"pao2_fio2": 80}
+    alone = sofa.score_batch(sofa.rows_to_columns([patient]))["respiration"][0]
+    batch = [patient, {"pao2_fio2": 80, "resp_support": 0}, {"pao2_fio2": 80, "resp_support": 1}, {"platelets": 40}]
+    mixed = sofa.score_batch(sofa.rows_to_columns(batch))["respiration"]
+    assert alone == mixed[0] == mixed[2] == 4
+    assert mixed[1] == 2 and mixed[3] == 0
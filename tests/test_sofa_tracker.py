@@ -0,0 +1,66 @@
+import io
+
+import sofa_tracker
+
+
+def test_flags_when_delta_reaches_threshold_and_clears():
+    tracker = sofa_tracker.SofaTracker()
+    assert tracker.observe("p", 0.0, "platelets", 120) is None  # 1 point
+    flag = tracker.observe("p", 1.0, "gcs", 9)  # +3 points
+    assert flag == sofa_tracker.Flag("p", 1.0, 4, 0, 4, True)
+    # Both scores fall out of the 24h window once better values are the only ones left
+    tracker.observe("p", 10.0, "platelets", 200)
+    cleared = tracker.observe("p", 25.5, "gcs", 15)
+    assert cleared is not None and not cleared.flagged and cleared.total == 0
+
+
+def test_known_baseline_is_subtracted():
+    tracker = sofa_tracker.SofaTracker()
+    tracker.set_baseline("p", 3)
+    assert tracker.observe("p", 0.0, "creatinine", 3.6) is None  # 3 points, delta 0
+    flag = tracker.observe("p", 1.0, "bilirubin", 6.5)  # +3 points
+    assert (flag.total, flag.baseline, flag.delta) == (6, 3, 3)
+
+
+def test_baseline_is_learned_after_a_full_window():
+    tracker = sofa_tracker.SofaTracker()
+    tracker.observe("p", 0.0, "platelets", 80)  # 2 points
+    assert tracker.snapshot("p")["flagged"]
+    tracker.observe("p", 30.0, "platelets", 80)
+    assert tracker.snapshot("p") == {"total": 2, "baseline": 2, "delta": 0, "flagged": False}
+
+
+def test_no_respiratory_support_caps_the_ratio():
+    tracker = sofa_tracker.SofaTracker()
+    tracker.observe("p", 0.0, "resp_support", 0)
+    tracker.observe("p", 0.0, "pao2_fio2", 80)
+    assert tracker.snapshot("p")["total"] == 2
+
+
+def test_state_stays_bounded_on_a_dense_feed():
+    tracker = sofa_tracker.SofaTracker()
+    for i in range(2000):
+        tracker.observe("p", i * 0.05, "gcs", 3 + (i * 7) % 13)
+    assert all(len(window) <= 5 for window in tracker.patients["p"].organs)
+
+
+def test_idle_patients_are_evicted():
+    tracker = sofa_tracker.SofaTracker()
+    tracker.observe("a", 0.0, "gcs", 15)
+    tracker.observe("b", 70.0, "gcs", 15)
+    assert tracker.evict_idle(now=80.0) == 1 and list(tracker.patients) == ["b"]
+
+
+def test_replay_matches_observe():
+    feed = list(sofa_tracker.synthetic_feed(20, 2, seed=1))
+    replayed = list(sofa_tracker.SofaTracker().replay(feed))
+    tracker = sofa_tracker.SofaTracker()
+    observed = [flag for flag in (tracker.observe(*row) for row in feed) if flag]
+    assert replayed == observed and replayed
+
+
+def test_iter_csv_reads_hours_and_timestamps():
+    data = b"patient_id,time,variable,value\np,1.5,gcs,9\np,2024-01-01T00:00:00,map,65\np,3,map,\n"
+    rows = list(sofa_tracker.iter_csv(io.BytesIO(data)))
+    assert [(pid, variable, value) for pid, _, variable, value in rows] == [("p", "gcs", 9.0), ("p", "map", 65.0)]
+    assert rows[0][1] == 1.5
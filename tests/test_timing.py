@@ -0,0 +1,14 @@
+import timing
+
+
+def test_percentile_is_nearest_rank():
+    samples = [float(i) for i in range(1, 101)]
+    assert [timing.percentile(samples, p) for p in (0, 50, 95, 99, 100)] == [1.0, 51.0, 96.0, 100.0, 100.0]
+    assert timing.percentile([], 50) == 0.0 and timing.percentile([3.0], 99) == 3.0
+
+
+def test_histogram_uses_recent_samples():
+    histogram = timing.Histogram()
+    for seconds in (0.3, 0.1, 0.2):
+        histogram.observe(seconds)
+    assert histogram.percentile(50) == 0.2 and histogram.max == 0.3
@@ -0,0 +1,231 @@
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import upload_store
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NOTE = b"Started metformin 500 mg twice daily. " * 200
+
+
+def blob_files(store):
+    return sorted(
+        name for _, _, names in os.walk(store.blob_root) for name in names if not name.startswith(".tmp-")
+    )
+
+
+def set_accessed(store, name, accessed):
+    with store._connect() as conn:
+        conn.execute("UPDATE documents SET accessed = ? WHERE name = ?", (accessed, name))
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path))
+    first = store.save("a.txt", io.BytesIO(NOTE))
+    again = store.save("a.txt", io.BytesIO(NOTE))
+    other_name = store.save("b.txt", io.BytesIO(NOTE))
+    assert first[2] and not again[2] and other_name[2]
+    assert first[1] == again[1] == other_name[1]
+    assert len(blob_files(store)) == 1
+    assert store.count() == 2
+    assert store.storage_stats()["unique_bytes"] == len(NOTE)
+
+
+def test_different_content_under_a_taken_name_is_kept(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path))
+    store.save("a.txt", io.BytesIO(b"one"))
+    stored_name, _, is_new = store.save("a.txt", io.BytesIO(b"two"))
+    assert (stored_name, is_new) == ("a (2).txt", True)
+    assert store.read_bytes("a.txt") == b"one" and store.read_bytes("a (2).txt") == b"two"
+
+
+def test_blob_is_removed_with_its_last_name(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path))
+    store.save("a.txt", io.BytesIO(NOTE))
+    store.save("b.txt", io.BytesIO(NOTE))
+    store.delete("a.txt")
+    assert len(blob_files(store)) == 1
+    assert store.read_bytes("b.txt") == NOTE
+    store.delete("b.txt")
+    assert blob_files(store) == [] and store.count() == 0
+    store.delete("b.txt")  # deleting a missing name is a no-op
+
+
+def test_quota_rejects_and_rolls_back(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path), quota_bytes=100)
+    store.save("small.txt", io.BytesIO(b"x" * 60))
+    with pytest.raises(upload_store.QuotaExceeded):
+        store.save("big.txt", io.BytesIO(b"y" * 60))
+    assert store.usage() == 60
+    assert [doc["name"] for doc in store.list()] == ["small.txt"]
+    assert len(blob_files(store)) == 1
+    # A second name for content that is already stored still counts towards the quota
+    with pytest.raises(upload_store.QuotaExceeded):
+        store.save("copy.txt", io.BytesIO(b"x" * 60))
+    assert store.read_bytes("small.txt") == b"x" * 60 and len(blob_files(store)) == 1
+
+
+@pytest.mark.parametrize("codec", [
+    "gzip",
+    pytest.param("zstd", marks=pytest.mark.skipif(upload_store.zstandard is None, reason="zstandard is not installed")),
+])
+def test_codec_round_trip(tmp_path, codec):
+    store = upload_store.UploadStore(str(tmp_path), codec=codec, chunk_size=1000)
+    store.save("note.txt", io.BytesIO(NOTE))
+    [doc] = store.list()
+    assert doc["codec"] == codec and doc["stored_size"] < doc["size"] == len(NOTE)
+    assert blob_files(store)[0].endswith(upload_store.CODEC_SUFFIXES[codec])
+    assert store.read_bytes("note.txt") == NOTE
+
+
+def test_compressed_formats_are_stored_as_is(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path), codec="gzip")
+    store.save("scan.pdf", io.BytesIO(b"%PDF-1.7 " + NOTE))
+    store.save("scan.bin", io.BytesIO(b"%PDF-1.7 " + NOTE[:100]))
+    assert {doc["name"]: doc["codec"] for doc in store.list()} == {"scan.pdf": "", "scan.bin": ""}
+
+
+def test_stores_read_blobs_of_any_codec(tmp_path):
+    gzipped = upload_store.UploadStore(str(tmp_path), codec="gzip")
+    gzipped.save("old.txt", io.BytesIO(NOTE))
+    plain = upload_store.UploadStore(str(tmp_path))
+    plain.save("new.txt", io.BytesIO(b"plain " + NOTE))
+    # Content already stored compressed is reused rather than written again
+    plain.save("copy.txt", io.BytesIO(NOTE))
+    codecs = {doc["name"]: doc["codec"] for doc in plain.list()}
+    assert codecs == {"copy.txt": "gzip", "new.txt": "", "old.txt": "gzip"}
+    assert plain.read_bytes("old.txt") == plain.read_bytes("copy.txt") == NOTE
+    assert gzipped.read_bytes("new.txt") == b"plain " + NOTE
+
+
+def test_unknown_codec_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        upload_store.UploadStore(str(tmp_path), codec="lz4")
+
+
+def test_old_catalog_is_migrated(tmp_path):
+    root = str(tmp_path)
+    sha256 = upload_store.UploadStore(root).store(io.BytesIO(NOTE))
+    os.remove(os.path.join(root, upload_store.INDEX_FILE))
+    conn = sqlite3.connect(os.path.join(root, upload_store.INDEX_FILE))
+    with conn:
+        conn.execute("CREATE TABLE documents (name TEXT PRIMARY KEY, sha256 TEXT NOT NULL, created REAL NOT NULL)")
+        conn.execute("INSERT INTO documents VALUES ('note.txt', ?, 1000.0)", (sha256,))
+    conn.close()
+
+    store = upload_store.UploadStore(root)
+    [doc] = store.list()
+    assert (doc["size"], doc["mime"], doc["modified"], doc["codec"], doc["stored_size"]) == (
+        len(NOTE), "text/plain", 1000.0, "", len(NOTE)
+    )
+    assert store.lru() == [(1000.0, "note.txt", len(NOTE))]
+    assert store.read_bytes("note.txt") == NOTE
+
+
+def test_loose_files_are_imported(tmp_path):
+    (tmp_path / "loose.txt").write_bytes(b"from before the catalog")
+    store = upload_store.UploadStore(str(tmp_path))
+    assert store.read_bytes("loose.txt") == b"from before the catalog"
+    assert not (tmp_path / "loose.txt").exists()
+
+
+HOLD_LOCK = """
+import sys, time
+import upload_store
+store = upload_store.UploadStore(sys.argv[1])
+with store._locked():
+    open(sys.argv[2], "w").close()
+    time.sleep(float(sys.argv[3]))
+"""
+
+
+@pytest.mark.skipif(upload_store.fcntl is None, reason="needs fcntl for the cross-process lock")
+def test_lock_is_held_across_processes(tmp_path):
+    root, held = str(tmp_path / "store"), str(tmp_path / "held")
+    store = upload_store.UploadStore(root)
+    child = subprocess.Popen([sys.executable, "-c", HOLD_LOCK, root, held, "0.5"], cwd=REPO_ROOT)
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(held):
+            assert child.poll() is None and time.monotonic() < deadline
+            time.sleep(0.01)
+        start = time.monotonic()
+        store.save("a.txt", io.BytesIO(b"waits for the other process"))
+        assert time.monotonic() - start > 0.3
+    finally:
+        child.wait(30)
+    assert child.returncode == 0
+    assert store.read_bytes("a.txt") == b"waits for the other process"
+
+
+def test_concurrent_save_and_delete_keep_the_blob(tmp_path):
+    store = upload_store.UploadStore(str(tmp_path))
+    errors = []
+
+    def churn(name):
+        try:
+            for _ in range(20):
+                store.save(name, io.BytesIO(NOTE))
+                store.delete(name)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=churn, args=(f"{i}.txt",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    store.save("last.txt", io.BytesIO(NOTE))
+    assert store.read_bytes("last.txt") == NOTE
+
+
+def test_sweeper_expires_idle_documents(tmp_path):
+    base = str(tmp_path)
+    store = upload_store.UploadStore(upload_store.namespace_dir(base, "user-a"))
+    store.save("old.txt", io.BytesIO(b"old"))
+    store.save("fresh.txt", io.BytesIO(b"fresh"))
+    set_accessed(store, "old.txt", 1000.0)
+    set_accessed(store, "fresh.txt", 1900.0)
+    evicted = []
+    sweeper = upload_store.Sweeper(base, ttl_seconds=500, on_evict=lambda root, names: evicted.append((root, names)))
+    assert sweeper.sweep(now=2000.0) == {store.root: ["old.txt"]}
+    assert evicted == [(store.root, ["old.txt"])] and sweeper.evicted == 1
+    assert [doc["name"] for doc in store.list()] == ["fresh.txt"]
+
+
+def test_sweeper_evicts_least_recently_used_across_namespaces(tmp_path):
+    base = str(tmp_path)
+    a = upload_store.UploadStore(upload_store.namespace_dir(base, "user-a"))
+    b = upload_store.UploadStore(upload_store.namespace_dir(base, "user-b"))
+    for store, name, accessed in ((a, "a1.txt", 10.0), (b, "b1.txt", 20.0), (a, "a2.txt", 30.0), (b, "b2.txt", 40.0)):
+        store.save(name, io.BytesIO(name.encode() * 25))  # 150 bytes each
+        set_accessed(store, name, accessed)
+    sweeper = upload_store.Sweeper(base, max_total_bytes=300)
+    assert sweeper.sweep(now=50.0) == {a.root: ["a1.txt"], b.root: ["b1.txt"]}
+    assert a.usage() + b.usage() == 300
+
+
+def test_sweeper_removes_empty_session_namespaces_only(tmp_path):
+    base = str(tmp_path)
+    session = upload_store.UploadStore(upload_store.namespace_dir(base, "session-1"))
+    user = upload_store.UploadStore(upload_store.namespace_dir(base, "user-1"))
+    upload_store.Sweeper(base, ttl_seconds=60).sweep(now=time.time() + 120)
+    assert not os.path.exists(session.root) and os.path.exists(user.root)
+
+
+def test_sweeper_covers_the_legacy_shared_catalog(tmp_path):
+    base = str(tmp_path)
+    legacy = upload_store.UploadStore(base)
+    legacy.save("shared.txt", io.BytesIO(NOTE))
+    set_accessed(legacy, "shared.txt", 1000.0)
+    upload_store.UploadStore(upload_store.namespace_dir(base, "user-a")).save("mine.txt", io.BytesIO(b"mine"))
+    assert upload_store.Sweeper(base, ttl_seconds=500).sweep(now=2000.0) == {base: ["shared.txt"]}
+    assert legacy.count() == 0
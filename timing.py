@@ -0,0 +1,205 @@
+"""
+Lightweight timing spans for the app's hot paths.
+
+    with timing.span("gemini", call="extract"):
+        ...
+
+    @timing.timed("tab", tab="sofa")
+    def render_sofa_tab():
+        ...
+
+Every finished span is folded into a per-process histogram keyed by span
+name and labels (fixed buckets plus the most recent samples for
+percentiles), which costs a lock and a few additions. `prometheus_text()`
+renders the histograms in the Prometheus text format and `serve(port)`
+exposes them at /metrics (and a JSON summary at /metrics.json). When the
+TIMING_LOG environment variable names a file, each span is also appended
+to it as one JSON line.
+
+Metrics are per process: with several server processes, scrape or log
+each of them.
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; covers sub-millisecond file operations up to slow model calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RECENT_SAMPLES = 2048
+
+
+def percentile(sorted_samples, p):
+    """Nearest-rank `p`th percentile (0-100) of already sorted samples; 0.0 when there are none."""
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(p / 100 * len(sorted_samples)))]
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum", "max", "errors", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds, error=False):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.errors += error
+        self.recent.append(seconds)
+
+    def percentile(self, p):
+        return percentile(sorted(self.recent), p)
+
+
+class Registry:
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.log_path = log_path
+        self.log_file = None
+
+    def observe(self, name, seconds, error=False, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds, error)
+            if self.log_path:
+                self._log(dict(labels, ts=round(time.time(), 3), span=name, seconds=round(seconds, 6), error=error, pid=os.getpid()))
+
+    def _log(self, record):
+        if self.log_file is None:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Line-buffered appends, so lines from several processes do not interleave
+            self.log_file = open(self.log_path, "a", buffering=1, encoding="utf-8")
+        self.log_file.write(json.dumps(record, default=str) + "\n")
+
+    def snapshot(self):
+        """One dict per span name and label set: count, errors, mean/p50/p95/p99/max in milliseconds."""
+        with self.lock:
+            items = [(name, labels, histogram) for (name, labels), histogram in self.histograms.items()]
+            rows = []
+            for name, labels, h in sorted(items, key=lambda item: item[:2]):
+                rows.append(dict(
+                    labels, span=name, count=h.count, errors=h.errors,
+                    mean_ms=h.sum / h.count * 1000 if h.count else 0.0,
+                    p50_ms=h.percentile(50) * 1000, p95_ms=h.percentile(95) * 1000,
+                    p99_ms=h.percentile(99) * 1000, max_ms=h.max * 1000,
+                ))
+        return rows
+
+    def prometheus_text(self, prefix="app"):
+        metric = f"{prefix}_span_seconds"
+        lines = [
+            f"# HELP {metric} Duration of instrumented operations.",
+            f"# TYPE {metric} histogram",
+        ]
+        errors = [
+            f"# HELP {prefix}_span_errors_total Instrumented operations that raised.",
+            f"# TYPE {prefix}_span_errors_total counter",
+        ]
+        with self.lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                base = [("span", name)] + list(labels)
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.buckets):
+                    cumulative += n
+                    lines.append(f"{metric}_bucket{_labels(base + [('le', repr(bound))])} {cumulative}")
+                lines.append(f"{metric}_bucket{_labels(base + [('le', '+Inf')])} {h.count}")
+                lines.append(f"{metric}_sum{_labels(base)} {h.sum:.6f}")
+                lines.append(f"{metric}_count{_labels(base)} {h.count}")
+                errors.append(f"{prefix}_span_errors_total{_labels(base)} {h.errors}")
+        return "\n".join(lines + errors) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+def _labels(pairs):
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+REGISTRY = Registry(os.environ.get("TIMING_LOG") or None)
+
+
+def observe(name, seconds, **labels):
+    REGISTRY.observe(name, seconds, **labels)
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - started, error, **labels)
+
+
+def timed(name, **labels):
+    """Decorator form of `span`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+def prometheus_text(prefix="app"):
+    return REGISTRY.prometheus_text(prefix)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Expose this process's metrics over HTTP from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,515 @@
+"""
+Content-addressed storage for uploaded documents.
+
+Blobs are named by the SHA-256 of their bytes and live under
+`<root>/.blobs/<first two hex chars>/<hash>`; a small SQLite catalog maps
+each document name to its hash along with its size, MIME type and
+timestamps, so listing documents never touches the blobs themselves.
+
+Saving copies the upload in fixed-size chunks through a temporary file that
+is renamed into place, so a crash never leaves a half-written blob, and
+content that is already stored (a rerun, a re-upload, or the same document
+under another name) costs no disk writes.
+
+Each user or session gets its own store under `<base>/<namespace>`, with an
+optional byte quota. Saves and deletes hold a per-store lock (a thread lock
+plus an advisory file lock, so other server processes are covered too), and
+`Sweeper` periodically evicts documents that have not been accessed within
+a TTL and, past a global byte budget, the least recently used ones.
+
+Blobs can be compressed with an optional codec (gzip, or zstd when the
+`zstandard` package is installed). Compression happens chunk by chunk while
+the upload is copied and reads decompress as they go, so neither side holds
+a whole file in memory. The SHA-256 is always of the original bytes, and
+content that is already compressed (PDF, JPEG, PNG, ZIP/DOCX...) is stored
+as is.
+"""
+import contextlib
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import timing
+
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock still covers a single server process
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+SORT_COLUMNS = ("name", "size", "modified", "mime")
+BLOB_DIR = ".blobs"
+INDEX_FILE = ".index.sqlite3"
+LOCK_FILE = ".lock"
+
+CODEC_SUFFIXES = {"": "", "gzip": ".gz", "zstd": ".zst"}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Formats that are compressed already; recompressing them only costs CPU
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst",
+    ".7z", ".rar", ".docx", ".xlsx", ".pptx", ".odt", ".mp3", ".mp4", ".m4a", ".mov", ".avi", ".webm",
+}
+INCOMPRESSIBLE_MAGIC = (
+    b"%PDF", b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"PK\x03\x04", b"\x1f\x8b", b"(\xb5/\xfd",
+    b"BZh", b"\xfd7zXZ", b"7z\xbc\xaf", b"Rar!",
+)
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def guess_mime(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def available_codecs():
+    return ["gzip", "zstd"] if zstandard is not None else ["gzip"]
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def _compressing_writer(codec, fileobj):
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fileobj, closefd=False)
+    raise ValueError(f"unknown codec {codec!r}")
+
+
+def open_blob(path, codec=""):
+    """Open a stored blob for reading, decompressing on the fly."""
+    if not codec:
+        return open(path, "rb")
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("this blob is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    raise ValueError(f"unknown codec {codec!r}")
+
+
+def namespace_dir(base, namespace):
+    # Keep namespace names safe to use as a single directory name
+    return os.path.join(base, re.sub(r"[^A-Za-z0-9_.-]", "_", namespace).lstrip("."))
+
+
+def list_namespaces(base):
+    if not os.path.isdir(base):
+        return []
+    return sorted(
+        entry.path for entry in os.scandir(base)
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, INDEX_FILE))
+    )
+
+
+def has_legacy_catalog(base):
+    # Before namespaces, every upload went into one shared store at the base itself
+    # (and before that, as loose files straight into the directory)
+    if not os.path.isdir(base):
+        return False
+    if os.path.exists(os.path.join(base, INDEX_FILE)):
+        return True
+    return any(entry.is_file() and not entry.name.startswith(".") for entry in os.scandir(base))
+
+
+class UploadStore:
+    def __init__(self, root="uploads", chunk_size=CHUNK_SIZE, quota_bytes=None, codec=None):
+        if codec and codec not in available_codecs():
+            raise ValueError(f"codec {codec!r} is not available (have: {', '.join(available_codecs())})")
+        self.root = root
+        self.chunk_size = chunk_size
+        self.quota_bytes = quota_bytes
+        self.codec = codec or ""
+        self.blob_root = os.path.join(root, BLOB_DIR)
+        self.index_path = os.path.join(root, INDEX_FILE)
+        os.makedirs(self.blob_root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " name TEXT PRIMARY KEY, sha256 TEXT NOT NULL, created REAL NOT NULL,"
+                " size INTEGER NOT NULL DEFAULT 0, mime TEXT NOT NULL DEFAULT '', modified REAL NOT NULL DEFAULT 0,"
+                " accessed REAL NOT NULL DEFAULT 0, codec TEXT NOT NULL DEFAULT '', stored_size INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._migrate(conn)
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_size ON documents (size)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_modified ON documents (modified)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_mime ON documents (mime)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_accessed ON documents (accessed)")
+        self._import_loose_files()
+
+    def _migrate(self, conn):
+        # Catalogs created before the metadata columns existed
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+        for column, ddl in (
+            ("size", "INTEGER NOT NULL DEFAULT 0"), ("mime", "TEXT NOT NULL DEFAULT ''"),
+            ("modified", "REAL NOT NULL DEFAULT 0"), ("accessed", "REAL NOT NULL DEFAULT 0"),
+            ("codec", "TEXT NOT NULL DEFAULT ''"), ("stored_size", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {ddl}")
+        if "size" not in columns:
+            for name, sha256, created in conn.execute("SELECT name, sha256, created FROM documents").fetchall():
+                path = self.blob_path(sha256)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                conn.execute(
+                    "UPDATE documents SET size = ?, mime = ?, modified = ? WHERE name = ?",
+                    (size, guess_mime(name), created, name)
+                )
+        if "accessed" not in columns:
+            # After `modified` is filled in, or the oldest catalogs would look idle since 1970
+            conn.execute("UPDATE documents SET accessed = modified")
+        if "stored_size" not in columns:
+            # Every blob written before codecs existed is stored uncompressed
+            conn.execute("UPDATE documents SET stored_size = size")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Serializes saves and deletes, so a delete can never remove a blob that
+        # a concurrent save has just found already stored and is about to reference
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(os.path.abspath(self.root), threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, LOCK_FILE), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def blob_path(self, sha256, codec=""):
+        return os.path.join(self.blob_root, sha256[:2], sha256 + CODEC_SUFFIXES[codec])
+
+    def locate(self, sha256):
+        """(path, codec) of the stored blob for `sha256`, or None if it is not stored."""
+        for codec in CODEC_SUFFIXES:
+            path = self.blob_path(sha256, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def _codec_for(self, name):
+        if not self.codec or (name and os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS):
+            return ""
+        return self.codec
+
+    def _hash(self, fileobj):
+        hasher = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: fileobj.read(self.chunk_size), b""):
+            hasher.update(chunk)
+            size += len(chunk)
+        return hasher.hexdigest(), size
+
+    def _write_blob(self, fileobj, codec=""):
+        # Copy in chunks to a temp file in the blob directory, hashing (and
+        # compressing) as we go, then rename it into place (a no-op if the
+        # content is already stored).
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                chunk = fileobj.read(self.chunk_size)
+                if codec and chunk.startswith(INCOMPRESSIBLE_MAGIC):
+                    codec = ""
+                out = _compressing_writer(codec, tmp) if codec else tmp
+                while chunk:
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+                    chunk = fileobj.read(self.chunk_size)
+                if out is not tmp:
+                    out.close()  # flushes the codec trailer; leaves tmp open
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            sha256 = hasher.hexdigest()
+            if self.locate(sha256) is not None:
+                os.remove(tmp_path)
+            else:
+                path = self.blob_path(sha256, codec)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return sha256, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _store(self, fileobj, name=None):
+        if fileobj.seekable():
+            # Hash first so duplicate content never touches the disk
+            start = fileobj.tell()
+            sha256, size = self._hash(fileobj)
+            if self.locate(sha256) is not None:
+                return sha256, size
+            fileobj.seek(start)
+        return self._write_blob(fileobj, self._codec_for(name))
+
+    @timing.timed("file", op="store")
+    def store(self, fileobj, name=None):
+        """
+        Store the bytes of a binary file object and return their SHA-256.
+        `name` is only used to skip compression for already-compressed formats.
+        """
+        return self._store(fileobj, name)[0]
+
+    def _unique_name(self, conn, name, sha256):
+        # Keep both documents when different content arrives under an existing name
+        base, ext = os.path.splitext(name)
+        candidate = name
+        n = 1
+        while True:
+            row = conn.execute("SELECT sha256 FROM documents WHERE name = ?", (candidate,)).fetchone()
+            if row is None or row[0] == sha256:
+                return candidate, row is not None
+            n += 1
+            candidate = f"{base} ({n}){ext}"
+
+    @timing.timed("file", op="save")
+    def save(self, name, fileobj):
+        """
+        Store an upload under `name` and return (stored_name, sha256, is_new).
+
+        Re-saving identical content under the same name is a no-op; different
+        content under a taken name is stored as "name (2).ext" and so on.
+        Raises QuotaExceeded if a new document would take the store over its
+        byte quota.
+        """
+        name = os.path.basename(name)
+        with self._locked():
+            sha256, size = self._store(fileobj, name)
+            path, codec = self.locate(sha256)
+            with self._connect() as conn:
+                stored_name, exists = self._unique_name(conn, name, sha256)
+                now = time.time()
+                if exists:
+                    conn.execute("UPDATE documents SET accessed = ? WHERE name = ?", (now, stored_name))
+                else:
+                    used = conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+                    if self.quota_bytes is not None and used + size > self.quota_bytes:
+                        self._remove_unused_blob(conn, sha256)
+                        raise QuotaExceeded(
+                            f"{name} ({size:,} bytes) does not fit: {used:,} of {self.quota_bytes:,} bytes already used"
+                        )
+                    conn.execute(
+                        "INSERT INTO documents (name, sha256, created, size, mime, modified, accessed, codec, stored_size)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (stored_name, sha256, now, size, guess_mime(stored_name), now, now, codec, os.path.getsize(path))
+                    )
+        return stored_name, sha256, not exists
+
+    @timing.timed("file", op="stats")
+    def storage_stats(self):
+        """
+        Document bytes before and after deduplication and compression:
+        `bytes` (all documents), `unique_bytes` (distinct contents) and
+        `stored_bytes` (what the blobs take on disk).
+        """
+        with self._connect() as conn:
+            documents, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+            unique, stored = conn.execute(
+                "SELECT COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0)"
+                " FROM (SELECT sha256, MAX(size) AS size, MAX(stored_size) AS stored_size FROM documents GROUP BY sha256)"
+            ).fetchone()
+        return {"documents": documents, "bytes": total, "unique_bytes": unique, "stored_bytes": stored}
+
+    def usage(self):
+        """Total size in bytes of the stored documents (what the quota is checked against)."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    @timing.timed("file", op="list")
+    def list(self, offset=0, limit=None, sort="name", descending=False):
+        """
+        Return one page of catalog rows as dicts with name, sha256, size,
+        mime, modified, codec and stored_size keys, sorted by one of
+        SORT_COLUMNS.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"cannot sort documents by {sort!r}")
+        order = "DESC" if descending else "ASC"
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT name, sha256, size, mime, modified, codec, stored_size FROM documents ORDER BY {sort} {order}, name LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def lookup(self, name):
+        with self._connect() as conn:
+            row = conn.execute("SELECT sha256 FROM documents WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    @timing.timed("file", op="open")
+    def open(self, name):
+        """Open a document for reading; compressed blobs are decompressed as they are read."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT sha256, codec FROM documents WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE documents SET accessed = ? WHERE name = ?", (time.time(), name))
+        if row is None:
+            raise FileNotFoundError(name)
+        return open_blob(self.blob_path(*row), row[1])
+
+    @timing.timed("file", op="read")
+    def read_bytes(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def _remove_unused_blob(self, conn, sha256):
+        # The blob is only removed once no document name refers to it
+        if not conn.execute("SELECT 1 FROM documents WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+            location = self.locate(sha256)
+            if location is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(location[0])
+
+    @timing.timed("file", op="delete")
+    def delete(self, name):
+        with self._locked(), self._connect() as conn:
+            row = conn.execute("SELECT sha256 FROM documents WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM documents WHERE name = ?", (name,))
+            self._remove_unused_blob(conn, row[0])
+
+    def lru(self, limit=None):
+        """(accessed, name, size) rows, least recently used first."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT accessed, name, size FROM documents ORDER BY accessed, name LIMIT ?", (-1 if limit is None else limit,)
+            ).fetchall()
+
+    @timing.timed("file", op="expire")
+    def expire(self, max_idle_seconds, now=None):
+        """Delete documents not saved or opened within `max_idle_seconds`; returns their names."""
+        cutoff = (now or time.time()) - max_idle_seconds
+        with self._connect() as conn:
+            names = [row[0] for row in conn.execute("SELECT name FROM documents WHERE accessed < ?", (cutoff,))]
+        for name in names:
+            self.delete(name)
+        return names
+
+    def _import_loose_files(self):
+        # Files written directly to the upload directory by earlier versions of the app
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.startswith("."):
+                with open(entry.path, "rb") as f:
+                    self.save(entry.name, f)
+                os.remove(entry.path)
+
+
+class Sweeper(threading.Thread):
+    """
+    Background eviction over every namespace under `base`.
+
+    Each pass deletes documents idle for more than `ttl_seconds`, then, while
+    the namespaces together hold more than `max_total_bytes`, the least
+    recently used documents across all of them. Session namespaces
+    (`session_prefix`) left empty for a whole TTL are removed entirely.
+    The shared catalog that earlier versions kept at `base` itself has no
+    owner to list it, so it is swept (and counted) like any namespace until
+    it empties out.
+    `on_evict(root, names)` is called for every namespace that lost
+    documents, so derived data (search index, job results) can follow.
+    """
+
+    def __init__(self, base, ttl_seconds=None, max_total_bytes=None, interval=300, on_evict=None, session_prefix="session-"):
+        super().__init__(name="upload-sweeper", daemon=True)
+        self.base = base
+        self.ttl_seconds = ttl_seconds
+        self.max_total_bytes = max_total_bytes
+        self.interval = interval
+        self.on_evict = on_evict
+        self.session_prefix = session_prefix
+        self.stopped = threading.Event()
+        self.last_run = None
+        self.evicted = 0
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        evicted = {}
+        roots = list_namespaces(self.base)
+        if has_legacy_catalog(self.base):
+            roots.append(self.base)
+        stores = [UploadStore(root) for root in roots]
+
+        if self.ttl_seconds:
+            for store in stores:
+                names = store.expire(self.ttl_seconds, now)
+                if names:
+                    evicted.setdefault(store.root, []).extend(names)
+
+        if self.max_total_bytes is not None:
+            candidates = sorted((row + (store,) for store in stores for row in store.lru()), key=lambda row: row[:2])
+            total = sum(size for _, _, size, _ in candidates)
+            for _, name, size, store in candidates:
+                if total <= self.max_total_bytes:
+                    break
+                store.delete(name)
+                evicted.setdefault(store.root, []).append(name)
+                total -= size
+
+        for root, names in evicted.items():
+            if self.on_evict is not None:
+                self.on_evict(root, names)
+
+        if self.ttl_seconds:
+            for store in stores:
+                index_age = now - os.path.getmtime(store.index_path)
+                if os.path.basename(store.root).startswith(self.session_prefix) and index_age > self.ttl_seconds and not store.count():
+                    shutil.rmtree(store.root, ignore_errors=True)
+
+        self.last_run = now
+        self.evicted += sum(len(names) for names in evicted.values())
+        return evicted
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                # A failed pass (e.g. a namespace removed mid-sweep) is retried on the next one
+                pass
+
+    def stop(self):
+        self.stopped.set()